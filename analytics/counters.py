@@ -0,0 +1,274 @@
+# coding:utf-8
+
+"""
+直播间实时滑动窗口计数
+
+每个窗口由预分配的环形数组实现，写入和查询都是O(1)(过期槽位随时间推进惰性清零)。
+默认窗口: 1s / 1m / 5m / 1h
+
+指标:
+    chat      弹幕条数(含表情弹幕)
+    chatters  发言人数(窗口内去重)
+    likes     点赞数(LikeMessage.count)
+    diamonds  礼物钻石数(GiftStruct.diamond_count × combo_count，连击礼物只累计增量)
+    follows   关注数
+    entries   进场人数
+"""
+
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+from checkpoint import pack_floats, unpack_floats
+
+# 窗口名 -> (窗口秒数, 槽位数)
+WINDOWS = {
+    '1s': (1, 10),
+    '1m': (60, 60),
+    '5m': (300, 60),
+    '1h': (3600, 60),
+}
+
+METRICS = ('chat', 'chatters', 'likes', 'diamonds', 'follows', 'entries')
+
+
+class ComboTracker:
+
+    def __init__(self, max_groups=10000):
+        """
+        连击礼物计数: 每条连击消息带的是累计连击数，只返回新增部分
+        :param max_groups: 最多记住多少个连击组
+        """
+        self.max_groups = max_groups
+        self._combos = OrderedDict()
+
+    def diamonds(self, event):
+        """
+        :return: 这条礼物事件新增的钻石数
+        """
+        combo_count = max(event['combo_count'], 1)
+        if not event['combo']:
+            return event['diamond_count'] * combo_count
+        key = (event['group_id'] or event['trace_id'], event['user_id'], event['gift_id'])
+        counted = self._combos.pop(key, 0)
+        self._combos[key] = max(counted, combo_count)
+        if len(self._combos) > self.max_groups:
+            self._combos.popitem(last=False)
+        return event['diamond_count'] * max(0, combo_count - counted)
+
+    def to_state(self):
+        return [[list(key), count] for key, count in self._combos.items()]
+
+    def load_state(self, state):
+        self._combos = OrderedDict((tuple(key), count) for key, count in state)
+
+
+class RingCounter:
+    __slots__ = ('seconds', 'resolution', 'size', '_values', '_total', '_head')
+
+    def __init__(self, seconds, slots):
+        """
+        :param seconds: 窗口长度(秒)
+        :param slots: 槽位数，决定时间精度 seconds/slots
+        """
+        self.seconds = seconds
+        self.resolution = seconds / slots
+        self.size = slots
+        self._values = array('d', bytes(8 * slots))
+        self._total = 0.0
+        self._head = 0
+
+    def _advance(self, epoch):
+        if epoch <= self._head:
+            return
+        # 清除已滑出窗口的槽位，最多清一整圈
+        start = max(self._head + 1, epoch - self.size + 1)
+        for e in range(start, epoch + 1):
+            slot = e % self.size
+            self._total -= self._values[slot]
+            self._values[slot] = 0.0
+        self._head = epoch
+
+    def add(self, value=1.0, now=None):
+        now = time.time() if now is None else now
+        epoch = int(now / self.resolution)
+        self._advance(epoch)
+        if epoch <= self._head - self.size:
+            return
+        slot = epoch % self.size
+        self._values[slot] += value
+        self._total += value
+
+    def to_state(self):
+        return [self._head, self._total, self._values.tolist()]
+
+    def load_state(self, state):
+        head, total, values = state
+        if len(values) == self.size:
+            self._head = head
+            self._total = total
+            self._values = array('d', values)
+
+    def total(self, now=None):
+        now = time.time() if now is None else now
+        self._advance(int(now / self.resolution))
+        return self._total
+
+
+class UniqueCounter:
+    __slots__ = ('seconds', '_last_seen')
+
+    def __init__(self, seconds):
+        """窗口内去重计数，内存只与窗口内的不同用户数有关"""
+        self.seconds = seconds
+        self._last_seen = OrderedDict()
+
+    def add(self, key, now=None):
+        now = time.time() if now is None else now
+        self._last_seen[key] = now
+        self._last_seen.move_to_end(key)
+        self._expire(now)
+
+    def _expire(self, now):
+        last_seen = self._last_seen
+        while last_seen:
+            key, seen = next(iter(last_seen.items()))
+            if now - seen < self.seconds:
+                break
+            del last_seen[key]
+
+    def total(self, now=None):
+        self._expire(time.time() if now is None else now)
+        return len(self._last_seen)
+
+    def to_state(self):
+        return [list(self._last_seen), pack_floats(self._last_seen.values())]
+
+    def load_state(self, state, now=None):
+        """恢复检查点，可以用更长窗口的状态恢复(只保留窗口内的部分)"""
+        now = time.time() if now is None else now
+        keys, seen = state
+        self._last_seen = OrderedDict((key, t) for key, t in zip(keys, unpack_floats(seen))
+                                      if now - t < self.seconds)
+
+
+class RoomCounters:
+
+    def __init__(self, windows=None, combo_groups=10000):
+        """
+        :param windows: 窗口定义，默认为 WINDOWS
+        :param combo_groups: 最多记住多少个连击礼物组的已计数连击数
+        """
+        self.windows = windows or WINDOWS
+        self._counters = {metric: {name: RingCounter(*spec) for name, spec in self.windows.items()}
+                          for metric in METRICS if metric != 'chatters'}
+        self._chatters = {name: UniqueCounter(seconds) for name, (seconds, _) in self.windows.items()}
+        self._combos = ComboTracker(combo_groups)
+        self._lock = threading.Lock()
+
+    def _add(self, metric, value, now):
+        for counter in self._counters[metric].values():
+            counter.add(value, now)
+
+    def update(self, event, now=None):
+        now = time.time() if now is None else now
+        event_type = event['type']
+        with self._lock:
+            if event_type in ('chat', 'emoji_chat'):
+                self._add('chat', 1, now)
+                for counter in self._chatters.values():
+                    counter.add(event['user_id'], now)
+            elif event_type in ('like', 'like_summary'):
+                self._add('likes', event['count'], now)
+            elif event_type == 'gift':
+                self._add('diamonds', self._combos.diamonds(event), now)
+            elif event_type == 'social':
+                self._add('follows', 1, now)
+            elif event_type == 'member':
+                self._add('entries', 1, now)
+            elif event_type == 'member_summary':
+                self._add('entries', event['count'], now)
+
+    def snapshot(self, now=None):
+        """
+        :return: {指标: {窗口: 窗口内累计值}}，除以窗口秒数即为每秒速率
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            result = {metric: {name: counter.total(now) for name, counter in counters.items()}
+                      for metric, counters in self._counters.items()}
+            result['chatters'] = {name: counter.total(now) for name, counter in self._chatters.items()}
+        return result
+
+    def to_state(self):
+        with self._lock:
+            return {
+                'counters': {metric: {name: counter.to_state() for name, counter in counters.items()}
+                             for metric, counters in self._counters.items()},
+                # 每次发言同时写入所有窗口，最长窗口包含了其他窗口的全部内容
+                'chatters': max(self._chatters.values(), key=lambda counter: counter.seconds).to_state(),
+                'combos': self._combos.to_state(),
+            }
+
+    def load_state(self, state):
+        """恢复检查点，窗口定义变化后不存在的窗口被忽略"""
+        with self._lock:
+            for metric, counters in state['counters'].items():
+                for name, counter_state in counters.items():
+                    counter = self._counters.get(metric, {}).get(name)
+                    if counter is not None:
+                        counter.load_state(counter_state)
+            now = time.time()
+            for counter in self._chatters.values():
+                counter.load_state(state['chatters'], now)
+            self._combos.load_state(state['combos'])
+
+
+class MetricsEngine:
+
+    def __init__(self, windows=None):
+        """
+        多直播间实时计数，作为sink使用: DouyinLiveWebFetcher(sinks=[engine])
+        :param windows: 窗口定义，默认为 WINDOWS
+        """
+        self.windows = windows or WINDOWS
+        self._rooms = {}
+        self._lock = threading.Lock()
+
+    def room(self, room_id):
+        counters = self._rooms.get(room_id)
+        if counters is None:
+            with self._lock:
+                counters = self._rooms.setdefault(room_id, RoomCounters(self.windows))
+        return counters
+
+    def write(self, event):
+        self.room(event['room_id']).update(event)
+
+    def rooms(self):
+        return list(self._rooms)
+
+    def snapshot(self, room_id):
+        """单个直播间的全部指标"""
+        return self.room(room_id).snapshot()
+
+    def rate(self, room_id, metric, window='1m'):
+        """
+        :return: 指标在窗口内的每秒速率
+        """
+        value = self.room(room_id).snapshot()[metric][window]
+        return value / self.windows[window][0]
+
+    def dump_room(self, room_id):
+        """检查点: 单个直播间的计数状态"""
+        counters = self._rooms.get(room_id)
+        return counters.to_state() if counters else None
+
+    def load_room(self, room_id, state):
+        self.room(room_id).load_state(state)
+
+    def snapshot_all(self):
+        """所有直播间的指标，供看板批量轮询"""
+        now = time.time()
+        return {room_id: counters.snapshot(now) for room_id, counters in list(self._rooms.items())}
@@ -0,0 +1,326 @@
+# coding:utf-8
+
+"""
+直播间人数与互动速率的历史曲线(RRD式存储)
+
+每个直播间按多个精度保存，每个精度是预分配的环形数组，写入时同时累加到各精度的当前桶，
+相当于写入时即完成降采样；内存只与槽位数有关，与直播时长无关。
+默认精度: 1秒×1小时 / 10秒×24小时 / 2分钟×7天
+
+指标:
+    total                在线人数(RoomUserSeqMessage.total)，桶内取平均
+    total_pv_for_anchor  累计观看人次(RoomUserSeqMessage.total_pv_for_anchor，"1.2万"等文本换算为数字)，桶内取平均
+    display_value        直播间显示人数(RoomStatsMessage.display_value)，桶内取平均
+    likes                点赞速率(次/秒)
+    diamonds             礼物速率(钻石/秒，连击礼物只累计增量)
+
+人数类指标的状态消息内容不变时不会输出事件(skip_unchanged)，没有样本的桶沿用之前最近一个桶的值，
+曲线在人数不变期间保持水平而不是断开；开始记录之前的桶仍为None。
+
+    history = History()
+    fetcher = DouyinLiveWebFetcher(live_id, sinks=[history])
+    start, resolution, values = history.series(room_id, 'total', seconds=6 * 3600, points=800)
+"""
+
+import threading
+import time
+from array import array
+
+from analytics.counters import ComboTracker
+
+# (桶秒数, 槽位数)，从细到粗
+RESOLUTIONS = ((1, 3600), (10, 8640), (120, 5040))
+
+# 取桶内平均值的指标
+GAUGES = ('total', 'total_pv_for_anchor', 'display_value')
+# 取桶内累计值/桶秒数的指标
+RATES = ('likes', 'diamonds')
+METRICS = GAUGES + RATES
+
+UNITS = {'万': 10000, 'w': 10000, 'W': 10000, '亿': 100000000}
+
+
+def parse_count(text):
+    """
+    :param text: 人数文本，如 "8923"、"1.2万"、"10万+"
+    :return: 数值，无法解析时为None
+    """
+    if isinstance(text, (int, float)):
+        return text
+    text = text.strip().rstrip('+').replace(',', '')
+    if not text:
+        return None
+    scale = UNITS.get(text[-1])
+    if scale:
+        text = text[:-1]
+    try:
+        return float(text) * (scale or 1)
+    except ValueError:
+        return None
+
+
+def _downsample(values, k, peak):
+    """每 k 个相邻的桶合并为一个: 取平均(peak时取最大)，没有数据的桶不参与，整组都没有时为None"""
+    merged = []
+    for i in range(0, len(values), k):
+        present = [value for value in values[i:i + k] if value is not None]
+        if not present:
+            merged.append(None)
+        else:
+            merged.append(max(present) if peak else sum(present) / len(present))
+    return merged
+
+
+class Archive:
+    """一个精度的环形数组，每个槽位记录所属的桶编号，过期的桶在写入时惰性清零"""
+    __slots__ = ('resolution', 'size', 'epochs', 'sums', 'counts', 'peaks')
+
+    def __init__(self, resolution, size):
+        """
+        :param resolution: 桶秒数
+        :param size: 槽位数，可保存 resolution*size 秒
+        """
+        self.resolution = resolution
+        self.size = size
+        self.epochs = array('q', [-1]) * size
+        self.sums = {metric: array('d', bytes(8 * size)) for metric in METRICS}
+        self.counts = {metric: array('d', bytes(8 * size)) for metric in GAUGES}
+        self.peaks = {metric: array('d', bytes(8 * size)) for metric in GAUGES}
+
+    @property
+    def span(self):
+        return self.resolution * self.size
+
+    def _slot(self, now):
+        epoch = int(now // self.resolution)
+        slot = epoch % self.size
+        held = self.epochs[slot]
+        if held == epoch:
+            return slot
+        if held > epoch:
+            # 比槽位中的桶更早的迟到数据已超出保存范围
+            return None
+        self.epochs[slot] = epoch
+        for values in self.sums.values():
+            values[slot] = 0.0
+        for metric in GAUGES:
+            self.counts[metric][slot] = 0.0
+            self.peaks[metric][slot] = 0.0
+        return slot
+
+    def add(self, metric, value, now):
+        slot = self._slot(now)
+        if slot is None:
+            return
+        self.sums[metric][slot] += value
+        if metric in self.counts:
+            self.counts[metric][slot] += 1
+            if value > self.peaks[metric][slot]:
+                self.peaks[metric][slot] = value
+
+    def _gauge(self, metric, slot, peak):
+        if peak:
+            return self.peaks[metric][slot]
+        return self.sums[metric][slot] / self.counts[metric][slot]
+
+    def _before(self, metric, epoch, peak):
+        """仍在环形数组中、早于 epoch 的最近一个有样本的桶的值，没有时为None"""
+        epochs, counts = self.epochs, self.counts[metric]
+        latest, found = -1, None
+        for slot in range(self.size):
+            held = epochs[slot]
+            if latest < held < epoch and counts[slot]:
+                latest, found = held, slot
+        return None if found is None else self._gauge(metric, found, peak)
+
+    def series(self, metric, end, points, since=None, peak=False):
+        """
+        :param end: 截止时间
+        :param points: 最多返回多少个桶
+        :param since: 开始记录的时间，之前的桶为None，之后没有数据的速率桶为0、人数类桶沿用上一个值
+        :param peak: 人数类指标返回桶内最大值而不是平均值
+        :return: (首个桶的开始时间, [值或None, ...])
+        """
+        resolution = self.resolution
+        last = int(end // resolution)
+        first = last - min(points, self.size) + 1
+        first_recorded = int(since // resolution) if since is not None else last + 1
+        epochs = self.epochs
+        size = self.size
+        values = []
+        if metric in self.counts:
+            counts = self.counts[metric]
+            carried = self._before(metric, first, peak)
+            for epoch in range(first, last + 1):
+                slot = epoch % size
+                if epochs[slot] == epoch and counts[slot]:
+                    carried = self._gauge(metric, slot, peak)
+                    values.append(carried)
+                else:
+                    values.append(carried if epoch >= first_recorded else None)
+        else:
+            sums = self.sums[metric]
+            for epoch in range(first, last + 1):
+                slot = epoch % size
+                if epochs[slot] == epoch:
+                    values.append(sums[slot] / resolution)
+                else:
+                    values.append(0.0 if epoch >= first_recorded else None)
+        return first * resolution, values
+
+
+class RoomHistory:
+
+    def __init__(self, resolutions=None, combo_groups=10000):
+        """
+        :param resolutions: 精度定义 ((桶秒数, 槽位数), ...)，默认为 RESOLUTIONS
+        :param combo_groups: 最多记住多少个连击礼物组的已计数连击数
+        """
+        self.archives = [Archive(resolution, size) for resolution, size in
+                         sorted(resolutions or RESOLUTIONS)]
+        self.started = None
+        self._combos = ComboTracker(combo_groups)
+        self._lock = threading.Lock()
+
+    def _add(self, metric, value, now):
+        for archive in self.archives:
+            archive.add(metric, value, now)
+
+    def update(self, event, now=None):
+        now = time.time() if now is None else now
+        event_type = event['type']
+        with self._lock:
+            if self.started is None:
+                self.started = now
+            if event_type == 'room_user_seq':
+                self._add('total', event['total'], now)
+                pv = parse_count(event['total_pv_for_anchor'])
+                if pv is not None:
+                    self._add('total_pv_for_anchor', pv, now)
+            elif event_type == 'room_stats':
+                if event['display_value']:
+                    self._add('display_value', event['display_value'], now)
+            elif event_type in ('like', 'like_summary'):
+                self._add('likes', event['count'], now)
+            elif event_type == 'gift':
+                self._add('diamonds', self._combos.diamonds(event), now)
+
+    def archive(self, seconds, points):
+        """
+        选择覆盖 seconds 秒且桶数不超过 points 的最细精度，都不满足时用最粗的精度(由 series 合并相邻的桶)
+        """
+        for archive in self.archives:
+            if archive.span >= seconds and seconds / archive.resolution <= points:
+                return archive
+        return self.archives[-1]
+
+    def series(self, metric, seconds=3600, points=1000, now=None, peak=False):
+        """
+        :param metric: 指标，见 METRICS
+        :param seconds: 最近多少秒
+        :param points: 最多返回多少个点(例如图表的像素宽度)
+        :return: (首个桶的开始时间, 桶秒数, [值或None, ...])，最粗精度的桶数超过 points 时
+                 每 k 个相邻的桶合并为一个点，桶秒数为 k 倍
+        """
+        if metric not in METRICS:
+            raise ValueError(f"未知的指标: {metric}")
+        now = time.time() if now is None else now
+        archive = self.archive(seconds, points)
+        count = min(int(-(-seconds // archive.resolution)), archive.size)
+        k = -(-count // max(points, 1))
+        if k > 1:
+            # 按整组取桶，组数不超过 points；超出环形数组的不完整的最早一组舍去
+            groups = -(-count // k)
+            if groups * k > archive.size:
+                groups -= 1
+            count = groups * k
+        with self._lock:
+            start, values = archive.series(metric, now, count, self.started, peak)
+        if k > 1:
+            values = _downsample(values, k, peak and metric in GAUGES)
+        return start, archive.resolution * k, values
+
+
+
+class History:
+
+    def __init__(self, resolutions=None):
+        """
+        多直播间历史曲线，作为sink使用: DouyinLiveWebFetcher(sinks=[history])
+        :param resolutions: 精度定义，默认为 RESOLUTIONS
+        """
+        self.resolutions = resolutions or RESOLUTIONS
+        self._rooms = {}
+        self._lock = threading.Lock()
+
+    def room(self, room_id):
+        history = self._rooms.get(room_id)
+        if history is None:
+            with self._lock:
+                history = self._rooms.setdefault(room_id, RoomHistory(self.resolutions))
+        return history
+
+    def write(self, event):
+        if event['type'] in ('room_user_seq', 'room_stats', 'like', 'like_summary', 'gift'):
+            self.room(event['room_id']).update(event)
+
+    def rooms(self):
+        return list(self._rooms)
+
+    def series(self, room_id, metric, seconds=3600, points=1000, now=None, peak=False):
+        """见 RoomHistory.series"""
+        return self.room(room_id).series(metric, seconds, points, now, peak)
+
+    def stats(self):
+        slots = sum(size for _, size in self.resolutions)
+        return {
+            'rooms': len(self._rooms),
+            # 每个槽位: 桶编号 + 各指标累计值 + 人数类指标的样本数和最大值
+            'bytes': len(self._rooms) * slots * 8 * (1 + len(METRICS) + 2 * len(GAUGES)),
+        }
+
+
+def benchmark(hours=2, rate=50):
+    """
+    :param hours: 模拟的直播时长
+    :param rate: 每秒事件数
+    :return: 每秒写入事件数、单次查询耗时(毫秒)
+    """
+    import random
+
+    history = History()
+    rng = random.Random(1)
+    start = 1700000000.0
+    events = int(hours * 3600 * rate)
+    begin = time.perf_counter()
+    for i in range(events):
+        now = start + i / rate
+        kind = rng.random()
+        if kind < 0.02:
+            event = {'type': 'room_user_seq', 'room_id': 1, 'total': rng.randint(1000, 5000),
+                     'total_pv_for_anchor': '12.3万'}
+        elif kind < 0.5:
+            event = {'type': 'like_summary', 'room_id': 1, 'count': rng.randint(1, 30)}
+        else:
+            event = {'type': 'gift', 'room_id': 1, 'combo': False, 'combo_count': 1,
+                     'diamond_count': rng.choice((1, 1, 10, 99))}
+        history.room(1).update(event, now)
+    written = events / (time.perf_counter() - begin)
+    end = start + events / rate
+    begin = time.perf_counter()
+    for seconds in (600, 3600, 6 * 3600, 24 * 3600):
+        history.series(1, 'total', seconds, 1000, end)
+        history.series(1, 'likes', seconds, 1000, end)
+    query = (time.perf_counter() - begin) / 8 * 1000
+    return written, query
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="历史曲线存储性能测试")
+    parser.add_argument('--hours', type=float, default=2, help="模拟的直播时长(小时)")
+    parser.add_argument('--rate', type=int, default=50, help="每秒事件数")
+    args = parser.parse_args()
+    written, query = benchmark(args.hours, args.rate)
+    print(f"写入: {written:,.0f}条/秒, 查询(≤1000点): {query:.2f}ms")
@@ -0,0 +1,281 @@
+# coding:utf-8
+
+"""
+HyperLogLog 独立观众数估计
+
+按直播间和时间桶(小时/天/周)维护HyperLogLog草图，由进场、弹幕、点赞、礼物中的 User.id 更新。
+草图可以跨直播间、跨时间桶合并，每个草图固定 2^p 字节(默认4KB，标准误差约1.6%)，
+保存时压缩。查询时优先使用覆盖范围内最粗的时间桶，200个直播间一周的去重观众数只需合并约200个草图。
+"""
+
+import base64
+import hashlib
+import math
+import os
+import struct
+import threading
+import time
+import zlib
+
+MASK64 = (1 << 64) - 1
+MAGIC = b'HLL\x01'
+
+HOUR = 3600
+DAY = 86400
+WEEK = 7 * DAY
+# 本地时区偏移，日/周桶按本地零点对齐
+_TZ_OFFSET = -time.timezone
+
+
+def hash64(value):
+    """用户ID(int)用splitmix64混淆，其他类型用blake2b"""
+    if isinstance(value, int):
+        z = (value + 0x9E3779B97F4A7C15) & MASK64
+        z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK64
+        return z ^ (z >> 31)
+    return int.from_bytes(hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class HyperLogLog:
+    __slots__ = ('p', 'm', 'registers')
+
+    def __init__(self, p=12, registers=None):
+        """
+        :param p: 精度，寄存器数 m=2^p，标准误差约 1.04/sqrt(m)
+        """
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.m)
+
+    def add(self, value):
+        x = hash64(value)
+        index = x >> (64 - self.p)
+        rest = x & ((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, values):
+        for value in values:
+            self.add(value)
+
+    def count(self):
+        m = self.m
+        registers = self.registers
+        total = math.fsum(_POWERS[r] for r in registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / total
+        zeros = registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # 小基数时用线性计数修正
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def merge(self, other):
+        """合并另一个草图(原地)，返回自身"""
+        if other.p != self.p:
+            raise ValueError("HyperLogLog精度不一致，无法合并")
+        # 寄存器值都小于128，用大整数按字节并行求max(SWAR)，比逐字节比较快两个数量级
+        a = int.from_bytes(self.registers, 'little')
+        b = int.from_bytes(other.registers, 'little')
+        high, ones = _masks(self.m)
+        ge = (((a | high) - b) & high) >> 7
+        mask = ge * 0xFF
+        merged = (a & mask) | (b & ~mask & (ones * 0xFF))
+        self.registers = bytearray(merged.to_bytes(self.m, 'little'))
+        return self
+
+    def copy(self):
+        return HyperLogLog(self.p, self.registers)
+
+    def to_bytes(self):
+        return MAGIC + struct.pack('B', self.p) + zlib.compress(bytes(self.registers))
+
+    @classmethod
+    def from_bytes(cls, data):
+        if data[:4] != MAGIC:
+            raise ValueError("不是HyperLogLog数据")
+        return cls(data[4], zlib.decompress(data[5:]))
+
+    def __len__(self):
+        return self.count()
+
+
+_POWERS = [2.0 ** -i for i in range(65)]
+_MASKS = {}
+
+
+def _masks(m):
+    """:return: (每字节0x80, 每字节0x01) 组成的m字节整数"""
+    masks = _MASKS.get(m)
+    if masks is None:
+        masks = _MASKS[m] = (int.from_bytes(b'\x80' * m, 'little'), int.from_bytes(b'\x01' * m, 'little'))
+    return masks
+
+
+def bucket_start(timestamp, granularity):
+    """
+    :param timestamp: 秒级时间戳
+    :param granularity: HOUR / DAY / WEEK
+    :return: 时间桶起点
+    """
+    timestamp = int(timestamp)
+    if granularity == HOUR:
+        return timestamp - timestamp % HOUR
+    day = timestamp - (timestamp + _TZ_OFFSET) % DAY
+    if granularity == DAY:
+        return day
+    # 1970-01-01 是周四，按周一对齐
+    weekday = ((day + _TZ_OFFSET) // DAY + 3) % 7
+    return day - weekday * DAY
+
+
+class UniqueViewers:
+
+    def __init__(self, p=12, retention=None):
+        """
+        多直播间独立观众数估计，作为sink使用: DouyinLiveWebFetcher(sinks=[viewers])
+        :param p: HyperLogLog精度
+        :param retention: 各粒度在内存中保留的时长(秒)，默认小时桶2天、天桶31天、周桶12周
+        """
+        self.p = p
+        self.retention = retention or {HOUR: 2 * DAY, DAY: 31 * DAY, WEEK: 12 * WEEK}
+        self._sketches = {}
+        self._current = {}
+        self._lock = threading.Lock()
+
+    def write(self, event):
+        user_ids = event.get('user_ids')
+        if user_ids is None:
+            user_id = event.get('user_id')
+            if not user_id:
+                return
+            user_ids = (user_id,)
+        self.add(event['room_id'], user_ids)
+
+    def add(self, room_id, user_ids, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            for granularity in self.retention:
+                sketch = self._sketch(room_id, granularity, bucket_start(timestamp, granularity))
+                sketch.update(user_ids)
+
+    def _sketch(self, room_id, granularity, start):
+        key = (room_id, granularity, start)
+        sketch = self._sketches.get(key)
+        if sketch is None:
+            sketch = self._sketches[key] = HyperLogLog(self.p)
+            # 出现新的时间桶时顺带清理过期草图
+            if self._current.get(granularity) != start:
+                self._current[granularity] = start
+                self._expire(start)
+        return sketch
+
+    def _expire(self, now):
+        for key in [key for key in self._sketches if key[2] < now - self.retention[key[1]]]:
+            del self._sketches[key]
+
+    def sketch(self, room_ids=None, start=None, end=None):
+        """
+        合并指定直播间、时间范围内的草图
+        :param room_ids: 直播间ID列表，None表示全部
+        :param start: 起始时间(秒)，None表示不限
+        :param end: 结束时间(秒)，None表示不限
+        """
+        rooms = set(room_ids) if room_ids is not None else None
+        start = float('-inf') if start is None else start
+        end = float('inf') if end is None else end
+        result = HyperLogLog(self.p)
+        with self._lock:
+            by_room = {}
+            for (room_id, granularity, bucket), sketch in self._sketches.items():
+                if rooms is None or room_id in rooms:
+                    by_room.setdefault(room_id, []).append((granularity, bucket, sketch))
+            for buckets in by_room.values():
+                for sketch in self._cover(buckets, start, end):
+                    result.merge(sketch)
+        return result
+
+    def _cover(self, buckets, start, end):
+        """
+        从粗到细选择时间桶覆盖[start, end)，已被粗粒度覆盖的区间不再使用细粒度
+        粗粒度的桶需完全落在范围内，范围两端不足一个桶的部分由细粒度的桶补齐；
+        最细粒度的桶只要与范围重叠即可。细粒度已过期的部分退而使用与范围部分重叠的较细的粗粒度桶
+        """
+        finest = min(self.retention)
+        chosen = []
+        covered = []
+        partial = []
+        for granularity in sorted(self.retention, reverse=True):
+            for g, bucket, sketch in buckets:
+                if g != granularity:
+                    continue
+                bucket_end = bucket + granularity
+                if bucket >= end or bucket_end <= start:
+                    continue
+                if any(s <= bucket and bucket_end <= e for s, e in covered):
+                    continue
+                if granularity != finest and (bucket < start or bucket_end > end):
+                    partial.append((max(bucket, start), min(bucket_end, end), sketch))
+                    continue
+                chosen.append(sketch)
+                covered.append((bucket, bucket_end))
+        for s, e, sketch in reversed(partial):
+            if not any(s < bucket_end and bucket < e for bucket, bucket_end in covered):
+                chosen.append(sketch)
+                covered.append((s, e))
+        return chosen
+
+    def estimate(self, room_ids=None, start=None, end=None):
+        """
+        独立观众数估计
+        :return: 去重后的用户数
+        """
+        return self.sketch(room_ids, start, end).count()
+
+    def dump_room(self, room_id):
+        """检查点: 单个直播间的草图，{"粒度_桶起点": base64编码的草图}"""
+        with self._lock:
+            return {f"{granularity}_{start}": base64.b64encode(sketch.to_bytes()).decode('ascii')
+                    for (room, granularity, start), sketch in self._sketches.items() if room == room_id} or None
+
+    def load_room(self, room_id, state):
+        with self._lock:
+            for name, data in state.items():
+                granularity, start = (int(part) for part in name.split('_'))
+                if granularity not in self.retention:
+                    continue
+                sketch = HyperLogLog.from_bytes(base64.b64decode(data))
+                key = (room_id, granularity, start)
+                if key in self._sketches:
+                    self._sketches[key].merge(sketch)
+                else:
+                    self._sketches[key] = sketch
+
+    def save(self, directory):
+        """每个草图保存为一个压缩文件: <room_id>_<粒度秒数>_<桶起点>.hll"""
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            items = [(key, sketch.to_bytes()) for key, sketch in self._sketches.items()]
+        for (room_id, granularity, start), data in items:
+            path = os.path.join(directory, f"{room_id}_{granularity}_{start}.hll")
+            with open(path + '.tmp', 'wb') as f:
+                f.write(data)
+            os.replace(path + '.tmp', path)
+
+    def load(self, directory):
+        for name in os.listdir(directory):
+            if not name.endswith('.hll'):
+                continue
+            room_id, granularity, start = (int(part) for part in name[:-4].split('_'))
+            if granularity not in self.retention:
+                continue
+            with open(os.path.join(directory, name), 'rb') as f:
+                sketch = HyperLogLog.from_bytes(f.read())
+            with self._lock:
+                key = (room_id, granularity, start)
+                if key in self._sketches:
+                    self._sketches[key].merge(sketch)
+                else:
+                    self._sketches[key] = sketch
@@ -0,0 +1,226 @@
+# coding:utf-8
+
+"""
+观众行为轨迹: 停留时长 / 发言频率 / 礼物贡献值
+
+由进场、弹幕、点赞、礼物事件驱动，每个观众一份 __slots__ 紧凑状态。
+合并阶段输出的 like_summary 只有用户列表、没有每个用户的点赞数，
+因此应作为处理阶段放在 Coalescer 之前: stages=[tracker, Coalescer()]，逐条统计点赞；
+放在合并之后(作为sink)时，汇总中的用户只更新停留时间，点赞数不计入。
+超过 idle_timeout 没有任何行为视为离开(本次停留结束)，超过 ttl 的观众按LRU淘汰，
+观众数再多内存也有上限。状态通过 dump_room/load_room 由检查点(checkpoint.Checkpointer)定期保存，重启后恢复。
+"""
+
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from analytics.counters import ComboTracker
+from checkpoint import pack_floats, unpack_floats
+
+# top() 可用的排序字段
+SORT_KEYS = ('diamonds', 'gifts', 'dwell', 'sessions', 'chats', 'chats_per_minute', 'likes')
+
+
+class ViewerState:
+    __slots__ = ('user_id', 'nick_name', 'first_seen', 'session_start', 'last_seen', 'dwell', 'sessions',
+                 'chats', 'likes', 'gifts', 'diamonds')
+
+    FIELDS = __slots__
+    # 检查点中按float64打包的列
+    FLOAT_FIELDS = ('first_seen', 'session_start', 'last_seen', 'dwell')
+
+    def __init__(self, user_id, nick_name, now):
+        self.user_id = user_id
+        self.nick_name = nick_name
+        self.first_seen = now
+        self.session_start = now
+        self.last_seen = now
+        self.dwell = 0.0
+        self.sessions = 1
+        self.chats = 0
+        self.likes = 0
+        self.gifts = 0
+        self.diamonds = 0
+
+    def touch(self, now, idle_timeout):
+        if now - self.last_seen > idle_timeout:
+            # 上一次停留已结束，开始新的一次
+            self.dwell += self.last_seen - self.session_start
+            self.session_start = now
+            self.sessions += 1
+        self.last_seen = max(self.last_seen, now)
+
+    def total_dwell(self):
+        return self.dwell + (self.last_seen - self.session_start)
+
+    def to_dict(self):
+        dwell = self.total_dwell()
+        return {
+            'user_id': self.user_id,
+            'nick_name': self.nick_name,
+            'dwell': dwell,
+            'sessions': self.sessions,
+            'chats': self.chats,
+            'chats_per_minute': self.chats / (dwell / 60) if dwell >= 60 else float(self.chats),
+            'likes': self.likes,
+            'gifts': self.gifts,
+            'diamonds': self.diamonds,
+            'first_seen': self.first_seen,
+            'last_seen': self.last_seen,
+        }
+
+    @classmethod
+    def from_list(cls, values):
+        state = cls.__new__(cls)
+        for field, value in zip(cls.FIELDS, values):
+            setattr(state, field, value)
+        return state
+
+
+class RoomSessions:
+
+    def __init__(self, idle_timeout=300.0, ttl=3600.0, max_viewers=200000):
+        """
+        :param idle_timeout: 多久没有行为视为离开(秒)
+        :param ttl: 多久没有行为的观众从内存中淘汰(秒)
+        :param max_viewers: 最多保留的观众数，超出时淘汰最久未活跃的
+        """
+        self.idle_timeout = idle_timeout
+        self.ttl = ttl
+        self.max_viewers = max_viewers
+        self.viewers = OrderedDict()
+        self.evicted = 0
+        self._combos = ComboTracker()
+
+    def _viewer(self, user_id, nick_name, now):
+        state = self.viewers.get(user_id)
+        if state is None:
+            state = self.viewers[user_id] = ViewerState(user_id, nick_name, now)
+        else:
+            state.touch(now, self.idle_timeout)
+            self.viewers.move_to_end(user_id)
+            if nick_name:
+                state.nick_name = nick_name
+        return state
+
+    def update(self, event, now):
+        event_type = event['type']
+        if event_type in ('like_summary', 'member_summary'):
+            for user_id in event['user_ids']:
+                self._viewer(user_id, None, now)
+        elif event.get('user_id'):
+            state = self._viewer(event['user_id'], event.get('nick_name'), now)
+            if event_type in ('chat', 'emoji_chat'):
+                state.chats += 1
+            elif event_type == 'like':
+                state.likes += event['count']
+            elif event_type == 'gift':
+                diamonds = self._combos.diamonds(event)
+                if diamonds:
+                    state.gifts += 1
+                    state.diamonds += diamonds
+        self._evict(now)
+
+    def to_state(self):
+        """按列保存观众状态，时间类字段打包"""
+        viewers = list(self.viewers.values())
+        columns = {}
+        for field in ViewerState.FIELDS:
+            column = [getattr(viewer, field) for viewer in viewers]
+            columns[field] = pack_floats(column) if field in ViewerState.FLOAT_FIELDS else column
+        return {
+            'viewers': columns,
+            'evicted': self.evicted,
+            'combos': self._combos.to_state(),
+        }
+
+    def load_state(self, state):
+        columns = state['viewers']
+        values = [unpack_floats(columns[field]) if field in ViewerState.FLOAT_FIELDS else columns[field]
+                  for field in ViewerState.FIELDS]
+        for row in zip(*values):
+            viewer = ViewerState.from_list(row)
+            if viewer.nick_name:
+                viewer.nick_name = sys.intern(viewer.nick_name)
+            self.viewers[viewer.user_id] = viewer
+        self.evicted += state['evicted']
+        self._combos.load_state(state['combos'])
+
+    def _evict(self, now):
+        viewers = self.viewers
+        while viewers:
+            state = next(iter(viewers.values()))
+            if len(viewers) <= self.max_viewers and now - state.last_seen < self.ttl:
+                break
+            viewers.popitem(last=False)
+            self.evicted += 1
+
+
+class SessionTracker:
+
+    def __init__(self, idle_timeout=300.0, ttl=3600.0, max_viewers=200000):
+        """
+        多直播间观众行为跟踪，放在合并之前作为处理阶段: DouyinLiveWebFetcher(stages=[tracker, Coalescer()])
+        参数含义见 RoomSessions
+        """
+        self.idle_timeout = idle_timeout
+        self.ttl = ttl
+        self.max_viewers = max_viewers
+        self._rooms = {}
+        self._lock = threading.Lock()
+
+    def room(self, room_id):
+        sessions = self._rooms.get(room_id)
+        if sessions is None:
+            sessions = self._rooms[room_id] = RoomSessions(self.idle_timeout, self.ttl, self.max_viewers)
+        return sessions
+
+    def process(self, event):
+        """作为处理阶段使用，统计后原样传递"""
+        self.write(event)
+        return [event]
+
+    def write(self, event, now=None):
+        if event['type'] not in ('member', 'member_summary', 'chat', 'emoji_chat', 'like', 'like_summary',
+                                 'gift', 'social', 'fansclub'):
+            return
+        now = time.time() if now is None else now
+        with self._lock:
+            self.room(event['room_id']).update(event, now)
+
+    def dump_room(self, room_id):
+        """检查点: 单个直播间的观众状态"""
+        with self._lock:
+            sessions = self._rooms.get(room_id)
+            return sessions.to_state() if sessions else None
+
+    def load_room(self, room_id, state):
+        with self._lock:
+            self.room(room_id).load_state(state)
+
+    def viewer(self, room_id, user_id):
+        """
+        单个观众的停留时长(秒)、发言数、每分钟发言数、点赞数、送礼次数、钻石贡献
+        :return: dict，观众不存在或已被淘汰时返回None
+        """
+        with self._lock:
+            state = self.room(room_id).viewers.get(user_id)
+            return state.to_dict() if state else None
+
+    def top(self, room_id, key='diamonds', k=10):
+        """
+        :param key: 排序字段，见 SORT_KEYS
+        """
+        if key not in SORT_KEYS:
+            raise ValueError(f"不支持的排序字段: {key}")
+        with self._lock:
+            viewers = [state.to_dict() for state in self.room(room_id).viewers.values()]
+        viewers.sort(key=lambda viewer: viewer[key], reverse=True)
+        return viewers[:k]
+
+    def stats(self):
+        with self._lock:
+            return {room_id: {'viewers': len(sessions.viewers), 'evicted': sessions.evicted}
+                    for room_id, sessions in self._rooms.items()}
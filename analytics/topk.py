@@ -0,0 +1,206 @@
+# coding:utf-8
+
+"""
+直播间实时榜单(送礼榜、发言榜)
+
+使用Space-Saving算法，每个榜单只保存 capacity 个用户，内存固定。
+误差界: 设榜单累计总量为N(总钻石数/总发言数)，
+    - 每个用户的估计值 score 满足 真实值 <= score <= 真实值 + error，且 error <= N / capacity
+    - 真实值大于 N / capacity 的用户一定在榜单中
+capacity 取 10×K 时，Top-K 在常见的长尾分布下基本准确。
+可以与服务端的 RoomRankMessage.ranks_list / get_audience_ranklist 对照。
+"""
+
+import heapq
+import sys
+import threading
+
+from analytics.counters import ComboTracker
+
+
+class SpaceSaving:
+
+    def __init__(self, capacity=1000):
+        """
+        :param capacity: 最多跟踪的用户数
+        """
+        self.capacity = capacity
+        self.total = 0
+        self._counts = {}
+        self._errors = {}
+        self._heap = []
+
+    def add(self, key, weight=1):
+        if weight <= 0:
+            return
+        self.total += weight
+        counts = self._counts
+        if key in counts:
+            counts[key] += weight
+        elif len(counts) < self.capacity:
+            counts[key] = weight
+            self._errors[key] = 0
+        else:
+            # 替换当前最小值，新用户继承其计数作为误差上界
+            minimum, evicted = self._popMin()
+            del counts[evicted]
+            del self._errors[evicted]
+            counts[key] = minimum + weight
+            self._errors[key] = minimum
+        heapq.heappush(self._heap, (counts[key], key))
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(count, k) for k, count in counts.items()]
+            heapq.heapify(self._heap)
+
+    def _popMin(self):
+        # 堆中有过期的旧计数，弹出直到与当前计数一致
+        while True:
+            count, key = heapq.heappop(self._heap)
+            if self._counts.get(key) == count:
+                return count, key
+
+    def top(self, k=10):
+        """
+        :return: [(key, score, error), ...]，按score降序
+        """
+        items = heapq.nlargest(k, self._counts.items(), key=lambda item: item[1])
+        return [(key, count, self._errors[key]) for key, count in items]
+
+    def error_bound(self):
+        """任意用户估计值的最大误差 N / capacity"""
+        return self.total / self.capacity
+
+    def to_state(self):
+        return [self.total, [[key, count, self._errors[key]] for key, count in self._counts.items()]]
+
+    def load_state(self, state):
+        total, items = state
+        items = heapq.nlargest(self.capacity, items, key=lambda item: item[1])
+        self.total = total
+        self._counts = {key: count for key, count, _ in items}
+        self._errors = {key: error for key, _, error in items}
+        self._heap = [(count, key) for key, count in self._counts.items()]
+        heapq.heapify(self._heap)
+
+    def __len__(self):
+        return len(self._counts)
+
+
+class RoomLeaderboard:
+
+    def __init__(self, capacity=1000):
+        self.gifters = SpaceSaving(capacity)
+        self.chatters = SpaceSaving(capacity)
+        self.server_ranks = []
+        self._names = {}
+        self._combos = ComboTracker()
+        self._lock = threading.Lock()
+
+    def update(self, event):
+        event_type = event['type']
+        with self._lock:
+            if event_type == 'gift':
+                self.gifters.add(event['user_id'], self._combos.diamonds(event))
+            elif event_type in ('chat', 'emoji_chat'):
+                self.chatters.add(event['user_id'])
+            elif event_type == 'rank':
+                self.server_ranks = [rank['user_id'] for rank in event['ranks']]
+                return
+            else:
+                return
+            self._names[event['user_id']] = event['nick_name']
+            # 昵称只保留仍在榜单中的用户
+            if len(self._names) > 2 * (self.gifters.capacity + self.chatters.capacity):
+                tracked = self.gifters._counts.keys() | self.chatters._counts.keys()
+                self._names = {user_id: name for user_id, name in self._names.items() if user_id in tracked}
+
+    def to_state(self):
+        with self._lock:
+            return {
+                'gifters': self.gifters.to_state(),
+                'chatters': self.chatters.to_state(),
+                'server_ranks': self.server_ranks,
+                'names': [[user_id, name] for user_id, name in self._names.items()],
+                'combos': self._combos.to_state(),
+            }
+
+    def load_state(self, state):
+        with self._lock:
+            self.gifters.load_state(state['gifters'])
+            self.chatters.load_state(state['chatters'])
+            self.server_ranks = state['server_ranks']
+            self._names.update((user_id, sys.intern(name)) for user_id, name in state['names'])
+            self._combos.load_state(state['combos'])
+
+    def top(self, board='gifters', k=10):
+        with self._lock:
+            summary = getattr(self, board)
+            return [{'user_id': user_id, 'nick_name': self._names.get(user_id, ''), 'score': score, 'error': error}
+                    for user_id, score, error in summary.top(k)]
+
+
+class TopKTracker:
+
+    def __init__(self, capacity=1000):
+        """
+        多直播间送礼榜/发言榜，作为sink使用: DouyinLiveWebFetcher(sinks=[tracker])
+        :param capacity: 每个榜单跟踪的用户数，误差上界为 总量/capacity
+        """
+        self.capacity = capacity
+        self._rooms = {}
+        self._lock = threading.Lock()
+
+    def room(self, room_id):
+        board = self._rooms.get(room_id)
+        if board is None:
+            with self._lock:
+                board = self._rooms.setdefault(room_id, RoomLeaderboard(self.capacity))
+        return board
+
+    def write(self, event):
+        if event['type'] in ('gift', 'chat', 'emoji_chat', 'rank'):
+            self.room(event['room_id']).update(event)
+
+    def rooms(self):
+        return list(self._rooms)
+
+    def dump_room(self, room_id):
+        """检查点: 单个直播间的榜单状态"""
+        board = self._rooms.get(room_id)
+        return board.to_state() if board else None
+
+    def load_room(self, room_id, state):
+        self.room(room_id).load_state(state)
+
+    def top_gifters(self, room_id, k=10):
+        """按钻石数排序的送礼榜"""
+        return self.room(room_id).top('gifters', k)
+
+    def top_chatters(self, room_id, k=10):
+        """按发言条数排序的发言榜"""
+        return self.room(room_id).top('chatters', k)
+
+    def error_bound(self, room_id, board='gifters'):
+        return getattr(self.room(room_id), board).error_bound()
+
+    def compare(self, room_id, server_ranks=None, k=None):
+        """
+        与服务端榜单对照
+        :param server_ranks: 服务端榜单用户ID列表，或 get_audience_ranklist 的返回值；
+                             默认使用最近一次 RoomRankMessage 的 ranks_list
+        :param k: 比较前k名，默认为服务端榜单长度
+        :return: 重合人数和重合率
+        """
+        board = self.room(room_id)
+        if server_ranks is None:
+            server_ranks = board.server_ranks
+        server_ids = [int(rank['id']) if isinstance(rank, dict) else rank for rank in server_ranks]
+        k = k or len(server_ids)
+        local_ids = [item['user_id'] for item in board.top('gifters', k)]
+        overlap = len(set(server_ids[:k]) & set(local_ids))
+        return {
+            'server': server_ids[:k],
+            'local': local_ids,
+            'overlap': overlap,
+            'overlap_rate': overlap / k if k else 0.0,
+        }
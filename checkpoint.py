@@ -0,0 +1,205 @@
+# coding:utf-8
+
+"""
+内存状态检查点
+
+定期把每个直播间的统计状态(计数、榜单、观众轨迹、独立观众草图...)和连接的续传状态
+(cursor/internal_ext、去重集合)保存到磁盘，进程重启后直接恢复，不必回放历史。
+
+    checkpointer = Checkpointer("checkpoints", {'counters': engine, 'topk': tracker, 'sessions': sessions})
+    checkpointer.restore()
+    checkpointer.attach(fetcher)   # 恢复续传状态并作为sink统计有变化的直播间
+    checkpointer.start()
+
+每个直播间一个文件，只有上次保存后收到过事件的直播间才重写(增量)；
+文件先写临时文件再改名(原子)。组件需实现 dump_room(room_id) / load_room(room_id, state)。
+"""
+
+import base64
+import gzip
+import json
+import os
+import sys
+import threading
+import time
+from array import array
+
+VERSION = 1
+
+
+def pack_floats(values):
+    """浮点数列(时间戳等)按float64打包为base64字符串，比逐个JSON编码快数倍"""
+    return base64.b64encode(array('d', values).tobytes()).decode('ascii')
+
+
+def unpack_floats(data):
+    return array('d', base64.b64decode(data)).tolist()
+
+
+def _write(path, data):
+    tmp = os.path.join(os.path.dirname(path), '.' + os.path.basename(path) + '.tmp')
+    payload = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    with open(tmp, 'wb') as f:
+        f.write(gzip.compress(payload, compresslevel=1))
+    os.replace(tmp, path)
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return json.loads(gzip.decompress(f.read()))
+
+
+class Checkpointer:
+
+    def __init__(self, directory, components=None, interval=30.0, max_age=1800.0, log_callback=None):
+        """
+        :param directory: 检查点目录
+        :param components: {名称: 组件}，如 MetricsEngine / TopKTracker / SessionTracker / UniqueViewers
+        :param interval: 自动保存间隔(秒)
+        :param max_age: 超过该时长的检查点不再恢复(秒)，避免用上一场直播的cursor续传
+        :param log_callback: 日志回调函数 log_callback(log_type, message)，默认输出到标准错误
+        """
+        self.directory = directory
+        self.components = dict(components or {})
+        self.interval = interval
+        self.max_age = max_age
+        self.fetchers = []
+        self.restored_fetchers = {}
+        self.log_callback = log_callback
+        self._dirty = set()
+        # write() 在websocket线程中调用，只与交换集合互斥，不等待文件写入
+        self._dirty_lock = threading.Lock()
+        self._cursors = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.saved = 0
+        self.errors = 0
+        self.last_duration = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, event):
+        with self._dirty_lock:
+            self._dirty.add(event['room_id'])
+
+    def log(self, log_type, message):
+        if self.log_callback:
+            self.log_callback(log_type, message)
+        else:
+            print(f"[CHECKPOINT][{log_type}] {message}", file=sys.stderr, flush=True)
+
+    def attach(self, fetcher):
+        """
+        登记抓取对象: 恢复已保存的续传状态，并把自己加入其sinks
+        需在 fetcher.start() 之前调用
+        """
+        state = self.restored_fetchers.pop(fetcher.live_id, None)
+        if state:
+            fetcher.restore_checkpoint(state)
+        if self not in fetcher.sinks:
+            fetcher.sinks.append(self)
+        self.fetchers.append(fetcher)
+
+    def checkpoint(self):
+        """
+        保存有变化的直播间和连接状态
+        :return: 本次写入的文件数
+        """
+        with self._lock:
+            begin = time.perf_counter()
+            now = time.time()
+            with self._dirty_lock:
+                dirty, self._dirty = self._dirty, set()
+            written = 0
+            pending = list(dirty)
+            try:
+                while pending:
+                    room_id = pending[-1]
+                    states = {}
+                    for name, component in self.components.items():
+                        state = component.dump_room(room_id)
+                        if state is not None:
+                            states[name] = state
+                    data = {'version': VERSION, 'time': now, 'room_id': room_id, 'components': states}
+                    _write(os.path.join(self.directory, f"room_{room_id}.ckpt.gz"), data)
+                    pending.pop()
+                    written += 1
+            except BaseException:
+                # 未写入的直播间留到下次保存
+                with self._dirty_lock:
+                    self._dirty.update(pending)
+                raise
+            for fetcher in list(self.fetchers):
+                state = fetcher.get_checkpoint()
+                if not state['room_id'] or self._cursors.get(fetcher.live_id) == state['cursor']:
+                    continue
+                data = {'version': VERSION, 'time': now, 'fetcher': state}
+                _write(os.path.join(self.directory, f"fetcher_{fetcher.live_id}.ckpt.gz"), data)
+                self._cursors[fetcher.live_id] = state['cursor']
+                written += 1
+            self.saved += written
+            self.last_duration = time.perf_counter() - begin
+            return written
+
+    def restore(self):
+        """
+        恢复目录中所有未过期的检查点，连接状态在 attach() 时应用
+        :return: {room_id: 恢复耗时(秒)}
+        """
+        now = time.time()
+        timings = {}
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith('.ckpt.gz'):
+                continue
+            begin = time.perf_counter()
+            try:
+                data = _read(os.path.join(self.directory, name))
+            except (OSError, ValueError, EOFError):
+                continue
+            if data.get('version') != VERSION or now - data['time'] > self.max_age:
+                continue
+            if 'fetcher' in data:
+                state = data['fetcher']
+                self.restored_fetchers[state['live_id']] = state
+                self._cursors[state['live_id']] = state['cursor']
+                continue
+            room_id = data['room_id']
+            for component_name, state in data['components'].items():
+                component = self.components.get(component_name)
+                if component is not None:
+                    component.load_room(room_id, state)
+            timings[room_id] = time.perf_counter() - begin
+        return timings
+
+    def start(self):
+        """启动后台定期保存线程"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="checkpointer")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.checkpoint()
+            except Exception as e:
+                # 任何异常都不能让保存线程退出，否则之后不再有检查点
+                self.errors += 1
+                self.log("ERROR", f"保存检查点失败: {type(e).__name__}: {e}")
+
+    def close(self):
+        """停止后台线程并做最后一次保存"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.checkpoint()
+
+    def stats(self):
+        return {
+            'rooms_dirty': len(self._dirty),
+            'fetchers': len(self.fetchers),
+            'saved': self.saved,
+            'errors': self.errors,
+            'last_duration': self.last_duration,
+        }
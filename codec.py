@@ -0,0 +1,401 @@
+# coding:utf-8
+
+"""
+事件的紧凑二进制编码，用于进程间传输；分发服务 fanout.py 的 WebSocket 订阅者可用 format=binary 接收
+
+    data = encode_batch(events)          # bytes
+    events = decode_batch(data)          # [dict, ...]
+    reader = BatchReader(data)           # 按需解码: reader[i]、reader.column('user_id')
+
+    write_batch(stream, events)          # 流式传输: 每批带长度前缀
+    for events in read_batches(stream): ...
+
+批格式(小端):
+    头部  magic 'DYEV' | 版本 u8 | 标志 u8 | 保留 u16 | schema校验 u32 | 事件数 u32 | 字符串数 u32 | 正文长度 u32
+    字符串表  (字符串数+1)个u32偏移 + UTF-8正文，同一批内重复的昵称、礼物名、弹幕只存一次
+    事件  每条为 类型 u8 | 空值位图 u32 | 按 events.EVENT_FIELDS 顺序排列的定长字段(每种类型最多32个字段)
+        int -> int64(ID/时间戳类字段为uint64)  bool -> u8  float -> float64
+        str -> 字符串表下标 u32  list -> JSON文本的字符串表下标 u32
+同一类型的事件长度固定，解码直接在原缓冲区上 struct.unpack_from，不切片复制；
+字符串表中的每个字符串只解码一次，同一批内的相同昵称解码后是同一个对象。
+每种类型的布局预先记录字符串、list、bool字段的序号，编解码时只转换这些字段，其余字段直接pack/unpack。
+标志位 COMPRESSED 表示正文经zlib压缩，此时解码需要先解压出一份副本。
+只编码 EVENT_FIELDS 中的字段，缺失或为None的字段解码为None；list中的tuple解码为list。
+schema校验由字段定义计算，EVENT_FIELDS 变化后旧数据会被拒绝而不是解错。
+
+性能对比: python codec.py --events 20000
+"""
+
+import argparse
+import json
+import struct
+import time
+import zlib
+
+from events import EVENT_FIELDS, UINT64_FIELDS, field_type
+
+MAGIC = b'DYEV'
+VERSION = 1
+
+# 类型编号按名称排序，新增事件类型会改变schema校验
+TYPES = tuple(sorted(EVENT_FIELDS))
+TYPE_CODES = {event_type: code for code, event_type in enumerate(TYPES)}
+
+_HEADER = struct.Struct('<4sBBHIIII')
+_LENGTH = struct.Struct('<I')
+
+_INT, _BOOL, _FLOAT, _STR, _LIST = range(5)
+_FORMATS = {_INT: 'q', _BOOL: 'B', _FLOAT: 'd', _STR: 'I', _LIST: 'I'}
+# 空值位图为u32
+MAX_FIELDS = 32
+
+
+class CodecError(ValueError):
+    pass
+
+
+def _kind(field):
+    kind = field_type(field)
+    if kind is str:
+        return _STR
+    if kind is list:
+        return _LIST
+    if kind is bool:
+        return _BOOL
+    if kind is float:
+        return _FLOAT
+    return _INT
+
+
+class _Layout:
+    """一种事件类型的定长记录布局，'type' 字段由类型编号表示"""
+    __slots__ = ('event_type', 'code', 'fields', 'kinds', 'struct', 'columns', 'texts', 'lists', 'keys',
+                 'str_slots', 'list_slots', 'bool_slots')
+
+    def __init__(self, event_type):
+        self.event_type = event_type
+        self.code = TYPE_CODES[event_type]
+        self.fields = tuple(field for field in EVENT_FIELDS[event_type] if field != 'type')
+        if len(self.fields) > MAX_FIELDS:
+            raise CodecError(f"事件类型 {event_type} 有 {len(self.fields)} 个字段，超过空值位图的上限 {MAX_FIELDS}")
+        self.kinds = tuple(_kind(field) for field in self.fields)
+        formats = ['Q' if field in UINT64_FIELDS else _FORMATS[kind]
+                   for field, kind in zip(self.fields, self.kinds)]
+        self.struct = struct.Struct('<BI' + ''.join(formats))
+        # 字段 -> (序号, 在记录中的偏移, 单字段Struct)，供按列读取
+        self.columns = {field: (i, struct.calcsize('<BI' + ''.join(formats[:i])), struct.Struct('<' + formats[i]))
+                        for i, field in enumerate(self.fields)}
+        # 编码时需要转换的字段序号: 存入字符串表的(str和list)、先转为JSON文本的(list)
+        self.texts = tuple(i for i, kind in enumerate(self.kinds) if kind in (_STR, _LIST))
+        self.lists = tuple(i for i, kind in enumerate(self.kinds) if kind == _LIST)
+        # 解码时各字段在 [类型名, 字段...] 中的位置
+        self.keys = ('type',) + self.fields
+        self.str_slots = tuple(i + 1 for i, kind in enumerate(self.kinds) if kind == _STR)
+        self.list_slots = tuple(i + 1 for i, kind in enumerate(self.kinds) if kind == _LIST)
+        self.bool_slots = tuple(i + 1 for i, kind in enumerate(self.kinds) if kind == _BOOL)
+
+    def encode(self, event, strings, dumps):
+        """
+        :param strings: 字符串 -> 下标 的字符串表，新字符串追加到末尾
+        :return: 一条定长记录
+        """
+        values = list(map(event.get, self.fields))
+        nulls = 0
+        if None in values:
+            for i, value in enumerate(values):
+                if value is None:
+                    nulls |= 1 << i
+                    values[i] = 0
+        for i in self.lists:
+            if not nulls >> i & 1:
+                values[i] = dumps(values[i])
+        for i in self.texts:
+            if not nulls >> i & 1:
+                value = values[i]
+                index = strings.get(value)
+                if index is None:
+                    index = strings[value] = len(strings)
+                values[i] = index
+        return self.struct.pack(self.code, nulls, *values)
+
+    def build(self, values, strings, loads):
+        """
+        :param values: 记录 unpack 的结果(类型编号, 空值位图, 各字段...)
+        :return: 事件dict
+        """
+        nulls = values[1]
+        values = [self.event_type, *values[2:]]
+        if nulls:
+            for i in range(len(self.fields)):
+                if nulls >> i & 1:
+                    values[i + 1] = None
+        for i in self.str_slots:
+            if values[i] is not None:
+                values[i] = strings[values[i]]
+        for i in self.list_slots:
+            if values[i] is not None:
+                values[i] = loads(strings[values[i]])
+        for i in self.bool_slots:
+            if values[i] is not None:
+                values[i] = values[i] != 0
+        return dict(zip(self.keys, values))
+
+
+_LAYOUTS = {event_type: _Layout(event_type) for event_type in TYPES}
+_BY_CODE = tuple(_LAYOUTS[event_type] for event_type in TYPES)
+SCHEMA = zlib.crc32(json.dumps([(t, _LAYOUTS[t].fields, _LAYOUTS[t].struct.format) for t in TYPES]).encode())
+
+# 头部标志位
+COMPRESSED = 1
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+def encode_batch(events, compress=False):
+    """
+    :param events: 事件dict列表
+    :param compress: 是否用zlib压缩正文(更小，但解码时需要先解压出一份副本)
+    :return: 一批事件的二进制编码
+    """
+    strings = {}
+    records = []
+    append = records.append
+    layouts = _LAYOUTS
+    for event in events:
+        layout = layouts.get(event['type'])
+        if layout is None:
+            raise CodecError(f"未知的事件类型: {event['type']}")
+        append(layout.encode(event, strings, _dumps))
+
+    encoded = [string.encode('utf-8') for string in strings]
+    offsets = [0]
+    total = 0
+    for data in encoded:
+        total += len(data)
+        offsets.append(total)
+    body = b''.join([struct.pack(f'<{len(offsets)}I', *offsets)] + encoded + records)
+    flags = 0
+    if compress:
+        body = zlib.compress(body, 1)
+        flags |= COMPRESSED
+    return _HEADER.pack(MAGIC, VERSION, flags, 0, SCHEMA, len(records), len(strings), len(body)) + body
+
+
+class _LazyStrings:
+    __slots__ = ('reader',)
+
+    def __init__(self, reader):
+        self.reader = reader
+
+    def __getitem__(self, index):
+        return self.reader.string(index)
+
+
+class BatchReader:
+    """
+    在缓冲区上按需解码一批事件，不复制缓冲区(压缩的批除外)；字符串在首次访问时解码并缓存
+    """
+
+    def __init__(self, data):
+        """
+        :param data: encode_batch 的结果，bytes/bytearray/memoryview
+        """
+        view = memoryview(data)
+        if len(view) < _HEADER.size:
+            raise CodecError("数据不完整")
+        magic, version, flags, _, schema, count, string_count, length = _HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise CodecError("不是事件批数据")
+        if version != VERSION:
+            raise CodecError(f"不支持的版本: {version}")
+        if schema != SCHEMA:
+            raise CodecError("事件字段定义不一致")
+        if len(view) < _HEADER.size + length:
+            raise CodecError("数据不完整")
+        self.size = _HEADER.size + length
+        base = _HEADER.size
+        if flags & COMPRESSED:
+            view = memoryview(zlib.decompress(view[base:base + length]))
+            base = 0
+        self._view = view
+        self._count = count
+        self._offsets = struct.unpack_from(f'<{string_count + 1}I', view, base)
+        self._text = base + (string_count + 1) * 4
+        self._records = self._text + self._offsets[-1]
+        self._strings = [None] * string_count
+        self._decoded = False
+        self._positions = None
+
+    def __len__(self):
+        return self._count
+
+    def string(self, index):
+        value = self._strings[index]
+        if value is None:
+            start = self._text + self._offsets[index]
+            value = self._strings[index] = str(self._view[start:self._text + self._offsets[index + 1]], 'utf-8')
+        return value
+
+    def strings(self):
+        """解码整个字符串表"""
+        if not self._decoded:
+            offsets = self._offsets
+            text = bytes(self._view[self._text:self._records])
+            self._strings = [text[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)]
+            self._decoded = True
+        return self._strings
+
+    @property
+    def positions(self):
+        """各事件在缓冲区中的起始位置"""
+        if self._positions is None:
+            view = self._view
+            position = self._records
+            positions = []
+            for _ in range(self._count):
+                positions.append(position)
+                position += _BY_CODE[view[position]].struct.size
+            self._positions = positions
+        return self._positions
+
+    def type(self, i):
+        return TYPES[self._view[self.positions[i]]]
+
+    def __getitem__(self, i):
+        position = self.positions[i]
+        layout = _BY_CODE[self._view[position]]
+        values = layout.struct.unpack_from(self._view, position)
+        strings = self._strings if self._decoded else _LazyStrings(self)
+        return layout.build(values, strings, json.loads)
+
+    def __iter__(self):
+        view = self._view
+        strings = self.strings()
+        loads = json.loads
+        by_code = _BY_CODE
+        position = self._records
+        for _ in range(self._count):
+            layout = by_code[view[position]]
+            values = layout.struct.unpack_from(view, position)
+            position += layout.struct.size
+            yield layout.build(values, strings, loads)
+
+    def column(self, field, event_type=None):
+        """
+        只读取一个字段，跳过没有该字段的事件
+        :return: [(事件序号, 值), ...]
+        """
+        result = []
+        view = self._view
+        for i, position in enumerate(self.positions):
+            layout = _BY_CODE[view[position]]
+            column = layout.columns.get(field)
+            if column is None or (event_type is not None and layout.event_type != event_type):
+                continue
+            index, offset, unpack = column
+            if view[position + 1 + index // 8] >> (index % 8) & 1:
+                result.append((i, None))
+                continue
+            value = unpack.unpack_from(view, position + offset)[0]
+            kind = layout.kinds[index]
+            if kind == _STR:
+                value = self.string(value)
+            elif kind == _LIST:
+                value = json.loads(self.string(value))
+            elif kind == _BOOL:
+                value = value != 0
+            result.append((i, value))
+        return result
+
+
+def decode_batch(data):
+    """
+    :return: 事件dict列表
+    """
+    return list(BatchReader(data))
+
+
+def write_batch(stream, events, compress=False):
+    """向流(文件、管道、socket.makefile)写一批事件，带长度前缀"""
+    data = encode_batch(events, compress)
+    stream.write(_LENGTH.pack(len(data)))
+    stream.write(data)
+    return len(data) + _LENGTH.size
+
+
+def read_batches(stream):
+    """
+    从流中依次读取 write_batch 写入的批
+    :return: 生成器，每次产生一批事件的列表
+    """
+    while True:
+        prefix = stream.read(_LENGTH.size)
+        if not prefix:
+            return
+        if len(prefix) < _LENGTH.size:
+            raise CodecError("数据不完整")
+        length, = _LENGTH.unpack(prefix)
+        data = stream.read(length)
+        if len(data) < length:
+            raise CodecError("数据不完整")
+        yield decode_batch(data)
+
+
+def benchmark(count=20000, batch=500):
+    """
+    比较各种编码一批事件的耗时和大小
+    :return: [(名称, 编码微秒/条, 解码微秒/条, 字节/条), ...]
+    """
+    import pickle
+
+    from synthetic import sample_messages
+
+    sample = sample_messages(count)
+    messages = [(cls, message) for cls, message, _ in sample]
+    event_list = [event for _, _, event in sample]
+    batches = [event_list[i:i + batch] for i in range(0, count, batch)]
+    message_batches = [messages[i:i + batch] for i in range(0, count, batch)]
+
+    def protobuf_encode(items):
+        return [(cls, bytes(message)) for cls, message in items]
+
+    def protobuf_decode(items):
+        return [cls().parse(data) for cls, data in items]
+
+    def reader_column(data):
+        return BatchReader(data).column('user_id')
+
+    codecs = (
+        ("pickle(betterproto)", message_batches, lambda b: pickle.dumps([m for _, m in b], pickle.HIGHEST_PROTOCOL),
+         pickle.loads),
+        ("protobuf重新编码", message_batches, protobuf_encode, protobuf_decode),
+        ("pickle(事件)", batches, lambda b: pickle.dumps(b, pickle.HIGHEST_PROTOCOL), pickle.loads),
+        ("JSON", batches, lambda b: json.dumps(b, ensure_ascii=False).encode('utf-8'), json.loads),
+        ("二进制批", batches, encode_batch, decode_batch),
+        ("二进制批+zlib", batches, lambda b: encode_batch(b, compress=True), decode_batch),
+        ("二进制批(只读user_id列)", batches, encode_batch, reader_column),
+    )
+    results = []
+    for name, inputs, encode, decode in codecs:
+        begin = time.perf_counter()
+        encoded = [encode(item) for item in inputs]
+        encode_seconds = time.perf_counter() - begin
+        begin = time.perf_counter()
+        for data in encoded:
+            decode(data)
+        decode_seconds = time.perf_counter() - begin
+        size = sum(sum(len(data) for _, data in item) if isinstance(item, list) else len(item) for item in encoded)
+        results.append((name, encode_seconds / count * 1e6, decode_seconds / count * 1e6, size / count))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="事件编码性能对比")
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--batch', type=int, default=500, help="每批事件数")
+    args = parser.parse_args()
+    print(f"{'编码':<24} {'编码(微秒/条)':>12} {'解码(微秒/条)':>12} {'大小(字节/条)':>12}")
+    for name, encode_us, decode_us, size in benchmark(args.events, args.batch):
+        print(f"{name:<24} {encode_us:>12.2f} {decode_us:>12.2f} {size:>12.1f}")
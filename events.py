@@ -0,0 +1,235 @@
+# coding:utf-8
+
+"""
+结构化事件
+
+每条Webcast消息解析后转换为一个dict事件，供处理阶段(去重、合并、告警...)
+和各类输出(存储、统计、界面)使用。EVENT_FIELDS 是各类事件的字段定义，
+存储表结构、列式归档和跨进程编码都以它为准。
+用户只保留 user_id 和昵称(来自进程级用户缓存，字符串共享)，完整资料见 users.get_user_cache()。
+"""
+
+from users import get_user_cache
+
+# 所有事件共有的字段
+BASE_FIELDS = ('type', 'room_id', 'msg_id', 'create_time')
+
+USER_FIELDS = ('user_id', 'nick_name')
+
+EVENT_FIELDS = {
+    'chat': BASE_FIELDS + USER_FIELDS + ('content',),
+    'emoji_chat': BASE_FIELDS + USER_FIELDS + ('emoji_id', 'content'),
+    'gift': BASE_FIELDS + USER_FIELDS + ('gift_id', 'gift_name', 'diamond_count', 'combo', 'combo_count',
+                                         'repeat_count', 'repeat_end', 'group_id', 'trace_id', 'send_time',
+                                         'to_user_id'),
+    'like': BASE_FIELDS + USER_FIELDS + ('count', 'total'),
+    'member': BASE_FIELDS + USER_FIELDS + ('gender', 'member_count'),
+    'social': BASE_FIELDS + USER_FIELDS + ('action', 'follow_count'),
+    'fansclub': BASE_FIELDS + USER_FIELDS + ('fansclub_type', 'content'),
+    'room_user_seq': BASE_FIELDS + ('total', 'total_user', 'total_pv_for_anchor'),
+    'room_stats': BASE_FIELDS + ('display_long', 'display_value', 'total'),
+    'rank': BASE_FIELDS + ('ranks',),
+    'room': BASE_FIELDS + ('content',),
+    'control': BASE_FIELDS + ('status',),
+    'stream_adaptation': BASE_FIELDS + ('adaptation_type',),
+    # 合并阶段产生的窗口汇总事件
+    'like_summary': BASE_FIELDS + ('count', 'user_count', 'user_ids', 'window_start', 'window_end'),
+    'member_summary': BASE_FIELDS + ('count', 'user_count', 'user_ids', 'nick_names', 'window_start',
+                                     'window_end'),
+    # 关键词告警，matches为[(start, end, keyword), ...]
+    'alert': BASE_FIELDS + USER_FIELDS + ('source_type', 'content', 'matches'),
+}
+
+# 字段类型，未列出的字段均为int
+FIELD_TYPES = {
+    'type': str,
+    'nick_name': str,
+    'content': str,
+    'gift_name': str,
+    'trace_id': str,
+    'combo': bool,
+    'total_pv_for_anchor': str,
+    'display_long': str,
+    'ranks': list,
+    'user_ids': list,
+    'nick_names': list,
+    'source_type': str,
+    'matches': list,
+    'window_start': float,
+    'window_end': float,
+}
+
+# 取值范围为uint64的字段
+UINT64_FIELDS = frozenset(('room_id', 'msg_id', 'create_time', 'user_id', 'gift_id', 'group_id', 'to_user_id',
+                           'send_time'))
+
+
+def field_type(field):
+    return FIELD_TYPES.get(field, int)
+
+
+GENDERS = {0: "女", 1: "男"}
+
+
+def _base(event_type, common):
+    return {
+        'type': event_type,
+        'room_id': common.room_id,
+        'msg_id': common.msg_id,
+        'create_time': common.create_time,
+    }
+
+
+_users = get_user_cache()
+
+
+def _user(event, user):
+    if user.id:
+        profile = _users.profile(user)
+        event['user_id'] = profile.id
+        event['nick_name'] = profile.nick_name
+    else:
+        event['user_id'] = user.id
+        event['nick_name'] = user.nick_name
+    return event
+
+
+def chat_event(message):
+    event = _user(_base('chat', message.common), message.user)
+    event['content'] = message.content
+    return event
+
+
+def emoji_chat_event(message):
+    event = _user(_base('emoji_chat', message.common), message.user)
+    event['emoji_id'] = message.emoji_id
+    event['content'] = message.default_content
+    return event
+
+
+def gift_event(message):
+    event = _user(_base('gift', message.common), message.user)
+    gift = message.gift
+    event.update(gift_id=gift.id or message.gift_id, gift_name=gift.name, diamond_count=gift.diamond_count,
+                 combo=gift.combo, combo_count=message.combo_count, repeat_count=message.repeat_count,
+                 repeat_end=message.repeat_end, group_id=message.group_id, trace_id=message.trace_id,
+                 send_time=message.send_time, to_user_id=message.to_user.id)
+    return event
+
+
+def like_event(message):
+    event = _user(_base('like', message.common), message.user)
+    event['count'] = message.count
+    event['total'] = message.total
+    return event
+
+
+def member_event(message):
+    event = _user(_base('member', message.common), message.user)
+    event['gender'] = message.user.gender
+    event['member_count'] = message.member_count
+    return event
+
+
+def social_event(message):
+    event = _user(_base('social', message.common), message.user)
+    event['action'] = message.action
+    event['follow_count'] = message.follow_count
+    return event
+
+
+def fansclub_event(message):
+    event = _user(_base('fansclub', message.common_info), message.user)
+    event['fansclub_type'] = message.type
+    event['content'] = message.content
+    return event
+
+
+def room_user_seq_event(message):
+    event = _base('room_user_seq', message.common)
+    event['total'] = message.total
+    event['total_user'] = message.total_user
+    event['total_pv_for_anchor'] = message.total_pv_for_anchor
+    return event
+
+
+def room_stats_event(message):
+    event = _base('room_stats', message.common)
+    event['display_long'] = message.display_long
+    event['display_value'] = message.display_value
+    event['total'] = message.total
+    return event
+
+
+def rank_event(message):
+    event = _base('rank', message.common)
+    event['ranks'] = [{'user_id': rank.user.id, 'nick_name': rank.user.nick_name, 'score_str': rank.score_str}
+                      for rank in message.ranks_list]
+    return event
+
+
+def room_event(message):
+    event = _base('room', message.common)
+    event['content'] = message.content
+    return event
+
+
+def control_event(message):
+    event = _base('control', message.common)
+    event['status'] = message.status
+    return event
+
+
+def stream_adaptation_event(message):
+    event = _base('stream_adaptation', message.common)
+    event['adaptation_type'] = message.adaptation_type
+    return event
+
+
+def describe(event):
+    """
+    事件转换为界面/控制台显示的日志
+    :return: (log_type, message)，不需要显示时返回None
+    """
+    event_type = event['type']
+    if event_type == 'chat':
+        return "CHAT", f"[{event['user_id']}]{event['nick_name']}: {event['content']}"
+    if event_type == 'emoji_chat':
+        return "EMOJI", f"表情包ID: {event['emoji_id']}, 用户: {event['nick_name']}, 内容: {event['content']}"
+    if event_type == 'gift':
+        return "GIFT", f"{event['nick_name']} 送出了 {event['gift_name']}x{event['combo_count']}"
+    if event_type == 'like':
+        return "LIKE", f"{event['nick_name']} 点了{event['count']}个赞"
+    if event_type == 'member':
+        gender = GENDERS.get(event['gender'], "未知")
+        return "ENTER", f"[{event['user_id']}][{gender}]{event['nick_name']} 进入了直播间"
+    if event_type == 'social':
+        return "FOLLOW", f"[{event['user_id']}]{event['nick_name']} 关注了主播"
+    if event_type == 'fansclub':
+        return "FANSCLUB", event['content']
+    if event_type == 'room_user_seq':
+        return "STATS", f"当前观看人数: {event['total']}, 累计观看人数: {event['total_pv_for_anchor']}"
+    if event_type == 'room_stats':
+        return "STATS", event['display_long']
+    if event_type == 'rank':
+        return "RANK", f"用户数据: {event['ranks']}"
+    if event_type == 'room':
+        return "ROOM", f"直播间ID: {event['room_id']}"
+    if event_type == 'control':
+        if event['status'] == 3:
+            return "STATUS", "直播间已结束"
+        return None
+    if event_type == 'stream_adaptation':
+        return "ADAPTATION", f"直播间adaptation: {event['adaptation_type']}"
+    if event_type == 'like_summary':
+        seconds = event['window_end'] - event['window_start']
+        return "LIKE", f"{seconds:.0f}秒内 {event['user_count']}人点了{event['count']}个赞"
+    if event_type == 'member_summary':
+        seconds = event['window_end'] - event['window_start']
+        names = "、".join(event['nick_names'])
+        more = "等" if event['user_count'] > len(event['nick_names']) else ""
+        return "ENTER", f"{seconds:.0f}秒内 {event['count']}人进入了直播间: {names}{more}"
+    if event_type == 'alert':
+        keywords = "、".join(dict.fromkeys(keyword for _, _, keyword in event['matches']))
+        return "ALERT", f"[{event['user_id']}]{event['nick_name']}: {event['content']} (命中: {keywords})"
+    return None
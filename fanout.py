@@ -0,0 +1,563 @@
+#!/usr/bin/python
+# coding:utf-8
+
+"""
+本地分发服务: 每个直播间只建一条上游连接、只解码一次，事件推送给任意多个本地订阅者
+
+    python fanout.py [261378947940 ...] [--port 8765] [--buffer 1000] [--linger 60] [--max-rooms 20] [--allow 261378947940]
+
+    SSE:        curl -N "http://127.0.0.1:8765/events?room=261378947940&method=chat,gift"
+    WebSocket:  ws://127.0.0.1:8765/ws?room=261378947940&method=chat
+    二进制:     ws://127.0.0.1:8765/ws?room=261378947940&format=binary
+    状态:       http://127.0.0.1:8765/rooms
+
+room 为直播间live_id，method 为事件类型(chat/gift/like_summary/alert...)或消息名(WebcastChatMessage)，
+均可逗号分隔或重复给出，省略表示不过滤。订阅的直播间尚未连接时自动连接，
+最后一个订阅者离开 linger 秒后断开(启动时指定的直播间常驻)。
+按需连接的直播间数不超过 --max-rooms，可用 --allow 限定允许按需连接的直播间，超出时订阅返回403。
+WebSocket 客户端可以发送 {"room": [...], "method": [...]} 修改过滤条件，SSE 每条事件的 event 为事件类型。
+format=binary 时(仅WebSocket)每次推送为一个binary帧，内容为 codec.encode_batch 编码的一批事件，
+用 codec.decode_batch / BatchReader 解码；丢弃通知等控制消息仍为JSON文本帧。
+
+每个订阅者有独立的有界缓冲区，写满时丢弃最旧的事件，慢的客户端不会拖慢抓取和其他订阅者；
+发生丢弃后，下一次推送前先发送一条 {"type": "dropped", "count": n} 告知丢失的条数。
+JSON事件只序列化一次，所有订阅者共享同一份字节；二进制订阅者按各自取出的一批编码。
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import select
+import signal
+import sys
+import threading
+import time
+import urllib.parse
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from codec import TYPE_CODES, encode_batch
+
+# 消息名 -> 事件类型，订阅时两种写法都可以
+METHOD_TYPES = {
+    'WebcastChatMessage': 'chat',
+    'WebcastGiftMessage': 'gift',
+    'WebcastLikeMessage': 'like',
+    'WebcastMemberMessage': 'member',
+    'WebcastSocialMessage': 'social',
+    'WebcastRoomUserSeqMessage': 'room_user_seq',
+    'WebcastFansclubMessage': 'fansclub',
+    'WebcastControlMessage': 'control',
+    'WebcastEmojiChatMessage': 'emoji_chat',
+    'WebcastRoomStatsMessage': 'room_stats',
+    'WebcastRoomMessage': 'room',
+    'WebcastRoomRankMessage': 'rank',
+    'WebcastRoomStreamAdaptationMessage': 'stream_adaptation',
+}
+
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+# 空闲时发送保活的间隔(秒)
+KEEPALIVE = 15.0
+
+
+def _split(values):
+    """['a,b', 'c'] -> {'a', 'b', 'c'}，空时为None"""
+    result = set()
+    for value in values or ():
+        result.update(part.strip() for part in str(value).split(',') if part.strip())
+    return result or None
+
+
+def _event_types(methods):
+    methods = _split(methods)
+    return frozenset(METHOD_TYPES.get(method, method) for method in methods) if methods else None
+
+
+class Subscriber:
+
+    def __init__(self, rooms=None, methods=None, buffer_size=1000, binary=False):
+        """
+        :param rooms: 订阅的直播间live_id，None表示全部
+        :param methods: 订阅的事件类型或消息名，None表示全部
+        :param buffer_size: 缓冲区最多保存的事件数，写满时丢弃最旧的
+        :param binary: 以codec二进制批格式接收，缓冲区保存事件本身而不是JSON字节
+        """
+        self.binary = binary
+        self.buffer = deque(maxlen=buffer_size)
+        self.delivered = 0
+        self.dropped = 0
+        self.connected_at = time.time()
+        self.closed = False
+        self._gap = 0
+        self._cond = threading.Condition()
+        self.set_filter(rooms, methods)
+
+    def set_filter(self, rooms=None, methods=None):
+        rooms = _split(rooms)
+        self.rooms = frozenset(rooms) if rooms else None
+        self.types = _event_types(methods)
+
+    def matches(self, live_id, event_type):
+        return ((self.rooms is None or live_id in self.rooms)
+                and (self.types is None or event_type in self.types))
+
+    def offer(self, item):
+        """由抓取线程调用，只追加到缓冲区，不会阻塞"""
+        with self._cond:
+            if len(self.buffer) == self.buffer.maxlen:
+                self.dropped += 1
+                self._gap += 1
+            self.buffer.append(item)
+            self._cond.notify()
+
+    def take(self, timeout=None):
+        """
+        取出缓冲区中的全部事件
+        :return: ([(事件类型, JSON字节), ...], 上次取出以来丢弃的条数)，二进制订阅者为 (事件类型, 事件)
+        """
+        with self._cond:
+            if not self.buffer and not self.closed:
+                self._cond.wait(timeout)
+            items = list(self.buffer)
+            self.buffer.clear()
+            gap, self._gap = self._gap, 0
+        self.delivered += len(items)
+        return items, gap
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify()
+
+    def stats(self):
+        return {
+            'rooms': sorted(self.rooms) if self.rooms else None,
+            'types': sorted(self.types) if self.types else None,
+            'format': 'binary' if self.binary else 'json',
+            'buffered': len(self.buffer),
+            'delivered': self.delivered,
+            'dropped': self.dropped,
+        }
+
+
+class _RoomSink:
+    """挂在直播间抓取对象上的sink，把事件交给分发服务"""
+
+    def __init__(self, server, live_id):
+        self.server = server
+        self.live_id = live_id
+
+    def write(self, event):
+        self.server.publish(self.live_id, event)
+
+
+class _Room:
+    __slots__ = ('live_id', 'fetcher', 'thread', 'pinned', 'idle_since')
+
+    def __init__(self, live_id, fetcher, thread, pinned):
+        self.live_id = live_id
+        self.fetcher = fetcher
+        self.thread = thread
+        self.pinned = pinned
+        self.idle_since = None
+
+
+def _default_fetcher(live_id, sink):
+    from liveMan import DouyinLiveWebFetcher
+    from stages.coalesce import Coalescer
+
+    def log(log_type, message):
+        if log_type in ('ERROR', 'WARN', 'WEBSOCKET'):
+            print(f"[{live_id}][{log_type}] {message}", file=sys.stderr, flush=True)
+
+    return DouyinLiveWebFetcher(live_id, log, stages=[Coalescer()], sinks=[sink])
+
+
+def _ws_frame(payload, opcode=0x1):
+    length = len(payload)
+    if length < 126:
+        header = bytes((0x80 | opcode, length))
+    elif length < 65536:
+        header = bytes((0x80 | opcode, 126)) + length.to_bytes(2, 'big')
+    else:
+        header = bytes((0x80 | opcode, 127)) + length.to_bytes(8, 'big')
+    return header + payload
+
+
+def _read_exact(reader, size):
+    # 无缓冲读取时一次read可能只返回部分数据
+    data = b''
+    while len(data) < size:
+        chunk = reader.read(size - len(data))
+        if not chunk:
+            raise ConnectionError("连接已关闭")
+        data += chunk
+    return data
+
+
+def _ws_read(reader):
+    """
+    读取一个客户端帧(客户端帧总是带掩码)
+    :return: (opcode, payload)
+    """
+    first, second = _read_exact(reader, 2)
+    length = second & 0x7f
+    if length == 126:
+        length = int.from_bytes(_read_exact(reader, 2), 'big')
+    elif length == 127:
+        length = int.from_bytes(_read_exact(reader, 8), 'big')
+    mask = _read_exact(reader, 4) if second & 0x80 else None
+    payload = _read_exact(reader, length) if length else b''
+    if mask and payload:
+        key = (mask * (length // 4 + 1))[:length]
+        payload = (int.from_bytes(payload, 'big') ^ int.from_bytes(key, 'big')).to_bytes(length, 'big')
+    return first & 0x0f, payload
+
+
+class FanoutServer:
+
+    def __init__(self, host='127.0.0.1', port=8765, buffer_size=1000, on_demand=True, linger=60.0,
+                 fetcher_factory=None, max_rooms=20, allowed_rooms=None):
+        """
+        :param buffer_size: 每个订阅者的默认缓冲区大小(订阅时可用 buffer 参数调小)
+        :param on_demand: 订阅尚未连接的直播间时是否自动连接
+        :param linger: 按需连接的直播间没有订阅者后多久断开(秒)
+        :param fetcher_factory: 创建抓取对象的函数 fetcher_factory(live_id, sink)，sink需加入抓取对象的sinks
+        :param max_rooms: 同时按需连接的直播间数上限(不含常驻直播间)
+        :param allowed_rooms: 允许按需连接的直播间live_id，None表示不限
+        """
+        self.host = host
+        self.port = port
+        self.buffer_size = buffer_size
+        self.on_demand = on_demand
+        self.linger = linger
+        self.max_rooms = max_rooms
+        self.allowed_rooms = frozenset(map(str, allowed_rooms)) if allowed_rooms is not None else None
+        self.fetcher_factory = fetcher_factory or _default_fetcher
+        self.published = 0
+        self.encoded = 0
+        self.rejected = 0
+        self._rooms = {}
+        # 订阅者列表整体替换，发布时无需加锁
+        self._subscribers = ()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._server = None
+        self._reaper = None
+
+    def attach(self, fetcher):
+        """把已创建的抓取对象加入分发，抓取对象的启动和停止由调用方负责"""
+        fetcher.sinks.append(_RoomSink(self, fetcher.live_id))
+        with self._lock:
+            self._rooms[fetcher.live_id] = _Room(fetcher.live_id, fetcher, None, True)
+
+    def open_room(self, live_id, pinned=False):
+        """连接直播间(已连接时直接返回)，在后台线程中运行抓取对象"""
+        with self._lock:
+            room, created = self._open(live_id, pinned)
+        if created:
+            room.thread.start()
+        return room
+
+    def _open(self, live_id, pinned):
+        """需持有 self._lock；新建的直播间由调用方在锁外启动线程"""
+        room = self._rooms.get(live_id)
+        if room is not None:
+            room.idle_since = None
+            return room, False
+        fetcher = self.fetcher_factory(live_id, _RoomSink(self, live_id))
+        thread = threading.Thread(target=fetcher.start, name=f"fanout-{live_id}")
+        thread.daemon = True
+        room = self._rooms[live_id] = _Room(live_id, fetcher, thread, pinned)
+        return room, True
+
+    def subscribe(self, rooms=None, methods=None, buffer_size=None, binary=False):
+        """
+        :param binary: 以codec二进制批格式接收
+        :raises PermissionError: 需要按需连接的直播间不允许连接或超出上限
+        """
+        self._open_on_demand(rooms)
+        buffer_size = min(buffer_size or self.buffer_size, self.buffer_size)
+        subscriber = Subscriber(rooms, methods, buffer_size, binary)
+        with self._lock:
+            self._subscribers += (subscriber,)
+        return subscriber
+
+    def update(self, subscriber, rooms=None, methods=None):
+        """修改过滤条件，不允许连接时保持原过滤条件并抛出 PermissionError"""
+        self._open_on_demand(rooms)
+        subscriber.set_filter(rooms, methods)
+
+    def _open_on_demand(self, rooms):
+        """连接订阅的直播间中尚未连接的，有任何一个不允许时都不连接"""
+        rooms = _split(rooms)
+        if not self.on_demand or not rooms:
+            return
+        with self._lock:
+            new = [live_id for live_id in rooms if live_id not in self._rooms]
+            for live_id in new:
+                if not live_id.isdigit() or (self.allowed_rooms is not None and live_id not in self.allowed_rooms):
+                    self.rejected += 1
+                    raise PermissionError(f"不允许按需连接直播间: {live_id}")
+            active = sum(1 for room in self._rooms.values() if not room.pinned)
+            if self.max_rooms is not None and active + len(new) > self.max_rooms:
+                self.rejected += 1
+                raise PermissionError(f"按需连接的直播间数已达上限({self.max_rooms})")
+            opened = [self._open(live_id, False) for live_id in rooms]
+        for room, created in opened:
+            if created:
+                room.thread.start()
+
+    def unsubscribe(self, subscriber):
+        subscriber.close()
+        with self._lock:
+            self._subscribers = tuple(s for s in self._subscribers if s is not subscriber)
+
+    def publish(self, live_id, event):
+        """
+        由各直播间的抓取线程调用；有JSON订阅者匹配时才序列化，且只序列化一次
+        """
+        self.published += 1
+        event_type = event['type']
+        item = None
+        for subscriber in self._subscribers:
+            if subscriber.matches(live_id, event_type):
+                if subscriber.binary:
+                    # 推送时按批编码；codec不支持的事件类型不推送
+                    if event_type in TYPE_CODES:
+                        subscriber.offer((event_type, event))
+                    continue
+                if item is None:
+                    item = (event_type, json.dumps(dict(event, live_id=live_id), ensure_ascii=False,
+                                                   separators=(',', ':'), default=str).encode('utf-8'))
+                    self.encoded += 1
+                subscriber.offer(item)
+
+    def _reap(self):
+        """断开没有订阅者超过 linger 秒的按需直播间"""
+        while not self._stop_event.wait(min(5.0, self.linger)):
+            now = time.time()
+            subscribers = self._subscribers
+            idle = []
+            with self._lock:
+                for live_id, room in self._rooms.items():
+                    if room.pinned or any(s.rooms and live_id in s.rooms for s in subscribers):
+                        room.idle_since = None
+                    elif room.idle_since is None:
+                        room.idle_since = now
+                    elif now - room.idle_since >= self.linger:
+                        idle.append(room)
+                for room in idle:
+                    del self._rooms[room.live_id]
+            for room in idle:
+                room.fetcher.stop()
+
+    def stats(self):
+        with self._lock:
+            rooms = list(self._rooms.values())
+        subscribers = self._subscribers
+        return {
+            'published': self.published,
+            'encoded': self.encoded,
+            'rejected': self.rejected,
+            'rooms': {room.live_id: {
+                'pinned': room.pinned,
+                'connected': room.fetcher.connected_at is not None,
+                'subscribers': sum(1 for s in subscribers if s.rooms is None or room.live_id in s.rooms),
+            } for room in rooms},
+            'subscribers': [s.stats() for s in subscribers],
+            'dropped': sum(s.dropped for s in subscribers),
+        }
+
+    def start(self):
+        """
+        在后台线程提供HTTP服务
+        :return: HTTP服务对象
+        """
+        if self._server is not None:
+            return self._server
+        self._server = ThreadingHTTPServer((self.host, self.port), self._handler())
+        self._server.daemon_threads = True
+        thread = threading.Thread(target=self._server.serve_forever, name="fanout-http")
+        thread.daemon = True
+        thread.start()
+        self._reaper = threading.Thread(target=self._reap, name="fanout-reaper")
+        self._reaper.daemon = True
+        self._reaper.start()
+        return self._server
+
+    def close(self):
+        self._stop_event.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        for subscriber in self._subscribers:
+            subscriber.close()
+        # 只停止自己创建的抓取对象
+        with self._lock:
+            rooms = [room for room in self._rooms.values() if room.thread is not None]
+            self._rooms.clear()
+        for room in rooms:
+            room.fetcher.stop()
+
+    def _handler(self):
+        fanout = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # 客户端长时间不读取时发送超时，断开该订阅者
+            timeout = 60
+            # 不缓冲读取: WebSocket 用 select 判断客户端是否发来了帧，
+            # 缓冲读取时已读入缓冲区的帧 select 看不到
+            rbufsize = 0
+
+            def do_GET(self):
+                url = urllib.parse.urlsplit(self.path)
+                query = urllib.parse.parse_qs(url.query)
+                if url.path == '/rooms':
+                    self._json(fanout.stats())
+                elif url.path == '/events':
+                    self._serve(query, self._sse)
+                elif url.path == '/ws' and self.headers.get('Upgrade', '').lower() == 'websocket':
+                    self._serve(query, self._websocket)
+                else:
+                    self.send_error(404)
+
+            def _json(self, value):
+                body = json.dumps(value, ensure_ascii=False).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _serve(self, query, stream):
+                try:
+                    buffer_size = int(query['buffer'][0]) if 'buffer' in query else None
+                except ValueError:
+                    self.send_error(400, explain="buffer必须为整数")
+                    return
+                fmt = query.get('format', ['json'])[0]
+                if fmt not in ('json', 'binary') or (fmt == 'binary' and stream != self._websocket):
+                    self.send_error(400, explain="format为json，或仅WebSocket支持的binary")
+                    return
+                try:
+                    subscriber = fanout.subscribe(query.get('room'), query.get('method'), buffer_size,
+                                                  fmt == 'binary')
+                except PermissionError as e:
+                    self.send_error(403, explain=str(e))
+                    return
+                try:
+                    stream(subscriber)
+                except (OSError, ConnectionError):
+                    pass
+                finally:
+                    fanout.unsubscribe(subscriber)
+                    self.close_connection = True
+
+            def _sse(self, subscriber):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+                self.send_header('Cache-Control', 'no-cache')
+                self.send_header('Access-Control-Allow-Origin', '*')
+                self.end_headers()
+                sock = self.connection
+                while not subscriber.closed:
+                    items, gap = subscriber.take(KEEPALIVE)
+                    if not items and not gap:
+                        sock.sendall(b':\n\n')
+                        continue
+                    chunks = []
+                    if gap:
+                        chunks.append(b'event: dropped\ndata: {"type":"dropped","count":%d}\n\n' % gap)
+                    for event_type, data in items:
+                        chunks.append(b'event: %s\ndata: %s\n\n' % (event_type.encode(), data))
+                    sock.sendall(b''.join(chunks))
+
+            def _websocket(self, subscriber):
+                key = self.headers.get('Sec-WebSocket-Key', '')
+                accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+                self.send_response(101)
+                self.send_header('Upgrade', 'websocket')
+                self.send_header('Connection', 'Upgrade')
+                self.send_header('Sec-WebSocket-Accept', accept)
+                self.end_headers()
+                sock = self.connection
+                idle = 0.0
+                while not subscriber.closed:
+                    # 先处理客户端发来的控制帧和过滤条件
+                    while select.select([sock], [], [], 0)[0]:
+                        opcode, payload = _ws_read(self.rfile)
+                        if opcode == 0x8:
+                            sock.sendall(_ws_frame(payload[:2], 0x8))
+                            return
+                        if opcode == 0x9:
+                            sock.sendall(_ws_frame(payload, 0xA))
+                        elif opcode == 0x1:
+                            self._update(subscriber, payload)
+                    items, gap = subscriber.take(0.5)
+                    if not items and not gap:
+                        idle += 0.5
+                        if idle >= KEEPALIVE:
+                            sock.sendall(_ws_frame(b'', 0x9))
+                            idle = 0.0
+                        continue
+                    idle = 0.0
+                    frames = []
+                    if gap:
+                        frames.append(_ws_frame(b'{"type":"dropped","count":%d}' % gap))
+                    if subscriber.binary:
+                        if items:
+                            frames.append(_ws_frame(encode_batch([event for _, event in items]), 0x2))
+                    else:
+                        frames.extend(_ws_frame(data) for _, data in items)
+                    sock.sendall(b''.join(frames))
+                sock.sendall(_ws_frame(b'', 0x8))
+
+            def _update(self, subscriber, payload):
+                try:
+                    request = json.loads(payload)
+                    fanout.update(subscriber, request.get('room'), request.get('method'))
+                except PermissionError as e:
+                    error = json.dumps({'type': 'error', 'message': str(e)}, ensure_ascii=False)
+                    self.connection.sendall(_ws_frame(error.encode('utf-8')))
+                except (ValueError, AttributeError):
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="直播间事件本地分发服务")
+    parser.add_argument('live_ids', nargs='*', help="启动时连接并常驻的直播间live_id")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--buffer', type=int, default=1000, help="每个订阅者缓冲的最多事件数")
+    parser.add_argument('--linger', type=float, default=60.0, help="按需连接的直播间无订阅者后多久断开(秒)")
+    parser.add_argument('--no-on-demand', action='store_true', help="只分发启动时指定的直播间")
+    parser.add_argument('--max-rooms', type=int, default=20, help="同时按需连接的直播间数上限")
+    parser.add_argument('--allow', action='append', help="允许按需连接的直播间live_id，可逗号分隔或重复给出")
+    args = parser.parse_args(argv)
+
+    server = FanoutServer(args.host, args.port, args.buffer, not args.no_on_demand, args.linger,
+                          max_rooms=args.max_rooms, allowed_rooms=_split(args.allow) if args.allow else None)
+    for live_id in args.live_ids:
+        server.open_room(live_id, pinned=True)
+    server.start()
+    print(f"[FANOUT] http://{args.host}:{args.port}/events  ws://{args.host}:{args.port}/ws",
+          file=sys.stderr, flush=True)
+
+    stop_event = threading.Event()
+    signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    while not stop_event.wait(1.0):
+        pass
+    server.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,321 @@
+#!/usr/bin/python
+# coding:utf-8
+
+"""
+无界面(headless)运行入口，适合服务器部署
+
+    python headless.py 261378947940 [更多live_id...] [--file live_ids.txt]
+                       [--sqlite events.db] [--parquet archive] [--search chat_search.db]
+                       [--keywords keywords.txt] [--checkpoint checkpoints] [--metrics-port 9108]
+                       [--trace traces] [--lag-threshold 5] [--fanout-port 8765]
+                       [--ndjson -|目录] [--ndjson-compress gzip|zstd] [--counters] [--top-k] [--unique-viewers] [--sessions] [--quiet]
+
+不导入tkinter，不需要显示器；V8在首次签名时加载，各类sink只在启用时导入。
+日志输出到标准错误，启动后报告从启动到首个连接建立的耗时；
+--ndjson - 时标准输出只有事件，每行一个JSON，可直接接入其他工具。
+启用的分析组件(--counters 等)在 --metrics-port 端口上提供JSON查询接口:
+    /counters?room_id=1,2       各直播间滑动窗口计数，不带room_id时为全部直播间
+    /top?room_id=1&board=gifters&k=10   送礼榜(gifters)或发言榜(chatters)，含误差上界
+    /unique?room_id=1,2&hours=24        最近若干小时的独立观众数(多个直播间合并去重)
+    /sessions?room_id=1&key=diamonds&k=10   观众停留时长、发言、点赞、送礼排行，带user_id时为单个观众
+"""
+
+import time
+
+STARTED = time.time()
+
+import argparse
+import functools
+import signal
+import sys
+import threading
+
+# 安静模式下仍然输出的日志类型
+QUIET_TYPES = ('ERROR', 'WARN', 'WEBSOCKET', 'ALERT')
+
+
+def load_live_ids(args):
+    """合并命令行和文件中的live_id，文件每行一个，#开头为注释"""
+    live_ids = list(args.live_ids)
+    if args.file:
+        with open(args.file, encoding='utf-8') as f:
+            for line in f:
+                line = line.split('#', 1)[0].strip()
+                if line:
+                    live_ids.append(line)
+    return list(dict.fromkeys(live_ids))
+
+
+def build_sinks(args):
+    """按参数创建sink，对应的存储后端按需导入"""
+    sinks = []
+    if args.sqlite:
+        from sinks.sqlite import SQLiteSink
+        sinks.append(SQLiteSink(args.sqlite))
+    if args.parquet:
+        from sinks.parquet import ParquetArchiveSink
+        sinks.append(ParquetArchiveSink(args.parquet))
+    if args.search:
+        from sinks.search import ChatSearchIndex
+        sinks.append(ChatSearchIndex(args.search))
+    if args.ndjson:
+        from sinks.ndjson import NDJSONSink
+        rotate_bytes = int(args.ndjson_rotate_mb * (1 << 20)) if args.ndjson_rotate_mb else None
+        rotate_interval = args.ndjson_rotate_minutes * 60 if args.ndjson_rotate_minutes else None
+        sinks.append(NDJSONSink(args.ndjson, compression=args.ndjson_compress, rotate_bytes=rotate_bytes,
+                                rotate_interval=rotate_interval))
+    return sinks
+
+
+def build_analytics(args):
+    """
+    按参数创建分析组件，作为sink共享给所有抓取对象
+    :return: {名称: 组件}
+    """
+    analytics = {}
+    if args.counters:
+        from analytics.counters import MetricsEngine
+        analytics['counters'] = MetricsEngine()
+    if args.top_k:
+        from analytics.topk import TopKTracker
+        analytics['topk'] = TopKTracker()
+    if args.unique_viewers:
+        from analytics.hll import UniqueViewers
+        analytics['unique'] = UniqueViewers()
+    if args.sessions:
+        from analytics.sessions import SessionTracker
+        analytics['sessions'] = SessionTracker()
+    return analytics
+
+
+# 作为处理阶段放在合并之前的分析组件(需要逐条的点赞事件)，其余作为sink
+STAGE_ANALYTICS = ('sessions',)
+
+
+def _room_ids(params):
+    """查询参数 room_id=1,2 -> {1, 2}，未指定时为None"""
+    if not params.get('room_id'):
+        return None
+    return {int(room_id) for room_id in params['room_id'].split(',')}
+
+
+def query_counters(engine, params):
+    rooms = engine.snapshot_all()
+    wanted = _room_ids(params)
+    if wanted is not None:
+        rooms = {room_id: counters for room_id, counters in rooms.items() if room_id in wanted}
+    return {
+        'windows': {name: seconds for name, (seconds, _) in engine.windows.items()},
+        'rooms': rooms,
+    }
+
+
+def query_top(tracker, params):
+    board = params.get('board', 'gifters')
+    if board not in ('gifters', 'chatters'):
+        raise ValueError(f"未知的榜单: {board}")
+    k = int(params.get('k', 10))
+    rooms = set(tracker.rooms())
+    wanted = _room_ids(params)
+    if wanted is not None:
+        rooms &= wanted
+    return {room_id: {'top': tracker.room(room_id).top(board, k), 'error_bound': tracker.error_bound(room_id, board)}
+            for room_id in rooms}
+
+
+def query_unique(viewers, params):
+    rooms = _room_ids(params)
+    hours = float(params.get('hours', 24))
+    now = time.time()
+    start = now - hours * 3600
+    result = {'hours': hours, 'total': viewers.estimate(rooms, start, now)}
+    if rooms is not None:
+        result['rooms'] = {room_id: viewers.estimate([room_id], start, now) for room_id in rooms}
+    return result
+
+
+def query_sessions(tracker, params):
+    rooms = _room_ids(params)
+    if not rooms:
+        raise ValueError("需要指定room_id")
+    if params.get('user_id'):
+        user_id = int(params['user_id'])
+        return {room_id: tracker.viewer(room_id, user_id) for room_id in rooms}
+    key = params.get('key', 'diamonds')
+    k = int(params.get('k', 10))
+    return {room_id: tracker.top(room_id, key, k) for room_id in rooms}
+
+
+QUERIES = {
+    'counters': ('/counters', query_counters),
+    'topk': ('/top', query_top),
+    'unique': ('/unique', query_unique),
+    'sessions': ('/sessions', query_sessions),
+}
+
+
+def serve_queries(instrumentation, analytics):
+    """在指标端口上登记各分析组件的查询接口"""
+    for name, component in analytics.items():
+        path, handler = QUERIES[name]
+        instrumentation.route(path, functools.partial(handler, component))
+
+
+def build_stages(args, analytics):
+    stages = [analytics[name] for name in STAGE_ANALYTICS if name in analytics]
+    if not args.no_coalesce:
+        from stages.coalesce import Coalescer
+        stages.append(Coalescer())
+    if args.keywords:
+        from stages.keywords import KeywordAlerter
+        stages.append(KeywordAlerter(args.keywords))
+    return stages
+
+
+def make_logger(live_id, quiet):
+    def log(log_type, message):
+        if quiet and log_type not in QUIET_TYPES:
+            return
+        print(f"[{live_id}][{log_type}] {message}", file=sys.stderr, flush=True)
+
+    return log
+
+
+def lag_alert(room_id, seconds, lagging):
+    if lagging:
+        message = f"直播间{room_id}落后 {seconds:.2f}秒，超过阈值"
+    else:
+        message = f"直播间{room_id}延迟恢复到 {seconds:.2f}秒"
+    print(f"[LAG][WARN] {message}", file=sys.stderr, flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="抖音直播间数据采集(无界面)")
+    parser.add_argument('live_ids', nargs='*', help="直播间live_id")
+    parser.add_argument('--file', help="live_id列表文件，每行一个")
+    parser.add_argument('--sqlite', help="事件写入SQLite数据库")
+    parser.add_argument('--parquet', help="事件按小时归档为Parquet的目录")
+    parser.add_argument('--search', help="弹幕全文检索索引数据库")
+    parser.add_argument('--ndjson', help="事件以NDJSON输出到该目录，'-'为标准输出")
+    parser.add_argument('--ndjson-compress', choices=('gzip', 'zstd'), help="NDJSON压缩算法")
+    parser.add_argument('--ndjson-rotate-mb', type=float, default=256, help="NDJSON文件达到该大小后轮转，0为不轮转")
+    parser.add_argument('--ndjson-rotate-minutes', type=float, default=60,
+                        help="NDJSON文件写入该分钟数后轮转，0为不轮转")
+    parser.add_argument('--keywords', help="关键词告警词表文件")
+    parser.add_argument('--checkpoint', help="检查点目录，保存续传状态，重启后从断点继续")
+    parser.add_argument('--metrics-port', type=int, help="在本机该端口提供Prometheus格式的 /metrics")
+    parser.add_argument('--trace', help="trace文件目录，按帧采样记录各环节耗时(Chrome trace格式)")
+    parser.add_argument('--trace-sample', type=float, default=0.01, help="追踪的帧采样比例")
+    parser.add_argument('--lag-threshold', type=float,
+                        help="以服务端时间戳测量端到端延迟，直播间落后超过该秒数时告警")
+    parser.add_argument('--fanout-port', type=int,
+                        help="在本机该端口以WebSocket/SSE向本地订阅者分发事件(见fanout.py)")
+    parser.add_argument('--counters', action='store_true',
+                        help="统计各直播间1秒/1分钟/5分钟/1小时的弹幕、点赞、礼物等计数，通过 /counters 查询")
+    parser.add_argument('--top-k', action='store_true', help="维护各直播间的送礼榜和发言榜，通过 /top 查询")
+    parser.add_argument('--unique-viewers', action='store_true',
+                        help="以HyperLogLog估计各直播间的独立观众数，通过 /unique 查询")
+    parser.add_argument('--sessions', action='store_true',
+                        help="跟踪各观众的停留时长、发言频率、点赞和送礼贡献，通过 /sessions 查询")
+    parser.add_argument('--no-coalesce', action='store_true', help="不合并连击礼物、点赞和进场消息")
+    parser.add_argument('--quiet', action='store_true', help="只输出错误、告警和连接状态日志")
+    args = parser.parse_args(argv)
+
+    live_ids = load_live_ids(args)
+    if not live_ids:
+        parser.error("请指定至少一个live_id")
+
+    from liveMan import DouyinLiveWebFetcher
+    imported = time.time()
+
+    analytics = build_analytics(args)
+    sinks = build_sinks(args) + [component for name, component in analytics.items()
+                                 if name not in STAGE_ANALYTICS]
+    checkpointer = None
+    if args.checkpoint:
+        from checkpoint import Checkpointer
+        # 分析组件的状态随检查点保存，重启后恢复
+        checkpointer = Checkpointer(args.checkpoint, analytics)
+        checkpointer.restore()
+
+    instrumentation = None
+    if args.metrics_port:
+        from instrument import Instrumentation
+        instrumentation = Instrumentation()
+        serve_queries(instrumentation, analytics)
+        instrumentation.serve(args.metrics_port)
+    elif analytics:
+        print("[STARTUP][WARN] 未指定 --metrics-port，分析结果没有查询接口", file=sys.stderr, flush=True)
+
+    tracer = None
+    if args.trace:
+        from tracing import Tracer
+        tracer = Tracer(args.trace, sample_rate=args.trace_sample)
+
+    lag = None
+    if args.lag_threshold is not None:
+        from lag import LagTracker
+        lag = LagTracker(args.lag_threshold, on_alert=lag_alert)
+
+    fetchers = []
+    for live_id in live_ids:
+        fetcher = DouyinLiveWebFetcher(live_id, make_logger(live_id, args.quiet), stages=build_stages(args, analytics),
+                                       sinks=sinks, instrumentation=instrumentation, tracer=tracer, lag=lag)
+        if checkpointer:
+            checkpointer.attach(fetcher)
+        fetchers.append(fetcher)
+    if checkpointer:
+        checkpointer.start()
+
+    fanout = None
+    if args.fanout_port:
+        from fanout import FanoutServer
+        fanout = FanoutServer(port=args.fanout_port, on_demand=False)
+        for fetcher in fetchers:
+            fanout.attach(fetcher)
+        fanout.start()
+
+    stop_event = threading.Event()
+    signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+
+    threads = []
+    for fetcher in fetchers:
+        thread = threading.Thread(target=fetcher.start, name=f"fetcher-{fetcher.live_id}")
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    # 等待首个连接建立，报告冷启动耗时
+    while not stop_event.wait(0.05):
+        connected = [fetcher.connected_at for fetcher in fetchers if fetcher.connected_at]
+        if connected:
+            print(f"[STARTUP] 模块导入 {imported - STARTED:.3f}秒, "
+                  f"启动到首个连接建立 {min(connected) - STARTED:.3f}秒", file=sys.stderr, flush=True)
+            break
+        if not any(thread.is_alive() for thread in threads):
+            break
+
+    while not stop_event.wait(1.0):
+        if not any(thread.is_alive() for thread in threads):
+            break
+
+    for fetcher in fetchers:
+        fetcher.stop()
+    for thread in threads:
+        thread.join(timeout=5)
+    if fanout:
+        fanout.close()
+    if checkpointer:
+        checkpointer.close()
+    for sink in sinks:
+        if hasattr(sink, 'close'):
+            sink.close()
+    if instrumentation:
+        instrumentation.close()
+    if tracer:
+        tracer.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+#!/usr/bin/python
+# coding:utf-8
+
+"""
+进程级共享心跳调度器
+
+所有直播间连接共用一个时间轮线程发送心跳，心跳包只序列化一次；
+心跳间隔跟随服务端下发的 Response.heartbeat_duration 自适应，
+长时间未收到服务端数据(ACK/消息)的连接会被标记为超时。
+"""
+
+import threading
+import time
+
+from protobuf import PushFrame
+
+# 心跳包内容固定，进程启动时序列化一次即可
+HEARTBEAT_FRAME = PushFrame(payload_type='hb').SerializeToString()
+
+DEFAULT_INTERVAL = 5.0
+MIN_INTERVAL = 1.0
+MAX_INTERVAL = 60.0
+
+
+class _HeartbeatEntry:
+    __slots__ = ('key', 'send', 'on_overdue', 'interval', 'rounds', 'last_sent', 'last_seen',
+                 'overdue', 'cancelled')
+
+    def __init__(self, key, send, on_overdue, interval):
+        self.key = key
+        self.send = send
+        self.on_overdue = on_overdue
+        self.interval = interval
+        self.rounds = 0
+        self.last_sent = 0.0
+        self.last_seen = time.time()
+        self.overdue = False
+        self.cancelled = False
+
+
+class HeartbeatScheduler:
+
+    def __init__(self, tick=0.5, wheel_size=256, overdue_factor=2.5):
+        """
+        时间轮心跳调度器
+        :param tick: 时间轮每一格的时长(秒)
+        :param wheel_size: 时间轮格数
+        :param overdue_factor: 超过 心跳间隔*overdue_factor 未收到服务端数据即视为超时
+        """
+        self.tick = tick
+        self.wheel_size = wheel_size
+        self.overdue_factor = overdue_factor
+        self._wheel = [[] for _ in range(wheel_size)]
+        self._cursor = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self.sent_count = 0
+        self.overdue_count = 0
+
+    def register(self, key, send, on_overdue=None, interval=DEFAULT_INTERVAL):
+        """
+        注册一个连接
+        :param key: 连接标识(一般为fetcher自身)
+        :param send: 发送心跳的回调，参数为心跳包字节，返回False表示连接已不可用
+        :param on_overdue: 心跳/ACK超时回调，参数为距上次收到数据的秒数
+        :param interval: 初始心跳间隔(秒)
+        """
+        entry = _HeartbeatEntry(key, send, on_overdue, self._clamp(interval))
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old:
+                old.cancelled = True
+            self._entries[key] = entry
+            self._schedule(entry)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="heartbeat-scheduler")
+                self._thread.daemon = True
+                self._thread.start()
+
+    def unregister(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry:
+                entry.cancelled = True
+
+    def set_interval(self, key, interval):
+        """
+        按服务端协商的heartbeat_duration调整心跳间隔，下一次调度生效
+        """
+        entry = self._entries.get(key)
+        if entry:
+            entry.interval = self._clamp(interval)
+
+    def touch(self, key):
+        """
+        记录收到服务端数据，清除超时标记
+        """
+        entry = self._entries.get(key)
+        if entry:
+            entry.last_seen = time.time()
+            entry.overdue = False
+
+    def overdue(self):
+        """
+        :return: 当前处于超时状态的连接列表
+        """
+        return [key for key, entry in list(self._entries.items()) if entry.overdue]
+
+    def stats(self):
+        return {
+            'connections': len(self._entries),
+            'sent': self.sent_count,
+            'overdue_events': self.overdue_count,
+            'overdue_now': len(self.overdue()),
+        }
+
+    def _clamp(self, interval):
+        if not interval or interval <= 0:
+            return DEFAULT_INTERVAL
+        return min(MAX_INTERVAL, max(MIN_INTERVAL, float(interval)))
+
+    def _schedule(self, entry):
+        ticks = max(1, int(round(entry.interval / self.tick)))
+        entry.rounds = (ticks - 1) // self.wheel_size
+        self._wheel[(self._cursor + ticks) % self.wheel_size].append(entry)
+
+    def _run(self):
+        next_tick = time.monotonic() + self.tick
+        while True:
+            self._wakeup.wait(max(0.0, next_tick - time.monotonic()))
+            next_tick += self.tick
+            with self._lock:
+                self._cursor = (self._cursor + 1) % self.wheel_size
+                slot = self._wheel[self._cursor]
+                due = [entry for entry in slot if not entry.cancelled and entry.rounds == 0]
+                remain = []
+                for entry in slot:
+                    if not entry.cancelled and entry.rounds > 0:
+                        entry.rounds -= 1
+                        remain.append(entry)
+                self._wheel[self._cursor] = remain
+            for entry in due:
+                self._fire(entry)
+
+    def _fire(self, entry):
+        now = time.time()
+        try:
+            alive = entry.send(HEARTBEAT_FRAME) is not False
+        except Exception:
+            alive = False
+        if not alive:
+            # 重连后同一个key下可能已是新连接的登记，只移除本条
+            with self._lock:
+                entry.cancelled = True
+                if self._entries.get(entry.key) is entry:
+                    del self._entries[entry.key]
+            return
+        entry.last_sent = now
+        self.sent_count += 1
+
+        silence = now - entry.last_seen
+        if not entry.overdue and silence > entry.interval * self.overdue_factor:
+            entry.overdue = True
+            self.overdue_count += 1
+            if entry.on_overdue:
+                try:
+                    entry.on_overdue(silence)
+                except Exception:
+                    pass
+
+        with self._lock:
+            if not entry.cancelled:
+                self._schedule(entry)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """
+    获取进程内唯一的心跳调度器
+    """
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = HeartbeatScheduler()
+    return _scheduler
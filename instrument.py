@@ -0,0 +1,268 @@
+# coding:utf-8
+
+"""
+消息处理各环节的耗时与计数
+
+    instrumentation = Instrumentation()
+    fetcher = DouyinLiveWebFetcher(live_id, instrumentation=instrumentation)
+    instrumentation.serve(9108)        # http://127.0.0.1:9108/metrics (Prometheus文本格式)
+    instrumentation.snapshot()         # 拉取接口，返回dict
+    instrumentation.route('/counters', handler)   # 同一端口上的JSON查询接口
+
+环节(stage):
+    frame       PushFrame 解析
+    decompress  gzip 解压
+    response    Response 解析
+    ack         ACK 发送
+    dispatch    单条消息的 _parseXxxMsg(解码 + 处理阶段 + 日志 + sink)
+    log         日志回调
+    sink        写入sink
+    flush       sink刷新(按sink类名)
+每个环节按 直播间 × 消息类型 统计次数和耗时直方图；另有消息/重复/未变化/出错计数，
+以及抓取时读取的重连次数、共享心跳调度器、各处理阶段和sink的 stats()(队列深度、丢弃数等)，
+抓取对象带有 lag.LagTracker 时另输出各直播间各环节的端到端延迟分位数。
+不传 instrumentation 时每处只多一次 None 判断，没有计时开销。
+"""
+
+import json
+import threading
+import urllib.parse
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from heartbeat import get_scheduler
+
+# 直方图桶上界(秒)，从10微秒到5秒
+BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+           0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+PREFIX = 'douyin_live'
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """按桶估计分位数(返回所在桶的上界)"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= rank:
+                return bound
+        return float('inf')
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'avg': self.sum / self.count if self.count else 0.0,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+        }
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class Instrumentation:
+
+    def __init__(self, buckets=BUCKETS):
+        """
+        :param buckets: 耗时直方图的桶上界(秒)
+        """
+        self.buckets = buckets
+        self._histograms = {}
+        self._counters = {}
+        self._fetchers = []
+        self._routes = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    def observe(self, stage, room_id, method, seconds):
+        """记录一次耗时"""
+        key = (stage, room_id, method)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, Histogram(self.buckets))
+        histogram.observe(seconds)
+
+    def count(self, name, room_id, method='', value=1):
+        """
+        计数，如 messages / duplicates / unchanged / errors
+        """
+        key = (name, room_id, method)
+        # 多个直播间的接收线程同时计数，读-改-写需要加锁，否则会丢失计数
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def register(self, fetcher):
+        """登记抓取对象，抓取指标时读取它的重连统计和各组件的 stats()"""
+        with self._lock:
+            if fetcher not in self._fetchers:
+                self._fetchers.append(fetcher)
+
+    def unregister(self, fetcher):
+        with self._lock:
+            if fetcher in self._fetchers:
+                self._fetchers.remove(fetcher)
+
+    def route(self, path, handler):
+        """
+        登记JSON查询接口，与 /metrics 共用端口，供看板轮询各分析组件
+        :param path: 路径，如 /counters
+        :param handler: handler(params) -> 可JSON序列化的结果，params为查询参数 {名称: 值}，
+                        参数错误时抛出 ValueError/KeyError(返回400)
+        """
+        self._routes[path] = handler
+
+    def _components(self, fetcher):
+        components = [('reconnect', fetcher.get_reconnect_stats())]
+        if fetcher.deduplicator is not None:
+            components.append(('dedup', fetcher.deduplicator.stats()))
+        if fetcher.state_detector:
+            components.append(('changes', fetcher.state_detector.stats()))
+        for component in list(fetcher.stages) + list(fetcher.sinks):
+            if hasattr(component, 'stats'):
+                components.append((type(component).__name__, component.stats()))
+        return components
+
+    def _lag_trackers(self, fetchers):
+        trackers = []
+        for fetcher in fetchers:
+            if fetcher.lag is not None and fetcher.lag not in trackers:
+                trackers.append(fetcher.lag)
+        return trackers
+
+    def snapshot(self):
+        """
+        拉取接口
+        :return: {'stages': {(环节, 直播间, 消息类型): 直方图摘要}, 'counters': {...}, 'fetchers': {live_id: {...}},
+                  'lag': [LagTracker.snapshot(), ...]}
+        """
+        with self._lock:
+            histograms = list(self._histograms.items())
+            counters = dict(self._counters)
+            fetchers = list(self._fetchers)
+        return {
+            'stages': {key: histogram.to_dict() for key, histogram in histograms},
+            'counters': counters,
+            'fetchers': {fetcher.live_id: dict(self._components(fetcher)) for fetcher in fetchers},
+            'heartbeat': get_scheduler().stats(),
+            'lag': [tracker.snapshot() for tracker in self._lag_trackers(fetchers)],
+        }
+
+    def render(self):
+        """
+        :return: Prometheus文本格式
+        """
+        lines = [f'# TYPE {PREFIX}_stage_seconds histogram']
+        with self._lock:
+            histograms = sorted(self._histograms.items(), key=lambda item: tuple(map(str, item[0])))
+            counters = sorted(self._counters.items(), key=lambda item: tuple(map(str, item[0])))
+            fetchers = list(self._fetchers)
+        for (stage, room_id, method), histogram in histograms:
+            labels = dict(stage=stage, room_id=room_id, method=method)
+            total = 0
+            for bound, count in zip(self.buckets, histogram.counts):
+                total += count
+                lines.append(f'{PREFIX}_stage_seconds_bucket{_labels(**labels, le=bound)} {total}')
+            lines.append(f'{PREFIX}_stage_seconds_bucket{_labels(**labels, le="+Inf")} {histogram.count}')
+            lines.append(f'{PREFIX}_stage_seconds_sum{_labels(**labels)} {histogram.sum}')
+            lines.append(f'{PREFIX}_stage_seconds_count{_labels(**labels)} {histogram.count}')
+
+        lines.append(f'# TYPE {PREFIX}_events_total counter')
+        for (name, room_id, method), value in counters:
+            lines.append(f'{PREFIX}_events_total{_labels(name=name, room_id=room_id, method=method)} {value}')
+
+        lines.append(f'# TYPE {PREFIX}_component gauge')
+        components = [('', 'heartbeat', get_scheduler().stats())]
+        for fetcher in fetchers:
+            components.extend((fetcher.live_id, name, stats) for name, stats in self._components(fetcher))
+        for live_id, component, stats in components:
+            for stat, value in stats.items():
+                if _number(value):
+                    labels = _labels(live_id=live_id, component=component, stat=stat)
+                    lines.append(f'{PREFIX}_component{labels} {value}')
+
+        lines.append(f'# TYPE {PREFIX}_lag_seconds gauge')
+        for tracker in self._lag_trackers(fetchers):
+            for room_id, stages in sorted(tracker.snapshot().items()):
+                for stage, summary in stages.items():
+                    for quantile in ('p50', 'p90', 'p99', 'max'):
+                        labels = _labels(room_id=room_id, stage=stage, quantile=quantile)
+                        lines.append(f'{PREFIX}_lag_seconds{labels} {summary[quantile]}')
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port=9108, host='127.0.0.1'):
+        """
+        在后台线程提供 /metrics 和 route() 登记的查询接口
+        :return: HTTP服务对象
+        """
+        if self._server is not None:
+            return self._server
+        instrumentation = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urllib.parse.urlsplit(self.path)
+                if url.path == '/metrics':
+                    self._reply(200, 'text/plain; version=0.0.4; charset=utf-8', instrumentation.render())
+                    return
+                handler = instrumentation._routes.get(url.path)
+                if handler is None:
+                    self.send_error(404)
+                    return
+                try:
+                    status, result = 200, handler(dict(urllib.parse.parse_qsl(url.query)))
+                except (ValueError, KeyError) as e:
+                    status, result = 400, {'error': str(e)}
+                self._reply(status, 'application/json; charset=utf-8',
+                            json.dumps(result, ensure_ascii=False, separators=(',', ':')))
+
+            def _reply(self, status, content_type, text):
+                body = text.encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        thread = threading.Thread(target=self._server.serve_forever, name="metrics-http")
+        thread.daemon = True
+        thread.start()
+        return self._server
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
@@ -0,0 +1,225 @@
+# coding:utf-8
+
+"""
+端到端延迟: 以服务端时间戳为基准，测量消息在各环节落后于直播现场多少
+
+    lag = LagTracker(threshold=5.0, on_alert=lambda room_id, seconds, lagging: ...)
+    fetcher = DouyinLiveWebFetcher(live_id, lag=lag)
+    lag.snapshot()      # {room_id: {环节: {'p50': 秒, 'p90': ..., 'p99': ..., 'max': ..., 'count': n}}}
+
+时钟偏差: 每帧的 Response.now 是服务端发出该帧时的时间(毫秒)，
+取最近 offset_window 秒内 (本地收到时间 - Response.now) 的最小值作为本地时钟相对服务端的偏差，
+其中包含最小单程网络延迟，因此测得的延迟比真实值略小，但不受本地时钟误差影响，
+本地时钟被校正或跳变时最多 offset_window 秒后恢复。
+
+环节(stage):
+    receive  收到帧的时间 - Response.now，即网络与排队造成的额外延迟
+    decode   事件解码完成的时间 - Common.create_time
+    sink     事件写完所有sink的时间 - Common.create_time(合并阶段的窗口等待也计入)
+    gift     礼物事件解码完成的时间 - GiftMessage.send_time(用户送出礼物的时间)
+每个 直播间 × 环节 保留最近 samples 个样本，按最近 window 秒计算分位数。
+alert_stage 环节的 alert_quantile 分位数超过 threshold 秒时告警，回落到 threshold*recover_ratio 以下时解除。
+"""
+
+import threading
+import time
+from collections import deque
+
+STAGES = ('receive', 'decode', 'sink', 'gift')
+
+
+def _seconds(timestamp):
+    """服务端时间戳(毫秒，个别字段为秒) -> 秒"""
+    return timestamp / 1000.0 if timestamp > 1e11 else float(timestamp)
+
+
+def _quantiles(values):
+    values.sort()
+    last = len(values) - 1
+    return {
+        'p50': values[last // 2],
+        'p90': values[last * 9 // 10],
+        'p99': values[last * 99 // 100],
+        'max': values[last],
+        'count': len(values),
+    }
+
+
+class ClockOffset:
+    """服务端时间到本地时间的偏差，滑动窗口最小值"""
+
+    def __init__(self, window=300.0):
+        """
+        :param window: 估计偏差使用的时间窗口(秒)
+        """
+        self.window = window
+        self.samples = 0
+        self._value = None
+        # (本地时间, 偏差)，偏差单调递增，队首为窗口内最小值
+        self._queue = deque()
+        self._lock = threading.Lock()
+
+    def update(self, server_time, local_time):
+        """
+        :param server_time: 服务端时间(秒)
+        :param local_time: 本地收到的时间(秒)
+        :return: 更新后的偏差
+        """
+        value = local_time - server_time
+        with self._lock:
+            queue = self._queue
+            while queue and queue[-1][1] >= value:
+                queue.pop()
+            queue.append((local_time, value))
+            expire = local_time - self.window
+            while queue[0][0] < expire:
+                queue.popleft()
+            self.samples += 1
+            self._value = queue[0][1]
+            return self._value
+
+    @property
+    def value(self):
+        """本地时间 - 服务端时间(秒)，尚无样本时为None"""
+        return self._value
+
+
+class _RoomLag:
+    __slots__ = ('stages', 'next_check', 'lagging', 'current')
+
+    def __init__(self, samples):
+        self.stages = {stage: deque(maxlen=samples) for stage in STAGES}
+        self.next_check = 0.0
+        self.lagging = False
+        self.current = 0.0
+
+
+class LagTracker:
+
+    def __init__(self, threshold=5.0, on_alert=None, window=60.0, samples=2048, offset_window=300.0,
+                 alert_stage='sink', alert_quantile='p90', recover_ratio=0.8, check_interval=1.0):
+        """
+        :param threshold: 告警阈值(秒)，None表示只统计不告警
+        :param on_alert: 告警回调 on_alert(room_id, 延迟秒数, 是否落后)，落后和恢复时各调用一次
+        :param window: 计算分位数的时间窗口(秒)
+        :param samples: 每个 直播间 × 环节 保留的样本数
+        :param offset_window: 估计时钟偏差的时间窗口(秒)
+        :param alert_stage: 用于告警的环节
+        :param alert_quantile: 用于告警的分位数，p50/p90/p99/max
+        :param recover_ratio: 延迟回落到 threshold*recover_ratio 以下时解除告警
+        :param check_interval: 每个直播间检查告警的最小间隔(秒)
+        """
+        self.threshold = threshold
+        self.on_alert = on_alert
+        self.window = window
+        self.samples = samples
+        self.alert_stage = alert_stage
+        self.alert_quantile = alert_quantile
+        self.recover_ratio = recover_ratio
+        self.check_interval = check_interval
+        self.clock = ClockOffset(offset_window)
+        self.alerts = 0
+        self.observed = 0
+        self._rooms = {}
+        self._lock = threading.Lock()
+
+    def _room(self, room_id):
+        room = self._rooms.get(room_id)
+        if room is None:
+            with self._lock:
+                room = self._rooms.setdefault(room_id, _RoomLag(self.samples))
+        return room
+
+    def frame(self, room_id, server_now, received=None):
+        """
+        收到一帧时调用，更新时钟偏差并记录 receive 环节
+        :param server_now: Response.now(毫秒)
+        :param received: 本地收到的时间 time.time()，默认为当前时间
+        """
+        if not server_now:
+            return
+        received = time.time() if received is None else received
+        server_time = _seconds(server_now)
+        offset = self.clock.update(server_time, received)
+        self._add(str(room_id), 'receive', received, received - offset - server_time)
+
+    def observe(self, event, stage, now=None):
+        """
+        记录事件在某环节的延迟(相对 create_time，gift环节相对 send_time)
+        """
+        offset = self.clock.value
+        if offset is None:
+            return
+        timestamp = event.get('send_time') if stage == 'gift' else event.get('create_time')
+        if not timestamp:
+            return
+        now = time.time() if now is None else now
+        self._add(str(event['room_id']), stage, now, now - offset - _seconds(timestamp))
+
+    def _add(self, room_id, stage, now, lag):
+        room = self._room(room_id)
+        room.stages[stage].append((now, lag))
+        self.observed += 1
+        if self.threshold is not None and stage == self.alert_stage and now >= room.next_check:
+            room.next_check = now + self.check_interval
+            self._check(room_id, room, now)
+
+    def _check(self, room_id, room, now):
+        summary = self._summary(room.stages[self.alert_stage], now)
+        if summary is None:
+            return
+        room.current = summary[self.alert_quantile]
+        if not room.lagging and room.current > self.threshold:
+            room.lagging = True
+            self.alerts += 1
+        elif room.lagging and room.current < self.threshold * self.recover_ratio:
+            room.lagging = False
+        else:
+            return
+        if self.on_alert:
+            try:
+                self.on_alert(room_id, room.current, room.lagging)
+            except Exception:
+                pass
+
+    def _summary(self, samples, now):
+        since = now - self.window
+        values = [lag for at, lag in list(samples) if at >= since]
+        return _quantiles(values) if values else None
+
+    # 作为sink使用: 放在sinks最后，记录写完所有sink时的延迟
+    def write(self, event):
+        self.observe(event, 'sink')
+
+    def snapshot(self, now=None):
+        """
+        :return: {直播间: {环节: {'p50', 'p90', 'p99', 'max', 'count'}}}，延迟单位为秒
+        """
+        now = time.time() if now is None else now
+        result = {}
+        for room_id, room in list(self._rooms.items()):
+            stages = {}
+            for stage, samples in room.stages.items():
+                summary = self._summary(samples, now)
+                if summary is not None:
+                    stages[stage] = summary
+            if stages:
+                result[room_id] = stages
+        return result
+
+    def lagging(self):
+        """
+        :return: {直播间: 延迟秒数}，当前处于落后告警状态的直播间
+        """
+        return {room_id: room.current for room_id, room in list(self._rooms.items()) if room.lagging}
+
+    def stats(self):
+        offset = self.clock.value
+        return {
+            'rooms': len(self._rooms),
+            'observed': self.observed,
+            'clock_offset': offset if offset is not None else 0.0,
+            'offset_samples': self.clock.samples,
+            'lagging': len(self.lagging()),
+            'alerts': self.alerts,
+        }
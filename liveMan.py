@@ -11,20 +11,36 @@ import subprocess
 import threading
 import time
 import urllib.parse
+from collections import deque
 from contextlib import contextmanager
-from unittest.mock import patch
 
 import requests
 import websocket
 import json
-from py_mini_racer import MiniRacer
-import tkinter as tk
-from tkinter import ttk, scrolledtext, messagebox, simpledialog
-from protobuf.douyin import *
+from protobuf import (PushFrame, Response, ChatMessage, GiftMessage, LikeMessage, MemberMessage, SocialMessage,
+                      RoomUserSeqMessage, FansclubMessage, EmojiChatMessage, RoomMessage, RoomStatsMessage,
+                      RoomRankMessage, ControlMessage, RoomStreamAdaptationMessage)
+from events import *
+from heartbeat import get_scheduler
+from stages.changes import StateChangeDetector
+from stages.coalesce import Coalescer
+from stages.dedup import get_deduplicator, message_id
+
+# 界面依赖在创建窗口时才导入，无界面(headless)运行不需要tkinter和显示器
+tk = ttk = scrolledtext = messagebox = simpledialog = filedialog = None
+
+
+def importTk():
+    global tk, ttk, scrolledtext, messagebox, simpledialog, filedialog
+    if tk is None:
+        import tkinter as tk
+        from tkinter import ttk, scrolledtext, messagebox, simpledialog, filedialog
 
 
 @contextmanager
 def patched_popen_encoding(encoding='utf-8'):
+    from unittest.mock import patch
+
     original_popen_init = subprocess.Popen.__init__
 
     def new_popen_init(self, *args, **kwargs):
@@ -54,6 +70,8 @@ def generateSignature(wss, script_file='sign.js'):
     with codecs.open(script_file, 'r', encoding='utf8') as f:
         script = f.read()
 
+    # V8只在首次签名时加载，重连复用签名后不再需要
+    from py_mini_racer import MiniRacer
     ctx = MiniRacer()
     ctx.eval(script)
 
@@ -86,24 +104,72 @@ def generateMsToken(length=107):
 
 class DouyinLiveWebFetcher:
 
-    def __init__(self, live_id, log_callback=None):
+    def __init__(self, live_id, log_callback=None, auto_reconnect=True, dedup=True,
+                 skip_unchanged=True, stages=None, sinks=None, instrumentation=None, tracer=None,
+                 lag=None):
         """
         直播间弹幕抓取对象
         :param live_id: 直播间的直播id，打开直播间web首页的链接如：https://live.douyin.com/261378947940  ，
                         其中的261378947940即是live_id
         :param log_callback: 日志回调函数
+        :param auto_reconnect: 连接断开后是否自动重连(复用ttwid/room_id/signature，并从上次的cursor续传)
+        :param dedup: 是否按msg_id丢弃重复消息(重连、历史回放、同房间多会话)
+        :param skip_unchanged: 统计/排行榜/流配置等状态消息内容未变化时跳过解析和输出
+        :param stages: 事件处理阶段列表，每个阶段实现 process(event) -> 事件列表，
+                       可选实现 tick()/flush() 输出到期或剩余的合并结果
+        :param sinks: 事件输出列表，每个sink实现 write(event)，可选实现 flush()
+        :param instrumentation: instrument.Instrumentation 实例，统计各环节耗时和计数，None表示不统计
+        :param tracer: tracing.Tracer 实例，按帧记录各环节的span并导出trace文件，None表示不追踪
+        :param lag: lag.LagTracker 实例，以服务端时间戳测量各环节的延迟，None表示不测量
         """
         self.__ttwid = None
         self.__room_id = None
+        self.__signature = None
         self.live_id = live_id
         self.live_url = "https://live.douyin.com/"
         self.user_agent = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) " \
                           "Chrome/120.0.0.0 Safari/537.36"
         self.log_callback = log_callback
         self.ws = None
-        self.heartbeat_thread = None
+        # 首次建立连接的时间
+        self.connected_at = None
+        self.heartbeat_interval = None
         self.running = False
 
+        # 断线重连: 指数退避 + 随机抖动
+        self.auto_reconnect = auto_reconnect
+        self.reconnect_base_delay = 1.0
+        self.reconnect_max_delay = 60.0
+        self.reconnect_count = 0
+        self.gap_durations = deque(maxlen=1000)
+        self.__reconnect_attempts = 0
+        self.__closed_at = None
+        self.__stop_event = threading.Event()
+
+        # 服务端下发的续传位置，每帧更新，重连时带上
+        self.cursor = ""
+        self.internal_ext = ""
+        self.live_cursor = ""
+
+        self.dedup = dedup
+        self.deduplicator = None
+        self.state_detector = StateChangeDetector() if skip_unchanged else None
+
+        self.stages = list(stages or [])
+        self.sinks = list(sinks or [])
+        self._pipeline_lock = threading.RLock()
+
+        self.instrumentation = instrumentation
+        if instrumentation is not None:
+            instrumentation.register(self)
+        self.tracer = tracer
+        # 当前帧已记录的span，仅在追踪时使用
+        self._spans = None
+        # 延迟测量放在sinks最后，记录事件写完所有sink时的延迟
+        self.lag = lag
+        if lag is not None and lag not in self.sinks:
+            self.sinks.append(lag)
+
     def log(self, log_type, message):
         """记录日志"""
         if self.log_callback:
@@ -113,14 +179,24 @@ class DouyinLiveWebFetcher:
 
     def start(self):
         self.running = True
-        self._connectWebSocket()
+        self.__stop_event.clear()
+        while self.running:
+            self._connectWebSocket()
+            if not self.running or not self.auto_reconnect:
+                break
+            delay = self._nextReconnectDelay()
+            self.log("WEBSOCKET", f"连接已断开，{delay:.1f}秒后尝试第{self.__reconnect_attempts}次重连...")
+            if self.__stop_event.wait(delay):
+                break
+        self.running = False
 
     def stop(self):
         self.running = False
+        self.__stop_event.set()
+        self._tickStages(flush=True)
+        get_scheduler().unregister(self)
         if self.ws:
             self.ws.close()
-        if self.heartbeat_thread and self.heartbeat_thread.is_alive():
-            self.heartbeat_thread.join(timeout=1.0)
 
     @property
     def ttwid(self):
@@ -257,6 +333,97 @@ class DouyinLiveWebFetcher:
             self.log("ERROR", f"获取观众用户数据时出错: {str(e)}")
             return []
 
+    def get_state(self, method):
+        """
+        获取状态类消息的最新值(即使因内容未变化而被跳过)
+        :param method: 消息类型，如 WebcastRoomUserSeqMessage
+        :return: 最近一次解析的消息对象，未开启变化检测或尚未收到时为None
+        """
+        if self.state_detector:
+            return self.state_detector.current(method)
+
+    def _nextReconnectDelay(self):
+        """
+        计算下一次重连的等待时间(full jitter指数退避)
+        :return: 等待秒数
+        """
+        self.__reconnect_attempts += 1
+        ceiling = min(self.reconnect_max_delay,
+                      self.reconnect_base_delay * (2 ** (self.__reconnect_attempts - 1)))
+        return random.uniform(self.reconnect_base_delay / 2, max(ceiling, self.reconnect_base_delay))
+
+    def get_reconnect_stats(self):
+        """
+        获取重连统计信息
+        :return: 重连次数、断线时长(秒)等指标
+        """
+        gaps = list(self.gap_durations)
+        return {
+            'reconnect_count': self.reconnect_count,
+            'pending_attempts': self.__reconnect_attempts,
+            'disconnected': self.__closed_at is not None,
+            'last_gap': gaps[-1] if gaps else 0.0,
+            'max_gap': max(gaps) if gaps else 0.0,
+            'avg_gap': sum(gaps) / len(gaps) if gaps else 0.0,
+            'total_gap': float(sum(gaps)),
+            'cursor': self.cursor,
+        }
+
+    def get_checkpoint(self):
+        """
+        获取续传所需的连接状态，用于检查点保存
+        :return: room_id、cursor/internal_ext和去重集合
+        """
+        return {
+            'live_id': self.live_id,
+            'room_id': self.__room_id,
+            'cursor': self.cursor,
+            'internal_ext': self.internal_ext,
+            'live_cursor': self.live_cursor,
+            'dedup': self.deduplicator.to_state() if self.deduplicator is not None else None,
+        }
+
+    def restore_checkpoint(self, state):
+        """
+        从检查点恢复连接状态，需在start()之前调用，连接时从保存的cursor续传
+        :param state: get_checkpoint() 的返回值
+        """
+        if state.get('live_id') != self.live_id or not state.get('room_id'):
+            return
+        self.__room_id = state['room_id']
+        self.cursor = state['cursor']
+        self.internal_ext = state['internal_ext']
+        self.live_cursor = state['live_cursor']
+        if self.dedup and state.get('dedup'):
+            self.deduplicator = get_deduplicator(self.__room_id)
+            self.deduplicator.load_state(state['dedup'])
+
+    def _buildWssUrl(self):
+        """
+        构造websocket地址，已收到过服务端cursor时从断点续传
+        """
+        cursor = self.cursor or "d-1_u-1_fh-7392091211001140287_t-1721106114633_r-1"
+        internal_ext = self.internal_ext or (
+            f"internal_src:dim|wss_push_room_id:{self.room_id}|wss_push_did:7319483754668557238"
+            f"|first_req_ms:1721106114541|fetch_time:1721106114633|seq:1|wss_info:0-1721106114633-0-0|"
+            f"wrds_v:7392094459690748497")
+        cursor = urllib.parse.quote(cursor, safe='-_')
+        internal_ext = urllib.parse.quote(internal_ext, safe=':|-_')
+
+        return ("wss://webcast100-ws-web-lq.douyin.com/webcast/im/push/v2/?app_name=douyin_web"
+                "&version_code=180800&webcast_sdk_version=1.0.14-beta.0"
+                "&update_version_code=1.0.14-beta.0&compress=gzip&device_platform=web&cookie_enabled=true"
+                "&screen_width=1536&screen_height=864&browser_language=zh-CN&browser_platform=Win32"
+                "&browser_name=Mozilla"
+                "&browser_version=5.0%20(Windows%20NT%2010.0;%20Win64;%20x64)%20AppleWebKit/537.36%20(KHTML,"
+                "%20like%20Gecko)%20Chrome/126.0.0.0%20Safari/537.36"
+                "&browser_online=true&tz_name=Asia/Shanghai"
+                f"&cursor={cursor}"
+                f"&internal_ext={internal_ext}"
+                f"&host=https://live.douyin.com&aid=6383&live_id=1&did_rule=3&endpoint=live_pc&support_wrds=1"
+                f"&user_unique_id=7319483754668557238&im_path=/webcast/im/fetch/&identity=audience"
+                f"&need_persist_msg_count=15&insert_task_id=&live_reason=&room_id={self.room_id}&heartbeatDuration=0")
+
     def _connectWebSocket(self):
         """
         连接抖音直播间websocket服务器，请求直播间数据
@@ -265,24 +432,15 @@ class DouyinLiveWebFetcher:
             self.log("ERROR", "无法获取room_id，无法连接WebSocket")
             return
 
-        wss = ("wss://webcast100-ws-web-lq.douyin.com/webcast/im/push/v2/?app_name=douyin_web"
-               "&version_code=180800&webcast_sdk_version=1.0.14-beta.0"
-               "&update_version_code=1.0.14-beta.0&compress=gzip&device_platform=web&cookie_enabled=true"
-               "&screen_width=1536&screen_height=864&browser_language=zh-CN&browser_platform=Win32"
-               "&browser_name=Mozilla"
-               "&browser_version=5.0%20(Windows%20NT%2010.0;%20Win64;%20x64)%20AppleWebKit/537.36%20(KHTML,"
-               "%20like%20Gecko)%20Chrome/126.0.0.0%20Safari/537.36"
-               "&browser_online=true&tz_name=Asia/Shanghai"
-               "&cursor=d-1_u-1_fh-7392091211001140287_t-1721106114633_r-1"
-               f"&internal_ext=internal_src:dim|wss_push_room_id:{self.room_id}|wss_push_did:7319483754668557238"
-               f"|first_req_ms:1721106114541|fetch_time:1721106114633|seq:1|wss_info:0-1721106114633-0-0|"
-               f"wrds_v:7392094459690748497"
-               f"&host=https://live.douyin.com&aid=6383&live_id=1&did_rule=3&endpoint=live_pc&support_wrds=1"
-               f"&user_unique_id=7319483754668557238&im_path=/webcast/im/fetch/&identity=audience"
-               f"&need_persist_msg_count=15&insert_task_id=&live_reason=&room_id={self.room_id}&heartbeatDuration=0")
-
-        signature = generateSignature(wss)
-        wss += f"&signature={signature}"
+        if self.dedup and self.deduplicator is None:
+            self.deduplicator = get_deduplicator(self.room_id)
+
+        wss = self._buildWssUrl()
+
+        # 签名参数不包含cursor/internal_ext，重连时复用，避免重复启动V8
+        if not self.__signature:
+            self.__signature = generateSignature(wss)
+        wss += f"&signature={self.__signature}"
 
         headers = {
             "cookie": f"ttwid={self.ttwid}",
@@ -301,35 +459,49 @@ class DouyinLiveWebFetcher:
             self.ws.run_forever()
         except Exception as e:
             self.log("ERROR", f"WebSocket连接错误: {str(e)}")
-            self.stop()
+            if not self.auto_reconnect:
+                self.stop()
 
-    def _sendHeartbeat(self):
+    def _sendHeartbeat(self, heartbeat):
         """
-        发送心跳包
+        发送心跳包，由进程共享的心跳调度器定时调用
+        :param heartbeat: 预先序列化好的心跳包
+        :return: False表示连接不可用，调度器将不再为该连接发送心跳
         """
-        while self.running:
-            try:
-                if self.ws and self.ws.sock and self.ws.sock.connected:
-                    heartbeat = PushFrame(payload_type='hb').SerializeToString()
-                    self.ws.send(heartbeat, websocket.ABNF.OPCODE_PING)
-                    self.log("HEARTBEAT", "发送心跳包...")
-                else:
-                    self.log("WARN", "WebSocket未连接，停止发送心跳")
-                    break
-            except Exception as e:
-                self.log("ERROR", f"发送心跳包时出错: {str(e)}")
-                break
+        if not self.running:
+            return False
+        try:
+            if self.ws and self.ws.sock and self.ws.sock.connected:
+                self.ws.send(heartbeat, websocket.ABNF.OPCODE_PING)
+                self.log("HEARTBEAT", "发送心跳包...")
             else:
-                time.sleep(5)
+                self.log("WARN", "WebSocket未连接，停止发送心跳")
+                return False
+        except Exception as e:
+            self.log("ERROR", f"发送心跳包时出错: {str(e)}")
+            return False
+        return True
+
+    def _onHeartbeatOverdue(self, silence):
+        """心跳/ACK超时"""
+        self.log("WARN", f"已有{silence:.1f}秒未收到服务端数据，连接可能已失效")
 
     def _wsOnOpen(self, ws):
         """
         连接建立成功
         """
         self.log("WEBSOCKET", "WebSocket连接成功.")
-        self.heartbeat_thread = threading.Thread(target=self._sendHeartbeat)
-        self.heartbeat_thread.daemon = True
-        self.heartbeat_thread.start()
+        if self.connected_at is None:
+            self.connected_at = time.time()
+        if self.__closed_at is not None:
+            gap = time.time() - self.__closed_at
+            self.gap_durations.append(gap)
+            self.reconnect_count += 1
+            self.__closed_at = None
+            self.log("WEBSOCKET", f"重连成功(累计{self.reconnect_count}次)，中断时长: {gap:.2f}秒")
+        self.__reconnect_attempts = 0
+        get_scheduler().register(self, self._sendHeartbeat, self._onHeartbeatOverdue,
+                                 self.heartbeat_interval or 5)
 
     def _wsOnMessage(self, ws, message):
         """
@@ -339,11 +511,47 @@ class DouyinLiveWebFetcher:
         """
 
         # 根据proto结构体解析对象
-        package = PushFrame().parse(message)
-        response = Response().parse(gzip.decompress(package.payload))
+        inst = self.instrumentation
+        timed = inst is not None or self.tracer is not None
+        room_id = self.__room_id
+        arrived = time.time() if self.lag is not None else 0.0
+        if not timed:
+            package = PushFrame().parse(message)
+            response = Response().parse(gzip.decompress(package.payload))
+        else:
+            if self.tracer is not None:
+                self._spans = [None]
+            received = time.perf_counter()
+            package = PushFrame().parse(message)
+            parsed = time.perf_counter()
+            payload = gzip.decompress(package.payload)
+            decompressed = time.perf_counter()
+            response = Response().parse(payload)
+            self._record('frame', '', received, parsed)
+            self._record('decompress', '', parsed, decompressed)
+            self._record('response', '', decompressed, time.perf_counter())
+
+        if self.lag is not None:
+            self.lag.frame(room_id, response.now, arrived)
+
+        scheduler = get_scheduler()
+        scheduler.touch(self)
+        # 心跳间隔跟随服务端下发的heartbeat_duration(毫秒)
+        if response.heartbeat_duration and response.heartbeat_duration / 1000 != self.heartbeat_interval:
+            self.heartbeat_interval = response.heartbeat_duration / 1000
+            scheduler.set_interval(self, self.heartbeat_interval)
+
+        # 记录续传位置，断线重连时从这里继续
+        if response.cursor:
+            self.cursor = response.cursor
+        if response.internal_ext:
+            self.internal_ext = response.internal_ext
+        if response.live_cursor:
+            self.live_cursor = response.live_cursor
 
         # 返回直播间服务器链接存活确认消息，便于持续获取数据
         if response.need_ack:
+            begin = time.perf_counter() if timed else 0.0
             try:
                 ack = PushFrame(log_id=package.log_id,
                                 payload_type='ack',
@@ -352,12 +560,25 @@ class DouyinLiveWebFetcher:
                 ws.send(ack, websocket.ABNF.OPCODE_BINARY)
             except Exception as e:
                 self.log("ERROR", f"发送ACK时出错: {str(e)}")
+            if timed:
+                self._record('ack', '', begin, time.perf_counter())
 
         # 根据消息类别解析消息体
         for msg in response.messages_list:
             method = msg.method
+            if inst is not None:
+                inst.count('messages', room_id, method)
+            if self.deduplicator is not None and self.deduplicator.seen(message_id(msg)):
+                if inst is not None:
+                    inst.count('duplicates', room_id, method)
+                continue
+            if self.state_detector and not self.state_detector.changed(method, msg.payload):
+                if inst is not None:
+                    inst.count('unchanged', room_id, method)
+                continue
+            begin = time.perf_counter() if timed else 0.0
             try:
-                {
+                message = {
                     'WebcastChatMessage': self._parseChatMsg,  # 聊天消息
                     'WebcastGiftMessage': self._parseGiftMsg,  # 礼物消息
                     'WebcastLikeMessage': self._parseLikeMsg,  # 点赞消息
@@ -372,107 +593,313 @@ class DouyinLiveWebFetcher:
                     'WebcastRoomRankMessage': self._parseRankMsg,  # 直播间用户数据信息
                     'WebcastRoomStreamAdaptationMessage': self._parseRoomStreamAdaptationMsg,  # 直播间流配置
                 }.get(method)(msg.payload)
+                if self.state_detector:
+                    self.state_detector.update(method, message)
             except Exception as e:
                 self.log("ERROR", f"尝试解析消息可能出错: {str(e)}")
+                if inst is not None:
+                    inst.count('errors', room_id, method)
+            if timed:
+                self._record('dispatch', method, begin, time.perf_counter())
+
+        self._tickStages()
+
+        if self._spans is not None:
+            self._spans[0] = ('frame_total', '', received, time.perf_counter())
+            self.tracer.add_frame(self._spans, room_id)
+            self._spans = None
+
+    def _record(self, stage, method, start, end):
+        """记录一个环节的耗时，供统计和追踪使用"""
+        if self.instrumentation is not None:
+            self.instrumentation.observe(stage, self.__room_id, method, end - start)
+        if self._spans is not None:
+            self._spans.append((stage, method, start, end))
 
     def _wsOnError(self, ws, error):
         self.log("ERROR", f"WebSocket错误: {str(error)}")
 
     def _wsOnClose(self, ws, *args):
         self.log("WEBSOCKET", "WebSocket连接已关闭.")
-        self.running = False
+        get_scheduler().unregister(self)
+        if self.__closed_at is None:
+            self.__closed_at = time.time()
+        if not self.auto_reconnect:
+            self.running = False
 
     def _parseChatMsg(self, payload):
         """聊天消息"""
         message = ChatMessage().parse(payload)
-        user_name = message.user.nick_name
-        user_id = message.user.id
-        content = message.content
-        self.log("CHAT", f"[{user_id}]{user_name}: {content}")
+        self._emit(chat_event(message))
+        return message
 
     def _parseGiftMsg(self, payload):
         """礼物消息"""
         message = GiftMessage().parse(payload)
-        user_name = message.user.nick_name
-        gift_name = message.gift.name
-        gift_cnt = message.combo_count
-        self.log("GIFT", f"{user_name} 送出了 {gift_name}x{gift_cnt}")
+        self._emit(gift_event(message))
+        return message
 
     def _parseLikeMsg(self, payload):
         '''点赞消息'''
         message = LikeMessage().parse(payload)
-        user_name = message.user.nick_name
-        count = message.count
-        self.log("LIKE", f"{user_name} 点了{count}个赞")
+        self._emit(like_event(message))
+        return message
 
     def _parseMemberMsg(self, payload):
         '''进入直播间消息'''
         message = MemberMessage().parse(payload)
-        user_name = message.user.nick_name
-        user_id = message.user.id
-        gender = ["女", "男"][message.user.gender]
-        self.log("ENTER", f"[{user_id}][{gender}]{user_name} 进入了直播间")
+        self._emit(member_event(message))
+        return message
 
     def _parseSocialMsg(self, payload):
         '''关注消息'''
         message = SocialMessage().parse(payload)
-        user_name = message.user.nick_name
-        user_id = message.user.id
-        self.log("FOLLOW", f"[{user_id}]{user_name} 关注了主播")
+        self._emit(social_event(message))
+        return message
 
     def _parseRoomUserSeqMsg(self, payload):
         '''直播间统计'''
         message = RoomUserSeqMessage().parse(payload)
-        current = message.total
-        total = message.total_pv_for_anchor
-        self.log("STATS", f"当前观看人数: {current}, 累计观看人数: {total}")
+        self._emit(room_user_seq_event(message))
+        return message
 
     def _parseFansclubMsg(self, payload):
         '''粉丝团消息'''
         message = FansclubMessage().parse(payload)
-        content = message.content
-        self.log("FANSCLUB", content)
+        self._emit(fansclub_event(message))
+        return message
 
     def _parseEmojiChatMsg(self, payload):
         '''聊天表情包消息'''
         message = EmojiChatMessage().parse(payload)
-        emoji_id = message.emoji_id
-        user = message.user
-        common = message.common
-        default_content = message.default_content
-        self.log("EMOJI", f"表情包ID: {emoji_id}, 用户: {user}, 内容: {default_content}")
+        self._emit(emoji_chat_event(message))
+        return message
 
     def _parseRoomMsg(self, payload):
         message = RoomMessage().parse(payload)
-        common = message.common
-        room_id = common.room_id
-        self.log("ROOM", f"直播间ID: {room_id}")
+        self._emit(room_event(message))
+        return message
 
     def _parseRoomStatsMsg(self, payload):
         message = RoomStatsMessage().parse(payload)
-        display_long = message.display_long
-        self.log("STATS", display_long)
+        self._emit(room_stats_event(message))
+        return message
 
     def _parseRankMsg(self, payload):
         message = RoomRankMessage().parse(payload)
-        ranks_list = message.ranks_list
-        self.log("RANK", f"用户数据: {ranks_list}")
+        self._emit(rank_event(message))
+        return message
 
     def _parseControlMsg(self, payload):
         '''直播间状态消息'''
         message = ControlMessage().parse(payload)
+        self._emit(control_event(message))
         if message.status == 3:
-            self.log("STATUS", "直播间已结束")
             self.stop()
+        return message
 
     def _parseRoomStreamAdaptationMsg(self, payload):
         message = RoomStreamAdaptationMessage().parse(payload)
-        adaptationType = message.adaptation_type
-        self.log('ADAPTATION', f'直播间adaptation: {adaptationType}')
+        self._emit(stream_adaptation_event(message))
+        return message
+
+    def _emit(self, event):
+        """
+        事件依次经过各处理阶段，再输出到日志和各个sink
+        """
+        if self.lag is not None:
+            self.lag.observe(event, 'decode')
+            if event['type'] == 'gift':
+                self.lag.observe(event, 'gift')
+        with self._pipeline_lock:
+            self._runStages([event])
+
+    def _runStages(self, events, start=0):
+        for stage in self.stages[start:]:
+            out = []
+            for event in events:
+                out.extend(stage.process(event))
+            events = out
+            if not events:
+                return
+        if self.instrumentation is not None or self._spans is not None:
+            self._runSinksTimed(events)
+            return
+        for event in events:
+            described = describe(event)
+            if described:
+                self.log(*described)
+            for sink in self.sinks:
+                try:
+                    sink.write(event)
+                except Exception as e:
+                    self.log("ERROR", f"写入{type(sink).__name__}出错: {str(e)}")
+
+    def _runSinksTimed(self, events):
+        """
+        同 _runStages 的输出部分，分别记录日志回调和sink的耗时
+        """
+        inst = self.instrumentation
+        for event in events:
+            event_type = event['type']
+            begin = time.perf_counter()
+            described = describe(event)
+            if described:
+                self.log(*described)
+            logged = time.perf_counter()
+            self._record('log', event_type, begin, logged)
+            for sink in self.sinks:
+                try:
+                    sink.write(event)
+                except Exception as e:
+                    self.log("ERROR", f"写入{type(sink).__name__}出错: {str(e)}")
+                    if inst is not None:
+                        inst.count('sink_errors', self.__room_id, event_type)
+            self._record('sink', event_type, logged, time.perf_counter())
+
+    def _tickStages(self, flush=False):
+        """
+        输出各阶段中已到期(flush=True时为全部)的合并结果
+        """
+        with self._pipeline_lock:
+            for i, stage in enumerate(self.stages):
+                handler = getattr(stage, 'flush' if flush else 'tick', None)
+                events = handler() if handler else None
+                if events:
+                    self._runStages(events, i + 1)
+            if flush:
+                for sink in self.sinks:
+                    if hasattr(sink, 'flush'):
+                        begin = time.perf_counter()
+                        sink.flush()
+                        if self.instrumentation is not None:
+                            self.instrumentation.observe('flush', self.__room_id, type(sink).__name__,
+                                                         time.perf_counter() - begin)
+                        if self.tracer is not None:
+                            self.tracer.add_frame([('flush', type(sink).__name__, begin, time.perf_counter())],
+                                                  self.__room_id, keep=True)
+
+
+class HistoryChart:
+    """
+    直播间历史曲线面板，直接绘制 History 中预先降采样的桶，
+    点数不超过画布宽度，24小时的直播重绘也只需画一条折线
+    """
+    # 时间范围名 -> 秒数
+    RANGES = {'10分钟': 600, '1小时': 3600, '6小时': 6 * 3600, '24小时': 24 * 3600, '7天': 7 * 24 * 3600}
+    METRIC_NAMES = {
+        'total': '在线人数',
+        'total_pv_for_anchor': '累计观看人次',
+        'display_value': '显示人数',
+        'likes': '点赞/秒',
+        'diamonds': '钻石/秒',
+    }
+    PADDING = (60, 15, 15, 25)  # 左、上、右、下
+
+    def __init__(self, parent, history, refresh_interval=2000):
+        """
+        :param history: analytics.history.History
+        :param refresh_interval: 自动刷新间隔(毫秒)
+        """
+        self.history = history
+        self.refresh_interval = refresh_interval
+        self.frame = ttk.Frame(parent, padding="5")
+
+        controls = ttk.Frame(self.frame)
+        controls.pack(fill="x")
+        ttk.Label(controls, text="直播间:").pack(side="left")
+        self.room_var = tk.StringVar()
+        self.room_box = ttk.Combobox(controls, textvariable=self.room_var, width=22, state="readonly")
+        self.room_box.pack(side="left", padx=5)
+        ttk.Label(controls, text="指标:").pack(side="left")
+        self.metric_var = tk.StringVar(value=self.METRIC_NAMES['total'])
+        ttk.Combobox(controls, textvariable=self.metric_var, values=list(self.METRIC_NAMES.values()), width=12,
+                     state="readonly").pack(side="left", padx=5)
+        ttk.Label(controls, text="范围:").pack(side="left")
+        self.range_var = tk.StringVar(value='1小时')
+        ttk.Combobox(controls, textvariable=self.range_var, values=list(self.RANGES), width=8,
+                     state="readonly").pack(side="left", padx=5)
+        for var in (self.room_var, self.metric_var, self.range_var):
+            var.trace_add('write', lambda *_: self.draw())
+
+        self.canvas = tk.Canvas(self.frame, background="white", highlightthickness=0)
+        self.canvas.pack(fill="both", expand=True, pady=(5, 0))
+        self.canvas.bind('<Configure>', lambda _: self.draw())
+        self.refresh()
+
+    def refresh(self):
+        if not self.frame.winfo_exists():
+            return
+        rooms = [str(room_id) for room_id in self.history.rooms()]
+        self.room_box.configure(values=rooms)
+        if rooms and self.room_var.get() not in rooms:
+            self.room_var.set(rooms[0])  # 触发draw
+        else:
+            self.draw()
+        self.frame.after(self.refresh_interval, self.refresh)
+
+    def _room_id(self):
+        selected = self.room_var.get()
+        for room_id in self.history.rooms():
+            if str(room_id) == selected:
+                return room_id
+        return None
+
+    def draw(self):
+        canvas = self.canvas
+        canvas.delete('all')
+        width, height = canvas.winfo_width(), canvas.winfo_height()
+        left, top, right, bottom = self.PADDING
+        plot_width, plot_height = width - left - right, height - top - bottom
+        room_id = self._room_id()
+        if room_id is None or plot_width < 10 or plot_height < 10:
+            canvas.create_text(width / 2, height / 2, text="暂无数据", fill="gray")
+            return
+        metric = next(key for key, name in self.METRIC_NAMES.items() if name == self.metric_var.get())
+        seconds = self.RANGES[self.range_var.get()]
+        start, resolution, values = self.history.series(room_id, metric, seconds, points=plot_width)
+        points = [(i, value) for i, value in enumerate(values) if value is not None]
+        if len(points) < 2:
+            canvas.create_text(width / 2, height / 2, text="暂无数据", fill="gray")
+            return
+
+        low = min(value for _, value in points)
+        high = max(value for _, value in points)
+        if high == low:
+            high = low + 1
+        x_scale = plot_width / len(values)
+        y_scale = plot_height / (high - low)
+        coords = []
+        for i, value in points:
+            coords.append(left + (i + 0.5) * x_scale)
+            coords.append(top + (high - value) * y_scale)
+
+        canvas.create_rectangle(left, top, left + plot_width, top + plot_height, outline="#cccccc")
+        canvas.create_line(*coords, fill="#1f77b4", width=1.5)
+        for value, y in ((high, top), (low, top + plot_height)):
+            canvas.create_text(left - 5, y, text=self._format(value), anchor="e", fill="gray")
+        time_format = '%H:%M' if seconds <= 24 * 3600 else '%m-%d %H:%M'
+        for t, x, anchor in ((start, left, "nw"), (start + len(values) * resolution, left + plot_width, "ne")):
+            canvas.create_text(x, top + plot_height + 5, text=time.strftime(time_format, time.localtime(t)),
+                               anchor=anchor, fill="gray")
+        latest = points[-1][1]
+        canvas.create_text(left + plot_width - 5, top + 5, anchor="ne",
+                           text=f"{self.metric_var.get()}: {self._format(latest)}  (每点{resolution}秒)")
+
+    @staticmethod
+    def _format(value):
+        return f"{value:,.0f}" if value >= 100 else f"{value:.2f}"
 
 
 class DouyinLiveApp:
+    # 每个日志框保留的最多行数，超出时删除最早的行，长时间运行内存不会无限增长
+    max_log_lines = 1000
+
     def __init__(self, root):
+        importTk()
+        from analytics.history import History
+        from sinks.search import ChatSearchIndex
+
         self.root = root
         self.root.title("抖音直播间监控工具")
         self.root.geometry("1200x800")
@@ -495,9 +922,17 @@ class DouyinLiveApp:
             "WEBSOCKET": "连接状态",
             "HEARTBEAT": "心跳检测",
             "ERROR": "错误信息",
-            "WARN": "警告信息"
+            "WARN": "警告信息",
+            "ALERT": "关键词告警"
         }
 
+        # 弹幕全文检索索引
+        self.search_index = ChatSearchIndex("chat_search.db")
+        # 人数和互动速率的历史曲线
+        self.history = History()
+        # 关键词告警词表文件，未选择时不扫描弹幕
+        self.keywords_path = None
+
         # 创建UI
         self.create_widgets()
 
@@ -530,8 +965,11 @@ class DouyinLiveApp:
         ttk.Button(button_frame, text="开始直播间数据监控", command=self.start_monitor).grid(row=0, column=2, padx=5)
         ttk.Button(button_frame, text="停止监控", command=self.stop_monitor).grid(row=0, column=3, padx=5)
         ttk.Button(button_frame, text="清空日志", command=self.clear_logs).grid(row=0, column=4, padx=5)
+        ttk.Button(button_frame, text="搜索弹幕", command=self.search_chat).grid(row=0, column=5, padx=5)
+        ttk.Button(button_frame, text="人数曲线", command=self.show_history).grid(row=0, column=6, padx=5)
+        ttk.Button(button_frame, text="关键词告警", command=self.choose_keywords).grid(row=0, column=7, padx=5)
 
-        # 创建4x3网格的日志框
+        # 创建4x3网格的日志框，下方是横跨三列的关键词告警
         self.log_frames = {}
         self.log_texts = {}
 
@@ -548,19 +986,21 @@ class DouyinLiveApp:
             (3, 2, "RANK"),  # 用户数据信息
             (4, 0, "ROOM"),  # 房间信息
             (4, 1, "ADAPTATION"),  # 流配置
-            (4, 2, "ERROR")  # 错误信息
+            (4, 2, "ERROR"),  # 错误信息
+            (5, 0, "ALERT")  # 关键词告警
         ]
 
         for row, col, log_type in log_positions:
+            wide = log_type == "ALERT"
             frame = ttk.LabelFrame(self.root, text=self.log_types[log_type])
-            frame.grid(row=row, column=col, padx=5, pady=5, sticky="nsew")
+            frame.grid(row=row, column=col, columnspan=3 if wide else 1, padx=5, pady=5, sticky="nsew")
 
             # 创建带滚动条的文本框
             text_area = scrolledtext.ScrolledText(
                 frame,
                 wrap=tk.WORD,
                 width=40,
-                height=10,
+                height=5 if wide else 10,
                 state='disabled'
             )
             text_area.pack(fill="both", expand=True)
@@ -569,7 +1009,7 @@ class DouyinLiveApp:
             self.log_texts[log_type] = text_area
 
         # 配置网格行列权重
-        for i in range(1, 5):
+        for i in range(1, 6):
             self.root.rowconfigure(i, weight=1)
         for i in range(3):
             self.root.columnconfigure(i, weight=1)
@@ -580,9 +1020,41 @@ class DouyinLiveApp:
             text_area = self.log_texts[log_type]
             text_area.config(state='normal')
             text_area.insert(tk.END, message + "\n")
+            lines = int(text_area.index('end-1c').split('.')[0])
+            if lines > self.max_log_lines:
+                text_area.delete('1.0', f'{lines - self.max_log_lines}.0')
             text_area.see(tk.END)  # 滚动到底部
             text_area.config(state='disabled')
 
+    def create_fetcher(self):
+        """创建直播监控器，连击礼物、点赞和进场消息合并后再显示"""
+        stages = [Coalescer()]
+        if self.keywords_path:
+            from stages.keywords import KeywordAlerter
+            stages.append(KeywordAlerter(self.keywords_path))
+        return DouyinLiveWebFetcher(self.live_id, self.log_message, stages=stages,
+                                    sinks=[self.search_index, self.history])
+
+    def choose_keywords(self):
+        """选择关键词词表文件(每行一个)，命中的弹幕显示在关键词告警框中，文件修改后自动重新加载"""
+        path = filedialog.askopenfilename(title="选择关键词文件", parent=self.root,
+                                          filetypes=[("文本文件", "*.txt"), ("所有文件", "*.*")])
+        if not path:
+            return
+        from stages.keywords import KeywordAlerter
+        try:
+            alerter = KeywordAlerter(path)
+        except (OSError, UnicodeDecodeError) as e:
+            messagebox.showerror("错误", f"无法读取关键词文件: {e}")
+            return
+        self.keywords_path = path
+        if self.fetcher:
+            # 替换已有监控器中的告警阶段，监控中也立即生效
+            with self.fetcher._pipeline_lock:
+                self.fetcher.stages = [stage for stage in self.fetcher.stages
+                                       if not isinstance(stage, KeywordAlerter)] + [alerter]
+        self.log_message("ALERT", f"已加载{len(alerter.automaton)}个关键词: {path}")
+
     def get_status(self):
         """获取直播间状态"""
         self.live_id = self.live_id_entry.get().strip()
@@ -591,7 +1063,7 @@ class DouyinLiveApp:
             return
 
         if not self.fetcher or self.fetcher.live_id != self.live_id:
-            self.fetcher = DouyinLiveWebFetcher(self.live_id, self.log_message)
+            self.fetcher = self.create_fetcher()
 
         success, status, nickname, user_id = self.fetcher.get_room_status()
         if success:
@@ -613,7 +1085,7 @@ class DouyinLiveApp:
             return
 
         if not self.fetcher or self.fetcher.live_id != self.live_id:
-            self.fetcher = DouyinLiveWebFetcher(self.live_id, self.log_message)
+            self.fetcher = self.create_fetcher()
 
         accounts = self.fetcher.get_audience_ranklist(self.anchor_id)
 
@@ -660,7 +1132,7 @@ class DouyinLiveApp:
 
         # 创建或更新监控器
         if not self.fetcher or self.fetcher.live_id != self.live_id:
-            self.fetcher = DouyinLiveWebFetcher(self.live_id, self.log_message)
+            self.fetcher = self.create_fetcher()
 
         # 先获取房间状态
         success, status, nickname, user_id = self.fetcher.get_room_status()
@@ -685,6 +1157,44 @@ class DouyinLiveApp:
             self.fetcher.stop()
             self.log_message("STATUS", "直播间监控已停止")
 
+    def search_chat(self):
+        """搜索历史弹幕"""
+        keyword = simpledialog.askstring("搜索弹幕", "关键词(多个关键词用空格分隔):", parent=self.root)
+        if not keyword or not keyword.strip():
+            return
+
+        self.search_index.flush()
+        rows = self.search_index.search(keyword.strip(), limit=500)
+        if not rows:
+            messagebox.showinfo("提示", f"未找到包含“{keyword}”的弹幕")
+            return
+
+        result_window = tk.Toplevel(self.root)
+        result_window.title(f"弹幕搜索: {keyword}（{len(rows)}条）")
+        result_window.geometry("800x400")
+
+        tree = ttk.Treeview(result_window, columns=("时间", "直播间", "昵称", "内容"), show="headings")
+        for column, width in (("时间", 150), ("直播间", 120), ("昵称", 150), ("内容", 380)):
+            tree.heading(column, text=column)
+            tree.column(column, width=width)
+
+        scrollbar = ttk.Scrollbar(result_window, orient="vertical", command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+
+        scrollbar.pack(side="right", fill="y")
+        tree.pack(fill="both", expand=True)
+
+        for row in rows:
+            created = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(row['create_time'] / 1000))
+            tree.insert("", "end", values=(created, row['room_id'], row['nick_name'], row['content']))
+
+    def show_history(self):
+        """显示在线人数、点赞和礼物速率的历史曲线"""
+        chart_window = tk.Toplevel(self.root)
+        chart_window.title("直播间历史曲线")
+        chart_window.geometry("900x400")
+        HistoryChart(chart_window, self.history).frame.pack(fill="both", expand=True)
+
     def clear_logs(self):
         """清空所有日志"""
         for text_area in self.log_texts.values():
@@ -698,12 +1208,15 @@ class DouyinLiveApp:
         if self.fetcher and self.fetcher.running:
             if messagebox.askokcancel("退出", "监控正在运行，确定要退出吗？"):
                 self.fetcher.stop()
+                self.search_index.close()
                 self.root.destroy()
         else:
+            self.search_index.close()
             self.root.destroy()
 
 
 if __name__ == '__main__':
+    importTk()
     root = tk.Tk()
     app = DouyinLiveApp(root)
     root.mainloop()
\ No newline at end of file
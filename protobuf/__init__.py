@@ -0,0 +1,188 @@
+# coding:utf-8
+
+"""
+douyin.proto 消息类按需加载
+
+    from protobuf import PushFrame, Response, ChatMessage
+    from protobuf.douyin import PushFrame      # 与上面是同一个类
+
+douyin.py 一次定义全部约70个betterproto数据类，导入时间主要花在创建这些类上。
+这里通过模块 __getattr__ 在首次访问时才从 douyin.py 中取出对应类(及其字段引用到的类)的定义执行，
+只解码聊天和礼物的进程不再为其余消息类付出导入时间和内存。
+类定义执行在预先登记的 protobuf.douyin 模块中，两种导入方式得到同一批类，
+betterproto按 cls.__module__ 找到该模块解析字符串形式的前向引用。
+类定义的索引和编译结果缓存在 __pycache__ 中，douyin.py 变化后自动重建；
+加载时同时初始化betterproto的字段解码元数据，首次解码不再额外计算。
+
+    python -m protobuf    # 对比整体导入与按需加载的耗时
+"""
+
+import marshal
+import os
+import re
+import sys
+import threading
+import time
+import types
+from dataclasses import dataclass
+from typing import Dict, List, get_type_hints
+
+import betterproto
+
+_SOURCE = os.path.join(os.path.dirname(__file__), 'douyin.py')
+_CACHE = os.path.join(os.path.dirname(__file__), '__pycache__',
+                      f'douyin.lazy.{sys.implementation.cache_tag}.marshal')
+_WORD = re.compile(r'\w+')
+
+_lock = threading.RLock()
+_index = None
+_stats = {'index_time': 0.0, 'index_cached': False, 'load_time': 0.0, 'loaded': []}
+
+
+def _source_key():
+    st = os.stat(_SOURCE)
+    return st.st_mtime_ns, st.st_size
+
+
+def _build_index():
+    """
+    解析douyin.py: 每个顶层类单独编译，并记录其字段引用的其他类
+    :return: {类名: (依赖类名元组, code对象)}
+    """
+    import ast
+
+    with open(_SOURCE, encoding='utf-8') as f:
+        tree = ast.parse(f.read(), _SOURCE)
+    classes = [node for node in tree.body if isinstance(node, ast.ClassDef)]
+    names = {node.name for node in classes}
+    index = {}
+    for node in classes:
+        deps = set()
+        for child in ast.walk(node):
+            if isinstance(child, ast.Name):
+                deps.add(child.id)
+            elif isinstance(child, ast.Constant) and isinstance(child.value, str):
+                # 前向引用写成字符串注解，如 "User"、List["Message"]
+                deps.update(_WORD.findall(child.value))
+        deps = tuple(sorted((deps & names) - {node.name}))
+        code = compile(ast.Module(body=[node], type_ignores=[]), _SOURCE, 'exec')
+        index[node.name] = (deps, code)
+    return index
+
+
+def _load_index():
+    global _index
+    if _index is not None:
+        return _index
+    begin = time.perf_counter()
+    key = _source_key()
+    try:
+        with open(_CACHE, 'rb') as f:
+            cached_key, index = marshal.load(f)
+        if tuple(cached_key) != key:
+            raise ValueError
+        _stats['index_cached'] = True
+    except (OSError, ValueError, EOFError, TypeError):
+        index = _build_index()
+        try:
+            os.makedirs(os.path.dirname(_CACHE), exist_ok=True)
+            with open(_CACHE + '.tmp', 'wb') as f:
+                marshal.dump((key, index), f)
+            os.replace(_CACHE + '.tmp', _CACHE)
+        except OSError:
+            pass
+    _index = index
+    _stats['index_time'] = time.perf_counter() - begin
+    return index
+
+
+class _LazyModule(types.ModuleType):
+    """protobuf.douyin: 访问类名时按需加载"""
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(f"module {self.__name__!r} has no attribute {name!r}")
+        return load(name)
+
+    def __dir__(self):
+        return sorted(set(self.__dict__) | set(_load_index()))
+
+
+douyin = _LazyModule(__name__ + '.douyin', "douyin.proto 消息类(按需加载)")
+douyin.__file__ = _SOURCE
+douyin.__package__ = __name__
+# douyin.py 中类定义引用的模块级名称
+douyin.__dict__.update(dataclass=dataclass, Dict=Dict, List=List, betterproto=betterproto)
+sys.modules[douyin.__name__] = douyin
+
+
+def _define(name, namespace, loading):
+    if name in namespace or name in loading:
+        return
+    loading.add(name)
+    deps, code = _load_index()[name]
+    # 字段类型在首次解码时才解析，依赖类必须先于使用者可见
+    for dep in deps:
+        _define(dep, namespace, loading)
+    exec(code, namespace)
+    _stats['loaded'].append(name)
+
+
+def load(name):
+    """
+    加载消息类及其依赖
+    :param name: 类名，如 ChatMessage
+    """
+    namespace = douyin.__dict__
+    cls = namespace.get(name)
+    if cls is not None:
+        return cls
+    if name not in _load_index():
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with _lock:
+        begin = time.perf_counter()
+        loaded = len(_stats['loaded'])
+        _define(name, namespace, set())
+        package = globals()
+        for new_name in _stats['loaded'][loaded:]:
+            cls = package[new_name] = namespace[new_name]
+            if issubclass(cls, betterproto.Message):
+                # betterproto解码每个字段时都用 get_type_hints 重新解析整个类的注解，
+                # 这里把字符串形式的前向引用一次性替换为已定义的类，之后的解析不再需要eval
+                hints = get_type_hints(cls, namespace, {})
+                cls.__annotations__ = {field: hints[field] for field in cls.__dict__.get('__annotations__', {})}
+                # 预先计算字段解码元数据
+                cls()
+        _stats['load_time'] += time.perf_counter() - begin
+    return namespace[name]
+
+
+def preload(names=None):
+    """
+    提前加载，如 preload(['ChatMessage', 'GiftMessage'])；默认加载全部
+    """
+    for name in names if names is not None else _load_index():
+        load(name)
+
+
+def import_stats():
+    """
+    :return: 已加载类数/总类数、索引耗时(是否命中缓存)、类定义与元数据耗时
+    """
+    return {
+        'loaded': len(_stats['loaded']),
+        'total': len(_load_index()),
+        'index_time': _stats['index_time'],
+        'index_cached': _stats['index_cached'],
+        'load_time': _stats['load_time'],
+    }
+
+
+def __getattr__(name):
+    if name == '__all__':
+        return list(_load_index())
+    return load(name)
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_load_index()))
@@ -0,0 +1,63 @@
+# coding:utf-8
+
+"""
+导入耗时报告: python -m protobuf
+
+分别在新进程中测量 整体导入douyin.py 与 按需加载 的耗时。
+两者都包含所用消息类首次解码前的元数据初始化(整体导入时发生在第一次解码)，不含betterproto本身的导入。
+"""
+
+import os
+import subprocess
+import sys
+
+# 抓取直播间时解析的消息类
+FETCHER_CLASSES = ('PushFrame', 'Response', 'ChatMessage', 'GiftMessage', 'LikeMessage', 'MemberMessage',
+                   'SocialMessage', 'RoomUserSeqMessage', 'FansclubMessage', 'ControlMessage',
+                   'EmojiChatMessage', 'RoomStatsMessage', 'RoomMessage', 'RoomRankMessage',
+                   'RoomStreamAdaptationMessage')
+
+# protobuf.douyin 已是按需加载的模块，整体导入时直接执行 douyin.py
+_EAGER = """
+import importlib.util, sys, time
+import betterproto
+begin = time.perf_counter()
+spec = importlib.util.spec_from_file_location('douyin', {source!r})
+douyin = sys.modules['douyin'] = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(douyin)
+for name in {names!r}:
+    getattr(douyin, name)()
+print(time.perf_counter() - begin)
+"""
+
+_LAZY = """
+import time, json
+import betterproto
+begin = time.perf_counter()
+import protobuf
+for name in {names!r}:
+    getattr(protobuf, name)()
+elapsed = time.perf_counter() - begin
+print(elapsed, json.dumps(protobuf.import_stats()))
+"""
+
+
+def _run(code, runs=5):
+    results = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+        results.append(output.stdout.split(None, 1))
+    results.sort(key=lambda result: float(result[0]))
+    return results[len(results) // 2]
+
+
+def main():
+    for label, names in (("聊天+礼物", ('PushFrame', 'Response', 'ChatMessage', 'GiftMessage')),
+                         ("抓取直播间全部消息类", FETCHER_CLASSES)):
+        eager = float(_run(_EAGER.format(names=names, source=os.path.join(os.path.dirname(__file__), 'douyin.py')))[0])
+        elapsed, stats = _run(_LAZY.format(names=names))
+        print(f"{label}: 整体导入 {eager * 1000:.1f}ms, 按需加载 {float(elapsed) * 1000:.1f}ms  {stats.strip()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,352 @@
+# coding:utf-8
+
+"""
+NDJSON流式输出，每个事件一行JSON，便于接入现有的日志工具
+
+    NDJSONSink('-')                                   # 标准输出
+    NDJSONSink('logs', compression='gzip', rotate_bytes=256 << 20, rotate_interval=3600)
+
+websocket线程只把事件追加到待写列表；后台写线程按批编码、压缩并写入大缓冲区，
+压缩(zlib/zstd)在写线程中进行，释放GIL，不占用websocket线程。
+写入目录时文件名为 <prefix>-<YYYYmmdd-HHMMSS>-<序号>.ndjson[.gz|.zst]，
+写入中的文件带 .part 后缀，按大小或时间轮转时才改为正式文件名，下游看到的都是完整文件。
+标准输出不轮转。
+
+有 orjson 时用它编码，否则使用标准库 json 的C编码器；zstd压缩需要安装 zstandard。
+吞吐量测试:
+
+    python -m sinks.ndjson --events 200000
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+import zlib
+
+from events import EVENT_FIELDS
+
+EXTENSIONS = {None: '.ndjson', 'gzip': '.ndjson.gz', 'zstd': '.ndjson.zst'}
+
+
+def make_encoder(encoder='auto'):
+    """
+    :param encoder: 'auto'(有orjson时使用orjson)、'orjson' 或 'json'
+    :return: 批量编码函数 encode(events) -> bytes，每个事件一行，以换行结尾
+    """
+    if encoder in ('auto', 'orjson'):
+        try:
+            import orjson
+        except ImportError:
+            if encoder == 'orjson':
+                raise
+        else:
+            dumps = orjson.dumps
+
+            def encode(events):
+                return b'\n'.join(map(dumps, events)) + b'\n'
+
+            return encode
+    dumps = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), check_circular=False).encode
+
+    def encode(events):
+        return ('\n'.join(map(dumps, events)) + '\n').encode('utf-8')
+
+    return encode
+
+
+class _Plain:
+
+    def compress(self, data):
+        return data
+
+    def sync(self):
+        return b''
+
+    def finish(self):
+        return b''
+
+
+class _Gzip:
+
+    def __init__(self, level):
+        # wbits=31 输出gzip格式，可直接用 zcat/gzip -d 读取
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def sync(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class _Zstd:
+
+    def __init__(self, level):
+        import zstandard
+        self._flush_block = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def sync(self):
+        return self._compressor.flush(self._flush_block)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+def _compressor(compression, level):
+    if compression is None:
+        return _Plain()
+    if compression == 'gzip':
+        return _Gzip(6 if level is None else level)
+    if compression == 'zstd':
+        return _Zstd(3 if level is None else level)
+    raise ValueError(f"不支持的压缩算法: {compression}")
+
+
+class NDJSONSink:
+
+    def __init__(self, path='-', prefix='events', compression=None, level=None, rotate_bytes=256 << 20,
+                 rotate_interval=3600.0, batch_size=5000, flush_interval=0.5, buffer_size=1 << 20,
+                 max_pending=500000, encoder='auto', event_types=None):
+        """
+        :param path: 输出目录，'-' 表示标准输出
+        :param prefix: 文件名前缀
+        :param compression: None、'gzip' 或 'zstd'
+        :param level: 压缩级别，默认gzip为6、zstd为3
+        :param rotate_bytes: 单个文件写入多少字节(压缩后)后轮转，None表示不按大小轮转
+        :param rotate_interval: 单个文件最长写入多少秒后轮转，None表示不按时间轮转
+        :param batch_size: 待写事件达到多少条时立即唤醒写线程
+        :param flush_interval: 写线程最长多少秒写一次
+        :param buffer_size: 文件写缓冲区大小(字节)
+        :param max_pending: 待写事件数上限，超出后丢弃新事件(不阻塞websocket线程)
+        :param encoder: 'auto'、'orjson' 或 'json'，见 make_encoder
+        :param event_types: 需要输出的事件类型，默认为全部
+        """
+        self.path = path
+        self.prefix = prefix
+        self.compression = compression
+        self.level = level
+        self.rotate_bytes = rotate_bytes
+        self.rotate_interval = rotate_interval
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer_size = buffer_size
+        self.max_pending = max_pending
+        self.event_types = frozenset(event_types or EVENT_FIELDS)
+        self._encode = make_encoder(encoder)
+        _compressor(compression, level)  # 尽早发现不支持的压缩算法或缺少zstandard
+        self._pending = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._written_seq = 0
+        self._queued_seq = 0
+        self._done = threading.Condition()
+        self._closed = False
+        self._file = None
+        self._part_path = None
+        self._compressor = None
+        self._opened = 0.0
+        self._file_bytes = 0
+        self._seq = 0
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.bytes = 0
+        self.files = 0
+        self.errors = 0
+        if path != '-':
+            os.makedirs(path, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="ndjson-sink")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def write(self, event):
+        if self._closed or event['type'] not in self.event_types:
+            return
+        with self._lock:
+            pending = self._pending
+            if len(pending) >= self.max_pending:
+                self.dropped += 1
+                return
+            pending.append(event)
+            self._queued_seq += 1
+            full = len(pending) >= self.batch_size
+        if full:
+            self._wakeup.set()
+
+    def flush(self, timeout=5.0):
+        """等待已写入的事件全部输出(压缩流同步到可解压的边界)"""
+        if self._closed:
+            return
+        target = self._queued_seq
+        self._wakeup.set()
+        with self._done:
+            self._done.wait_for(lambda: self._written_seq >= target or self._closed, timeout)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join()
+
+    def stats(self):
+        return {
+            'written': self.written,
+            'dropped': self.dropped,
+            'batches': self.batches,
+            'bytes': self.bytes,
+            'files': self.files,
+            'errors': self.errors,
+            'queue_depth': len(self._pending),
+        }
+
+    def _run(self):
+        running = True
+        while running:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            running = not self._closed
+            with self._lock:
+                batch, self._pending = self._pending, []
+                seq = self._queued_seq
+            try:
+                if batch:
+                    self._output(batch)
+                elif self._file is not None and self._due(time.time()):
+                    self._rotate()
+                if self._file is not None:
+                    self._sync()
+            except (OSError, ValueError):
+                # 标准输出的管道被关闭(BrokenPipeError)、磁盘写满等，丢弃本批，下一批重新打开文件
+                self.errors += 1
+                self._abandon()
+            with self._done:
+                self._written_seq = seq
+                self._done.notify_all()
+        self._finish()
+
+    def _output(self, batch):
+        data = self._encode(batch)
+        now = time.time()
+        if self._file is not None and self._due(now):
+            self._rotate()
+        if self._file is None:
+            self._open(now)
+        data = self._compressor.compress(data)
+        self._file.write(data)
+        self._file_bytes += len(data)
+        self.bytes += len(data)
+        self.written += len(batch)
+        self.batches += 1
+
+    def _due(self, now):
+        if self._part_path is None:
+            return False
+        if self.rotate_bytes is not None and self._file_bytes >= self.rotate_bytes:
+            return True
+        return self.rotate_interval is not None and now - self._opened >= self.rotate_interval
+
+    def _open(self, now):
+        self._compressor = _compressor(self.compression, self.level)
+        self._opened = now
+        self._file_bytes = 0
+        if self.path == '-':
+            self._file = sys.stdout.buffer
+            return
+        self._seq += 1
+        name = f"{self.prefix}-{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}-{self._seq:04d}" \
+               f"{EXTENSIONS[self.compression]}"
+        self._part_path = os.path.join(self.path, name + '.part')
+        self._file = open(self._part_path, 'wb', buffering=self.buffer_size)
+
+    def _sync(self):
+        data = self._compressor.sync()
+        if data:
+            self._file.write(data)
+            self._file_bytes += len(data)
+            self.bytes += len(data)
+        self._file.flush()
+
+    def _rotate(self):
+        """结束当前文件，去掉 .part 后缀"""
+        data = self._compressor.finish()
+        if data:
+            self._file.write(data)
+            self.bytes += len(data)
+        self._file.close()
+        os.replace(self._part_path, self._part_path[:-len('.part')])
+        self.files += 1
+        self._file = None
+        self._part_path = None
+
+    def _abandon(self):
+        if self._file is None:
+            return
+        if self._part_path is not None:
+            try:
+                self._file.close()
+            except (OSError, ValueError):
+                pass
+            self._file = None
+            self._part_path = None
+        # 标准输出出错后不再重试，避免每批都写入已关闭的管道
+        elif not self._closed:
+            self._closed = True
+
+    def _finish(self):
+        try:
+            if self._part_path is not None:
+                self._rotate()
+            elif self._file is not None:
+                data = self._compressor.finish()
+                if data:
+                    self._file.write(data)
+                self._file.flush()
+        except (OSError, ValueError):
+            self.errors += 1
+        self._file = None
+
+
+def benchmark(count=200000, compression=None, encoder='auto'):
+    """
+    :return: 每秒输出的行数、每行字节数
+    """
+    import tempfile
+
+    from synthetic import sample_events
+
+    events = sample_events(min(count, 20000))
+    events = (events * (count // len(events) + 1))[:count]
+    with tempfile.TemporaryDirectory() as directory:
+        sink = NDJSONSink(directory, compression=compression, encoder=encoder)
+        begin = time.perf_counter()
+        for event in events:
+            sink.write(event)
+        sink.close()
+        elapsed = time.perf_counter() - begin
+    return count / elapsed, sink.bytes / count, sink.stats()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="NDJSON输出吞吐量测试")
+    parser.add_argument('--events', type=int, default=200000, help="事件条数")
+    parser.add_argument('--encoder', default='auto', choices=('auto', 'orjson', 'json'))
+    args = parser.parse_args()
+    for compression in (None, 'gzip', 'zstd'):
+        try:
+            rate, size, stats = benchmark(args.events, compression, args.encoder)
+        except ImportError as e:
+            print(f"{compression}: 跳过({e})")
+            continue
+        print(f"{compression or '不压缩'}: {rate:,.0f} 行/秒, {size:.1f} 字节/行, 丢弃 {stats['dropped']}")
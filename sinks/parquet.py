@@ -0,0 +1,220 @@
+# coding:utf-8
+
+"""
+Parquet列式归档
+
+事件按类型在内存中以列的形式缓存，按 room_id 和小时分区写成Parquet文件：
+
+    <root>/<type>/room_id=<room_id>/hour=<YYYYMMDDHH>/part-<时间戳>-<序号>.parquet
+
+每个分区各自缓存，某小时的分区在事件时间越过该小时结束加宽限期后才写出，
+小时交界处交替到达的事件不会产生大量小文件。
+分析时通过 read_archive 只读取需要的列，并按分区裁剪。
+依赖 pyarrow，仅在使用本模块时才需要安装。
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from events import EVENT_FIELDS, UINT64_FIELDS, field_type
+
+# 分区字段类型: 不能靠目录名推断，19位的room_id会被推断为字符串；小时YYYYMMDDHH超出int32
+PARTITION_SCHEMA = pa.schema([('room_id', pa.uint64()), ('hour', pa.int64())])
+# 重复度高、适合字典编码的字段
+DICTIONARY_FIELDS = ('nick_name', 'gift_name')
+
+
+def _arrow_type(field):
+    if field in UINT64_FIELDS:
+        return pa.uint64()
+    if field == 'user_ids':
+        return pa.list_(pa.uint64())
+    if field == 'nick_names':
+        return pa.list_(pa.string())
+    if field in DICTIONARY_FIELDS:
+        return pa.dictionary(pa.int32(), pa.string())
+    return {
+        int: pa.int64(),
+        bool: pa.bool_(),
+        float: pa.float64(),
+        str: pa.string(),
+        list: pa.string(),  # 结构不固定的列表以JSON保存
+    }[field_type(field)]
+
+
+def event_schema(event_type):
+    """
+    事件类型对应的Arrow schema(不含分区字段type/room_id)
+    """
+    return pa.schema([(field, _arrow_type(field)) for field in EVENT_FIELDS[event_type]
+                      if field not in ('type', 'room_id')])
+
+
+class _Buffer:
+    __slots__ = ('columns', 'rows', 'created', 'hour_end')
+
+    def __init__(self, fields, hour):
+        self.columns = {field: [] for field in fields}
+        self.rows = 0
+        self.created = time.time()
+        # 分区小时结束的时间(毫秒)
+        self.hour_end = (time.mktime(time.strptime(hour, '%Y%m%d%H')) + 3600) * 1000
+
+
+class ParquetArchiveSink:
+
+    def __init__(self, root, flush_rows=100000, flush_interval=300.0, event_types=None, compression='zstd',
+                 grace=120.0, log_callback=None):
+        """
+        :param root: 归档根目录
+        :param flush_rows: 单个分区缓存多少行写一个文件
+        :param flush_interval: 单个分区缓存最长多少秒写一个文件
+        :param event_types: 需要归档的事件类型，默认为全部
+        :param compression: Parquet压缩算法
+        :param grace: 事件时间越过分区小时结束多少秒后写出该分区，等待迟到的事件
+        :param log_callback: 日志回调函数 log_callback(log_type, message)，默认输出到标准错误
+        """
+        self.root = root
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.compression = compression
+        self.grace = grace
+        self.log_callback = log_callback
+        self.event_types = frozenset(event_types or EVENT_FIELDS)
+        self._schemas = {event_type: event_schema(event_type) for event_type in self.event_types}
+        self._buffers = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="parquet-sink")
+        self._seq = 0
+        # 已见到的最大事件时间(毫秒)，用于判断分区的小时是否已结束
+        self._watermark = 0
+        self._rotated = 0.0
+        self.rows_written = 0
+        self.files_written = 0
+        self.rows_failed = 0
+        self.errors = 0
+
+    def write(self, event):
+        event_type = event['type']
+        if event_type not in self.event_types:
+            return
+        created = event.get('create_time') or time.time() * 1000
+        hour = time.strftime('%Y%m%d%H', time.localtime(created / 1000))
+        key = (event_type, event['room_id'], hour)
+        schema = self._schemas[event_type]
+        with self._lock:
+            if created > self._watermark:
+                self._watermark = created
+            buffer = self._buffers.get(key)
+            if buffer is None:
+                buffer = self._buffers[key] = _Buffer(schema.names, hour)
+            for field, column in buffer.columns.items():
+                column.append(event.get(field))
+            buffer.rows += 1
+            if buffer.rows >= self.flush_rows:
+                self._submit(key, self._buffers.pop(key))
+            now = time.time()
+            if now - self._rotated >= 1.0:
+                self._rotated = now
+                self._rotate(now)
+
+    def flush(self):
+        """写出全部缓存并等待完成"""
+        with self._lock:
+            futures = [self._submit(key, buffer) for key, buffer in self._buffers.items()]
+            self._buffers.clear()
+        # 写入失败已由回调记录
+        wait(futures)
+
+    def close(self):
+        self.flush()
+        self._executor.shutdown(wait=True)
+
+    def stats(self):
+        return {
+            'rows_written': self.rows_written,
+            'files_written': self.files_written,
+            'rows_failed': self.rows_failed,
+            'errors': self.errors,
+            'buffered_rows': sum(buffer.rows for buffer in list(self._buffers.values())),
+            'partitions': len(self._buffers),
+        }
+
+    def log(self, log_type, message):
+        if self.log_callback:
+            self.log_callback(log_type, message)
+        else:
+            print(f"[PARQUET][{log_type}] {message}", file=sys.stderr, flush=True)
+
+    def _rotate(self, now):
+        """写出小时已结束超过宽限期或缓存过久的分区"""
+        closed = self._watermark - self.grace * 1000
+        for key in [key for key, buffer in self._buffers.items()
+                    if buffer.hour_end <= closed or now - buffer.created >= self.flush_interval]:
+            self._submit(key, self._buffers.pop(key))
+
+    def _submit(self, key, buffer):
+        self._seq += 1
+        future = self._executor.submit(self._writeFile, key, buffer, self._seq)
+        future.add_done_callback(lambda future: self._written(future, key, buffer))
+        return future
+
+    def _written(self, future, key, buffer):
+        error = future.exception()
+        if error is None:
+            return
+        self.errors += 1
+        self.rows_failed += buffer.rows
+        event_type, room_id, hour = key
+        self.log("ERROR", f"写入 {event_type}/room_id={room_id}/hour={hour} 失败，丢弃{buffer.rows}行: {error!r}")
+
+    def _writeFile(self, key, buffer, seq):
+        event_type, room_id, hour = key
+        schema = self._schemas[event_type]
+        arrays = []
+        for field in schema.names:
+            values = buffer.columns[field]
+            if schema.field(field).type == pa.string() and field_type(field) is list:
+                values = [json.dumps(value, ensure_ascii=False) for value in values]
+            arrays.append(pa.array(values, type=schema.field(field).type))
+        table = pa.Table.from_arrays(arrays, schema=schema)
+
+        directory = os.path.join(self.root, event_type, f"room_id={room_id}", f"hour={hour}")
+        os.makedirs(directory, exist_ok=True)
+        name = f"part-{int(time.time() * 1000)}-{seq}.parquet"
+        # 先写以.开头的临时文件再改名，读取方不会看到写了一半的文件
+        temp_path = os.path.join(directory, f".{name}.tmp")
+        pq.write_table(table, temp_path, compression=self.compression,
+                       use_dictionary=[field for field in DICTIONARY_FIELDS if field in schema.names])
+        os.replace(temp_path, os.path.join(directory, name))
+        self.rows_written += buffer.rows
+        self.files_written += 1
+
+
+def read_archive(root, event_type, columns=None, room_ids=None, hours=None):
+    """
+    读取归档数据，只读取指定列，并按room_id/小时分区裁剪
+    :param root: 归档根目录
+    :param event_type: 事件类型，如 chat、gift
+    :param columns: 需要的列，None表示全部
+    :param room_ids: 只读取这些直播间
+    :param hours: 只读取这些小时，格式 YYYYMMDDHH
+    :return: pyarrow.Table
+    """
+    path = os.path.join(root, event_type)
+    dataset = ds.dataset(path, format='parquet', partitioning=ds.partitioning(PARTITION_SCHEMA, flavor='hive'))
+    expression = None
+    if room_ids:
+        expression = ds.field('room_id').isin([int(room_id) for room_id in room_ids])
+    if hours:
+        hour_filter = ds.field('hour').isin([int(hour) for hour in hours])
+        expression = hour_filter if expression is None else expression & hour_filter
+    return dataset.to_table(columns=columns, filter=expression)
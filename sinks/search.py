@@ -0,0 +1,212 @@
+# coding:utf-8
+
+"""
+弹幕全文检索
+
+聊天内容(ChatMessage.content、EmojiChatMessage.default_content)增量写入SQLite FTS5索引，
+支持关键词+时间范围+直播间/用户过滤查询。
+
+FTS5自带的unicode61分词会把一整段中文当作一个词，这里先把中文切成重叠的二元组，
+每段中文末尾再补一个单字：
+    "主播好漂亮" -> 主播 播好 好漂 漂亮 亮
+查询时关键词按相同规则切分后做短语匹配，单字关键词用前缀匹配，任意长度的子串都能命中。
+
+命令行用法:
+    python -m sinks.search chat_search.db 关键词 [--room ROOM_ID] [--since 2025-07-20] [--until ...]
+"""
+
+import argparse
+import re
+import sqlite3
+import time
+
+from sinks.sqlite import SQLiteSink, _column
+
+_CJK = '\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff'
+_TOKEN = re.compile(f'([{_CJK}]+)|([^\\W{_CJK}]+)')
+
+SEARCH_TYPES = ('chat', 'emoji_chat')
+
+
+def tokenize(text):
+    """
+    文档分词: 中文二元组+段尾单字，其他按词
+    """
+    tokens = []
+    for cjk, word in _TOKEN.findall(text or ''):
+        if cjk:
+            tokens.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+            tokens.append(cjk[-1])
+        else:
+            tokens.append(word.lower())
+    return ' '.join(tokens)
+
+
+def match_query(keyword):
+    """
+    关键词转换为FTS5查询表达式，多个关键词用空格分隔，需同时命中
+    """
+    phrases = []
+    for part in keyword.split():
+        pieces = _TOKEN.findall(part)
+        tokens = []
+        prefix = False
+        for index, (cjk, word) in enumerate(pieces):
+            last = index == len(pieces) - 1
+            if word:
+                tokens.append(word.lower())
+            elif len(cjk) == 1 and last:
+                # 单字可能出现在文档中某个二元组的开头
+                tokens.append(cjk)
+                prefix = True
+            else:
+                tokens.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+                if not last:
+                    tokens.append(cjk[-1])
+        if tokens:
+            phrases.append('"' + ' '.join(tokens) + '"' + ('*' if prefix else ''))
+    return ' AND '.join(phrases)
+
+
+class ChatSearchIndex(SQLiteSink):
+
+    def __init__(self, path, batch_size=2000, flush_interval=1.0, queue_size=200000):
+        """
+        :param path: 索引数据库路径
+        :param batch_size: 攒够多少条写一次索引
+        :param flush_interval: 最长多少秒写一次索引
+        :param queue_size: 写队列长度上限
+        """
+        super().__init__(path, batch_size=batch_size, flush_interval=flush_interval, queue_size=queue_size,
+                         event_types=SEARCH_TYPES)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS chat_lines (
+                id INTEGER PRIMARY KEY,
+                room_id INTEGER,
+                user_id INTEGER,
+                nick_name TEXT,
+                content TEXT,
+                create_time INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS chat_lines_time ON chat_lines (create_time);
+            CREATE INDEX IF NOT EXISTS chat_lines_user ON chat_lines (user_id, create_time);
+            CREATE VIRTUAL TABLE IF NOT EXISTS chat_fts USING fts5(content, nick_name, content='');
+        """)
+        conn.commit()
+        # 只有写线程插入数据，行号自行分配即可批量写入两张表
+        self._next_id = (conn.execute("SELECT max(id) FROM chat_lines").fetchone()[0] or 0) + 1
+        return conn, None
+
+    def _commit(self, conn, statements, events):
+        lines = []
+        tokens = []
+        now = int(time.time() * 1000)
+        for row_id, event in enumerate(events, self._next_id):
+            lines.append((row_id, _column(event['room_id']), _column(event['user_id']), event['nick_name'],
+                          event['content'], event['create_time'] or now))
+            tokens.append((row_id, tokenize(event['content']), tokenize(event['nick_name'])))
+        with conn:
+            conn.executemany("INSERT INTO chat_lines VALUES (?, ?, ?, ?, ?, ?)", lines)
+            conn.executemany("INSERT INTO chat_fts (rowid, content, nick_name) VALUES (?, ?, ?)", tokens)
+        self._next_id += len(events)
+        self.written += len(events)
+        self.batches += 1
+
+    def search(self, keyword=None, start=None, end=None, room_id=None, user_id=None, nick_name=None, limit=100):
+        """
+        查询弹幕
+        :param keyword: 内容关键词
+        :param start: 起始时间(毫秒时间戳)
+        :param end: 结束时间(毫秒时间戳)
+        :param room_id: 直播间ID
+        :param user_id: 用户ID
+        :param nick_name: 昵称关键词
+        :param limit: 最多返回条数，按时间倒序
+        :return: [{'room_id', 'user_id', 'nick_name', 'content', 'create_time'}, ...]
+        """
+        return search(self.path, keyword, start, end, room_id, user_id, nick_name, limit)
+
+
+def search(path, keyword=None, start=None, end=None, room_id=None, user_id=None, nick_name=None, limit=100):
+    """查询弹幕索引，参数同 ChatSearchIndex.search"""
+    conditions = []
+    params = []
+    match = []
+    for column, text in (('content', keyword), ('nick_name', nick_name)):
+        if not text:
+            continue
+        query = match_query(text)
+        if not query:
+            # 关键词只有标点等无法分词的字符，什么也匹配不到，不能退化成不带关键词的查询
+            return []
+        match.append(f"{column} : ({query})")
+    if match:
+        sql = ("SELECT c.room_id, c.user_id, c.nick_name, c.content, c.create_time "
+               "FROM chat_fts JOIN chat_lines c ON c.id = chat_fts.rowid WHERE chat_fts MATCH ?")
+        params.append(' AND '.join(match))
+        order = "chat_fts.rowid"
+    else:
+        sql = "SELECT c.room_id, c.user_id, c.nick_name, c.content, c.create_time FROM chat_lines c WHERE 1"
+        order = "c.id"
+    if start is not None:
+        conditions.append("c.create_time >= ?")
+        params.append(start)
+    if end is not None:
+        conditions.append("c.create_time <= ?")
+        params.append(end)
+    if room_id is not None:
+        conditions.append("c.room_id = ?")
+        params.append(_column(int(room_id)))
+    if user_id is not None:
+        conditions.append("c.user_id = ?")
+        params.append(_column(int(user_id)))
+    for condition in conditions:
+        sql += " AND " + condition
+    sql += f" ORDER BY {order} DESC LIMIT ?"
+    params.append(limit)
+
+    conn = sqlite3.connect(path)
+    try:
+        columns = ('room_id', 'user_id', 'nick_name', 'content', 'create_time')
+        return [dict(zip(columns, row)) for row in conn.execute(sql, params)]
+    finally:
+        conn.close()
+
+
+def _parse_time(value):
+    if value is None:
+        return None
+    if value.isdigit():
+        return int(value)
+    fmt = '%Y-%m-%d %H:%M:%S' if ' ' in value else '%Y-%m-%d'
+    return int(time.mktime(time.strptime(value, fmt)) * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="弹幕全文检索")
+    parser.add_argument('db', help="索引数据库路径")
+    parser.add_argument('keyword', nargs='?', help="内容关键词，多个关键词用空格分隔")
+    parser.add_argument('--nick', help="昵称关键词")
+    parser.add_argument('--room', help="直播间ID")
+    parser.add_argument('--user', help="用户ID")
+    parser.add_argument('--since', help="起始时间，如 2025-07-20 或 '2025-07-20 20:00:00'")
+    parser.add_argument('--until', help="结束时间")
+    parser.add_argument('--limit', type=int, default=100)
+    args = parser.parse_args()
+
+    begin = time.perf_counter()
+    rows = search(args.db, args.keyword, _parse_time(args.since), _parse_time(args.until), args.room, args.user,
+                  args.nick, args.limit)
+    for row in rows:
+        created = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(row['create_time'] / 1000))
+        print(f"{created} [{row['room_id']}][{row['user_id']}]{row['nick_name']}: {row['content']}")
+    print(f"共{len(rows)}条, 耗时{(time.perf_counter() - begin) * 1000:.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
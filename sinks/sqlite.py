@@ -0,0 +1,160 @@
+# coding:utf-8
+
+"""
+SQLite事件存储
+
+每种事件一张表，WAL模式；websocket线程只负责入队，
+由独立的写线程按条数或时间批量 executemany 提交。
+"""
+
+import json
+import queue
+import sqlite3
+import threading
+import time
+
+from events import EVENT_FIELDS, UINT64_FIELDS, field_type
+
+SQL_TYPES = {int: 'INTEGER', bool: 'INTEGER', float: 'REAL', str: 'TEXT', list: 'TEXT'}
+
+
+def sql_type(field):
+    if field in UINT64_FIELDS:
+        # 不声明类型(无类型亲和性): INTEGER列会把超出int64的数字文本转成REAL而丢失精度
+        return ''
+    return SQL_TYPES[field_type(field)]
+
+
+def table_name(event_type):
+    return f"{event_type}_events"
+
+
+class SQLiteSink:
+
+    def __init__(self, path, batch_size=2000, flush_interval=1.0, queue_size=200000, event_types=None):
+        """
+        :param path: 数据库文件路径
+        :param batch_size: 攒够多少条提交一次
+        :param flush_interval: 最长多少秒提交一次
+        :param queue_size: 写队列长度上限，写满后丢弃新事件(不阻塞websocket线程)
+        :param event_types: 需要保存的事件类型，默认为全部
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.event_types = frozenset(event_types or EVENT_FIELDS)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._closed = False
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.errors = 0
+        self._thread = threading.Thread(target=self._run, name="sqlite-sink")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def write(self, event):
+        if event['type'] not in self.event_types or self._closed:
+            return
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self, timeout=5.0):
+        """等待已入队的事件全部写入"""
+        if self._closed:
+            return
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return
+        done.wait(timeout)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def stats(self):
+        return {
+            'written': self.written,
+            'dropped': self.dropped,
+            'batches': self.batches,
+            'errors': self.errors,
+            'queue_depth': self._queue.qsize(),
+        }
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        statements = {}
+        for event_type in self.event_types:
+            fields = EVENT_FIELDS[event_type][1:]
+            columns = ", ".join(f"{field} {sql_type(field)}".rstrip() for field in fields)
+            table = table_name(event_type)
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({columns})")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_room_time ON {table} (room_id, create_time)")
+            placeholders = ", ".join("?" * len(fields))
+            statements[event_type] = (f"INSERT INTO {table} VALUES ({placeholders})", fields)
+        conn.commit()
+        return conn, statements
+
+    def _run(self):
+        conn, statements = self._connect()
+        pending = []
+        waiters = []
+        deadline = time.monotonic() + self.flush_interval
+        running = True
+        while running:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = False
+            if item is None:
+                running = False
+            elif isinstance(item, threading.Event):
+                waiters.append(item)
+            elif item is not False:
+                pending.append(item)
+                if len(pending) < self.batch_size and time.monotonic() < deadline:
+                    continue
+            if pending:
+                try:
+                    self._commit(conn, statements, pending)
+                except sqlite3.Error:
+                    self.errors += 1
+                pending = []
+            for waiter in waiters:
+                waiter.set()
+            waiters = []
+            deadline = time.monotonic() + self.flush_interval
+        conn.close()
+
+    def _commit(self, conn, statements, events):
+        rows = {}
+        for event in events:
+            rows.setdefault(event['type'], []).append(event)
+        with conn:
+            for event_type, group in rows.items():
+                sql, fields = statements[event_type]
+                conn.executemany(sql, [tuple(_column(event.get(field)) for field in fields) for event in group])
+        self.written += len(events)
+        self.batches += 1
+
+
+INT64_MAX = 2 ** 63 - 1
+
+
+def _column(value):
+    if isinstance(value, list):
+        return json.dumps(value, ensure_ascii=False)
+    if isinstance(value, int) and value > INT64_MAX:
+        # SQLite整数为有符号64位，超出范围的uint64以文本保存
+        return str(value)
+    return value
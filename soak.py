@@ -0,0 +1,309 @@
+#!/usr/bin/python
+# coding:utf-8
+
+"""
+内存浸泡测试: 用合成的websocket帧长时间驱动抓取对象，检查进程内存是否有上限
+
+    python soak.py [--rooms 4] [--hours 4] [--warmup-hours 1.5] [--budget-mb 8] [--users 20000] [--gui]
+
+帧由 synthetic.SyntheticRoom 按直播间协议编码(PushFrame -> gzip Response -> 各类消息)，直接交给 _wsOnMessage，
+经过去重、变化检测、合并/关键词阶段和各分析sink，不连接网络。
+time.time() 替换为模拟时钟，每帧前进 frame_interval/rooms 秒，
+按时间淘汰的状态(会话、计数窗口、去重)都会真实地过期。解码受betterproto限制约每秒七百条消息，
+默认参数(4个直播间、每秒各20条、模拟4小时)不开tracemalloc(--trace-frames 0)约需半小时，开启时慢4倍左右。
+按模拟时间均匀采样 RSS、tracemalloc 跟踪的内存和线程数；预热(需长于会话ttl等保留时间)之后按最小二乘计算
+每百万条消息的内存增长，超过 budget_mb 或线程数增加时以退出码1结束，
+并列出预热结束到测试结束之间内存增长最多的代码位置(有上限的结构在填满之前也会计入增长)。
+--gui 时日志写入隐藏的图形界面文本框(需要显示器)，检查界面日志是否有上限。
+"""
+
+import argparse
+import gc
+import itertools
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from synthetic import SyntheticRoom
+
+KEYWORDS = ('上链接', '多少钱', '翻牌')
+
+
+class SimulatedClock:
+    """在with块内把 time.time() 替换为可手动推进的时钟"""
+
+    def __init__(self, start=None):
+        self.start = self.now = time.time() if start is None else start
+        self._real = None
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+    def __enter__(self):
+        self._real = time.time
+        time.time = self.time
+        return self
+
+    def __exit__(self, *exc):
+        time.time = self._real
+
+
+class _Socket:
+    connected = True
+
+
+class FakeWebSocket:
+    """代替WebSocketApp接收ACK和心跳"""
+    sock = _Socket()
+
+    def __init__(self):
+        self.sent = 0
+
+    def send(self, data, opcode=None):
+        self.sent += 1
+
+    def close(self):
+        pass
+
+
+def rss():
+    """当前常驻内存(字节)，不支持时返回峰值或0"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage if sys.platform == 'darwin' else usage * 1024
+
+
+def slope(points):
+    """最小二乘斜率"""
+    if len(points) < 2:
+        return 0.0
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    var = sum((x - mean_x) ** 2 for x, _ in points)
+    if not var:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / var
+
+
+def build_pipeline():
+    from analytics.counters import MetricsEngine
+    from analytics.hll import UniqueViewers
+    from analytics.sessions import SessionTracker
+    from analytics.topk import TopKTracker
+    from lag import LagTracker
+    from stages.coalesce import Coalescer
+    from stages.keywords import KeywordAlerter
+
+    sinks = [MetricsEngine(), TopKTracker(), SessionTracker(), UniqueViewers()]
+    return (lambda: [Coalescer(), KeywordAlerter(keywords=KEYWORDS)]), sinks, LagTracker(threshold=None)
+
+
+def soak(rooms=4, hours=4.0, warmup_hours=1.5, batch=20, users=20000, frame_interval=1.0, samples=40,
+         reconnect_every=5000, trace_frames=1, top=15, gui=False, on_sample=None):
+    """
+    :param hours: 模拟的直播时长(小时)
+    :param warmup_hours: 预热时长(小时)，缓存和时间窗口在预热期间填满，不计入增长
+    :param frame_interval: 每个直播间两帧之间的模拟时间(秒)
+    :param samples: 采样次数
+    :param reconnect_every: 每隔多少帧模拟一次断线重连，0表示不重连
+    :param trace_frames: tracemalloc记录的调用栈深度，0表示不使用tracemalloc
+    :param top: 报告内存增长最多的代码位置数
+    :param on_sample: 每次采样后的回调 on_sample(sample, 是否预热结束)
+    :return: {'samples': [...], 'rss_per_million': 字节, 'traced_per_million': 字节, 'threads': 增加数, ...}
+    """
+    from liveMan import DouyinLiveWebFetcher
+    from stages.dedup import get_deduplicator
+    from users import get_user_cache
+
+    root = None
+    if gui:
+        import tkinter
+        from liveMan import DouyinLiveApp
+        root = tkinter.Tk()
+        root.withdraw()
+        log = DouyinLiveApp(root).log_message
+    else:
+        def log(log_type, message):
+            pass
+
+    clock = SimulatedClock()
+    ws = FakeWebSocket()
+    make_stages, sinks, lag = build_pipeline()
+    pairs = []
+    for i in range(rooms):
+        room = SyntheticRoom(7000000000000000000 + i, users=users, batch=batch, seed=i)
+        fetcher = DouyinLiveWebFetcher(f"soak{i}", log, stages=make_stages(), sinks=sinks,
+                                       lag=lag)
+        fetcher.restore_checkpoint({'live_id': fetcher.live_id, 'room_id': str(room.room_id), 'cursor': '',
+                                    'internal_ext': '', 'live_cursor': ''})
+        fetcher.deduplicator = get_deduplicator(fetcher.room_id)
+        fetcher.ws = ws
+        fetcher.running = True
+        pairs.append((room, fetcher))
+
+    if trace_frames:
+        tracemalloc.start(trace_frames)
+    step = frame_interval / rooms
+    duration = hours * 3600
+    interval = duration / samples
+    result = {'samples': [], 'baseline': None}
+    baseline = None
+    total = 0
+    next_sample = 0.0
+    began = time.perf_counter()
+
+    with clock:
+        for _, fetcher in pairs:
+            fetcher._wsOnOpen(ws)
+        for index in itertools.count():
+            room, fetcher = pairs[index % rooms]
+            if reconnect_every and index and index % reconnect_every == 0:
+                fetcher._wsOnClose(ws)
+                fetcher._wsOnOpen(ws)
+            before = room.messages
+            fetcher._wsOnMessage(ws, room.frame(clock.now))
+            total += room.messages - before
+            clock.advance(step)
+            if root is not None and index % 50 == 0:
+                root.update()
+
+            simulated = clock.now - clock.start
+            if simulated >= next_sample or simulated >= duration:
+                next_sample += interval
+                gc.collect()
+                sample = {
+                    'messages': total,
+                    'simulated_hours': simulated / 3600,
+                    'rss': rss(),
+                    'traced': tracemalloc.get_traced_memory()[0] if trace_frames else 0,
+                    'threads': threading.active_count(),
+                    'elapsed': time.perf_counter() - began,
+                }
+                result['samples'].append(sample)
+                warmed = baseline is None and simulated >= warmup_hours * 3600
+                if warmed:
+                    baseline = tracemalloc.take_snapshot() if trace_frames else True
+                    result['baseline'] = sample
+                if on_sample:
+                    on_sample(sample, warmed)
+                if simulated >= duration:
+                    break
+        for _, fetcher in pairs:
+            fetcher.stop()
+
+    measured = result['samples'][result['samples'].index(result['baseline']):] if baseline is not None else []
+    result['simulated_hours'] = (clock.now - clock.start) / 3600
+    result['messages'] = total
+    result['rate'] = total / (time.perf_counter() - began)
+    result['rss_per_million'] = slope([(s['messages'], s['rss']) for s in measured]) * 1e6
+    result['traced_per_million'] = slope([(s['messages'], s['traced']) for s in measured]) * 1e6
+    result['threads'] = measured[-1]['threads'] - measured[0]['threads'] if measured else 0
+    result['components'] = [(type(component).__name__, component.stats())
+                            for component in pairs[0][1].stages + sinks + [lag] if hasattr(component, 'stats')]
+    result['components'].append(('UserCache', get_user_cache().stats()))
+    result['components'].append(('dedup', pairs[0][1].deduplicator.stats()))
+
+    result['top'] = []
+    if trace_frames and baseline is not None:
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+        ))
+        key = 'traceback' if trace_frames > 1 else 'lineno'
+        diffs = [diff for diff in snapshot.compare_to(baseline, key) if diff.size_diff > 0]
+        result['top'] = diffs[:top]
+        tracemalloc.stop()
+    if root is not None:
+        root.destroy()
+    return result
+
+
+def _mb(value):
+    return value / (1024 * 1024)
+
+
+def print_sample(sample, warmed):
+    mark = ' <- 预热结束' if warmed else ''
+    print(f"{sample['messages']:>10} {sample['simulated_hours']:>8.2f} {_mb(sample['rss']):>9.1f} "
+          f"{_mb(sample['traced']):>9.1f} {sample['threads']:>4} {sample['elapsed']:>8.1f}{mark}", flush=True)
+
+
+def report(result, budget_mb):
+    """打印汇总，返回是否通过"""
+    print(f"\n共 {result['messages']} 条消息，模拟 {result['simulated_hours']:.2f} 小时，"
+          f"{result['rate']:.0f} 条/秒")
+    print("\n各组件状态:")
+    for name, stats in result['components']:
+        print(f"  {name}: {stats}")
+    if result['top']:
+        print("\n预热后内存增长最多的位置:")
+        for diff in result['top']:
+            frames = diff.traceback.format()
+            print(f"  +{diff.size_diff / 1024:.1f} KiB ({diff.count_diff:+d} 块)  {frames[-2].strip()}: "
+                  f"{frames[-1].strip()}")
+            for line in frames[:-2][-4:]:
+                print(f"      {line.strip()}")
+
+    rss_growth = _mb(result['rss_per_million'])
+    traced_growth = _mb(result['traced_per_million'])
+    print(f"\n每百万条消息内存增长: RSS {rss_growth:.2f}MB, tracemalloc {traced_growth:.2f}MB, "
+          f"预算 {budget_mb}MB; 线程数变化 {result['threads']:+d}")
+    failures = []
+    if rss_growth > budget_mb:
+        failures.append("RSS增长超出预算")
+    if traced_growth > budget_mb:
+        failures.append("tracemalloc增长超出预算")
+    if result['threads'] > 0:
+        failures.append("线程数增加")
+    print("未通过: " + "，".join(failures) if failures else "通过")
+    return not failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="内存浸泡测试")
+    parser.add_argument('--rooms', type=int, default=4, help="直播间数")
+    parser.add_argument('--hours', type=float, default=4.0, help="模拟的直播时长(小时)")
+    parser.add_argument('--warmup-hours', type=float, default=1.5, help="预热时长(小时)，不计入内存增长")
+    parser.add_argument('--batch', type=int, default=20, help="每帧消息数")
+    parser.add_argument('--users', type=int, default=20000, help="观众ID范围，越大用户缓存等有上限的结构填满越慢")
+    parser.add_argument('--frame-interval', type=float, default=1.0, help="每个直播间两帧之间的模拟时间(秒)")
+    parser.add_argument('--samples', type=int, default=40, help="采样次数")
+    parser.add_argument('--reconnect-every', type=int, default=5000, help="每隔多少帧模拟一次断线重连")
+    parser.add_argument('--trace-frames', type=int, default=1,
+                        help="tracemalloc调用栈深度，0表示不使用(更快，只看RSS)")
+    parser.add_argument('--top', type=int, default=15, help="报告内存增长最多的位置数")
+    parser.add_argument('--budget-mb', type=float, default=8.0, help="每百万条消息允许的内存增长(MB)")
+    parser.add_argument('--gui', action='store_true', help="日志写入图形界面文本框")
+    args = parser.parse_args(argv)
+
+    # 图形界面等组件会在当前目录创建数据库，在临时目录中运行
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    cwd = os.getcwd()
+    print(f"{'消息数':>10} {'模拟小时':>8} {'RSS(MB)':>9} {'跟踪(MB)':>9} {'线程':>4} {'耗时(秒)':>8}")
+    with tempfile.TemporaryDirectory(prefix='soak-') as workdir:
+        os.chdir(workdir)
+        try:
+            result = soak(args.rooms, args.hours, args.warmup_hours, args.batch, args.users, args.frame_interval,
+                          args.samples, args.reconnect_every, args.trace_frames, args.top, args.gui, print_sample)
+        finally:
+            os.chdir(cwd)
+    return 0 if report(result, args.budget_mb) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
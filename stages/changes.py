@@ -0,0 +1,114 @@
+# coding:utf-8
+
+"""
+状态类消息的变化检测
+
+直播间统计、排行榜、流配置等消息推送频繁，但内容多数与上一条相同。
+这里对原始payload计算指纹(跳过每条消息都不同的Common头)，
+内容未变化的消息不再解析和输出，同时保存最近一次解析结果供随时查询。
+"""
+
+import hashlib
+import threading
+
+STATE_METHODS = (
+    'WebcastRoomUserSeqMessage',
+    'WebcastRoomStatsMessage',
+    'WebcastRoomRankMessage',
+    'WebcastRoomStreamAdaptationMessage',
+)
+
+
+def _read_varint(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+def payload_fingerprint(payload):
+    """
+    计算payload指纹，跳过字段1(Common，含msg_id/create_time，每条都不同)
+    :return: 8字节摘要
+    """
+    h = hashlib.blake2b(digest_size=8)
+    data = memoryview(payload)
+    pos = 0
+    end = len(data)
+    try:
+        while pos < end:
+            start = pos
+            key, pos = _read_varint(data, pos)
+            wire_type = key & 0x7
+            if wire_type == 0:
+                _, pos = _read_varint(data, pos)
+            elif wire_type == 1:
+                pos += 8
+            elif wire_type == 2:
+                length, pos = _read_varint(data, pos)
+                pos += length
+            elif wire_type == 5:
+                pos += 4
+            else:
+                raise ValueError(f"unsupported wire type {wire_type}")
+            if pos > end:
+                raise ValueError("truncated field")
+            if key >> 3 != 1:
+                h.update(data[start:pos])
+    except (IndexError, ValueError):
+        # 无法按wire格式切分时退化为对整个payload计算
+        h = hashlib.blake2b(payload, digest_size=8)
+    return h.digest()
+
+
+class StateChangeDetector:
+
+    def __init__(self, methods=STATE_METHODS):
+        """
+        :param methods: 需要做变化检测的消息类型
+        """
+        self.methods = frozenset(methods)
+        self._fingerprints = {}
+        self._states = {}
+        self._lock = threading.Lock()
+        self.checks = 0
+        self.unchanged = 0
+
+    def changed(self, method, payload):
+        """
+        判断消息内容相对上一条是否有变化，并记录指纹
+        :return: True表示有变化(或不是状态类消息)，需要解析
+        """
+        if method not in self.methods:
+            return True
+        fingerprint = payload_fingerprint(payload)
+        with self._lock:
+            self.checks += 1
+            if self._fingerprints.get(method) == fingerprint:
+                self.unchanged += 1
+                return False
+            self._fingerprints[method] = fingerprint
+            return True
+
+    def update(self, method, message):
+        """保存最近一次解析得到的状态"""
+        if method in self.methods:
+            self._states[method] = message
+
+    def current(self, method):
+        """
+        :return: 该类消息最近一次的解析结果，尚未收到时为None
+        """
+        return self._states.get(method)
+
+    def stats(self):
+        return {
+            'checks': self.checks,
+            'unchanged': self.unchanged,
+            'skip_rate': self.unchanged / self.checks if self.checks else 0.0,
+        }
@@ -0,0 +1,150 @@
+# coding:utf-8
+
+"""
+高频事件合并
+
+- 连击礼物: 同一 group_id/trace_id 的多条GiftMessage只输出最终一条(repeat_end=1或超时)
+- 点赞、进场: 按时间窗口汇总为 like_summary / member_summary，总数不丢失
+"""
+
+import time
+from collections import OrderedDict
+
+
+class Coalescer:
+
+    def __init__(self, gifts=True, like_window=1.0, member_window=1.0, combo_timeout=10.0, sample_names=5,
+                 ended_combos=10000):
+        """
+        :param gifts: 是否合并连击礼物
+        :param like_window: 点赞汇总窗口(秒)，None表示不合并
+        :param member_window: 进场汇总窗口(秒)，None表示不合并
+        :param combo_timeout: 连击礼物超过该时长(秒)未收到后续消息即输出
+        :param sample_names: 进场汇总中保留的昵称个数
+        :param ended_combos: 记住多少个已结束的连击组，结束后迟到的旧消息直接丢弃
+        """
+        self.gifts = gifts
+        self.like_window = like_window
+        self.member_window = member_window
+        self.combo_timeout = combo_timeout
+        self.sample_names = sample_names
+        self._combos = {}
+        # 已结束的连击组 -> 结束时的连击数，按LRU淘汰
+        self._ended = OrderedDict()
+        self.ended_combos = ended_combos
+        self._windows = {}
+        self.events_in = 0
+        self.events_out = 0
+
+    def process(self, event, now=None):
+        """
+        :return: 需要继续向后传递的事件列表
+        """
+        now = time.time() if now is None else now
+        self.events_in += 1
+        event_type = event['type']
+        if event_type == 'gift' and self.gifts and event['combo']:
+            out = self._combo(event, now)
+        elif event_type == 'like' and self.like_window:
+            out = self._accumulate(event, now, self.like_window)
+        elif event_type == 'member' and self.member_window:
+            out = self._accumulate(event, now, self.member_window)
+        else:
+            out = [event]
+        out.extend(self.tick(now, count=False))
+        self.events_out += len(out)
+        return out
+
+    def tick(self, now=None, count=True):
+        """
+        输出已到期的窗口汇总和超时的连击礼物
+        """
+        now = time.time() if now is None else now
+        out = []
+        for event_type, window in list(self._windows.items()):
+            if now >= window['window_end']:
+                out.append(self._summary(event_type, window))
+                del self._windows[event_type]
+        for key, (event, updated) in list(self._combos.items()):
+            if now - updated >= self.combo_timeout:
+                out.append(event)
+                del self._combos[key]
+        if count:
+            self.events_out += len(out)
+        return out
+
+    def flush(self):
+        """输出所有未完成的合并结果"""
+        out = [self._summary(event_type, window) for event_type, window in self._windows.items()]
+        out.extend(event for event, _ in self._combos.values())
+        self._windows.clear()
+        self._combos.clear()
+        self.events_out += len(out)
+        return out
+
+    def stats(self):
+        return {
+            'events_in': self.events_in,
+            'events_out': self.events_out,
+            'ratio': self.events_in / self.events_out if self.events_out else 0.0,
+            'pending_combos': len(self._combos),
+        }
+
+    def _combo(self, event, now):
+        key = (event['group_id'] or event['trace_id'], event['user_id'], event['gift_id'])
+        ended = self._ended.get(key)
+        if ended is not None and event['combo_count'] <= ended:
+            # 连击已输出，乱序迟到的旧消息不再重新打开，避免重复计数
+            return []
+        pending = self._combos.get(key)
+        end = event['repeat_end'] == 1
+        if pending and pending[0]['combo_count'] > event['combo_count']:
+            # 乱序到达的旧消息，保留更大的连击数，但结束标记以收到的消息为准
+            event = dict(pending[0], repeat_end=event['repeat_end'])
+        if end:
+            self._combos.pop(key, None)
+            self._ended[key] = event['combo_count']
+            self._ended.move_to_end(key)
+            if len(self._ended) > self.ended_combos:
+                self._ended.popitem(last=False)
+            return [event]
+        self._combos[key] = (event, now)
+        return []
+
+    def _accumulate(self, event, now, window_seconds):
+        event_type = event['type']
+        window = self._windows.get(event_type)
+        out = []
+        if window and now >= window['window_end']:
+            out.append(self._summary(event_type, window))
+            window = None
+        if window is None:
+            window = self._windows[event_type] = {
+                'room_id': event['room_id'],
+                'msg_id': event['msg_id'],
+                'create_time': event['create_time'],
+                'count': 0,
+                'users': {},
+                'window_start': now,
+                'window_end': now + window_seconds,
+            }
+        window['count'] += event['count'] if event_type == 'like' else 1
+        window['users'].setdefault(event['user_id'], event['nick_name'])
+        return out
+
+    def _summary(self, event_type, window):
+        users = window['users']
+        summary = {
+            'type': f'{event_type}_summary',
+            'room_id': window['room_id'],
+            'msg_id': window['msg_id'],
+            'create_time': window['create_time'],
+            'count': window['count'],
+            'user_count': len(users),
+            'user_ids': list(users),
+            'window_start': window['window_start'],
+            'window_end': window['window_end'],
+        }
+        if event_type == 'member':
+            summary['nick_names'] = list(users.values())[:self.sample_names]
+        return summary
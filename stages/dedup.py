@@ -0,0 +1,121 @@
+# coding:utf-8
+
+"""
+按 msg_id 去重
+
+断线重连、建连时 need_persist_msg_count 的历史回放、同一直播间的多个会话
+都可能重复推送同一条消息。这里按时间分桶保存最近见过的 msg_id，
+每个直播间的内存上限为 桶数 * 每桶上限。
+"""
+
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+
+import betterproto
+
+from protobuf import Common
+
+
+@dataclass
+class CommonHeader(betterproto.Message):
+    """所有Webcast消息的第1个字段都是Common，只解析这一个字段以取得msg_id"""
+
+    common: Common = betterproto.message_field(1)
+
+
+class MsgIdDeduplicator:
+
+    def __init__(self, ttl=600, bucket_seconds=60, max_per_bucket=100000):
+        """
+        时间分桶的msg_id集合
+        :param ttl: msg_id保留时长(秒)
+        :param bucket_seconds: 每个桶覆盖的时长(秒)
+        :param max_per_bucket: 每个桶最多保存的msg_id数，写满后提前换桶
+        """
+        self.ttl = ttl
+        self.bucket_seconds = bucket_seconds
+        self.max_buckets = max(1, int(ttl // bucket_seconds))
+        self.max_per_bucket = max_per_bucket
+        self._buckets = deque()
+        self._lock = threading.Lock()
+        self.checks = 0
+        self.hits = 0
+
+    def seen(self, msg_id, now=None):
+        """
+        检查并记录msg_id
+        :return: True表示重复消息
+        """
+        if not msg_id:
+            return False
+        now = time.time() if now is None else now
+        with self._lock:
+            self.checks += 1
+            while self._buckets and now - self._buckets[0][0] >= self.ttl:
+                self._buckets.popleft()
+            for _, bucket in self._buckets:
+                if msg_id in bucket:
+                    self.hits += 1
+                    return True
+            if (not self._buckets or now - self._buckets[-1][0] >= self.bucket_seconds
+                    or len(self._buckets[-1][1]) >= self.max_per_bucket):
+                self._buckets.append((now, set()))
+                while len(self._buckets) > self.max_buckets:
+                    self._buckets.popleft()
+            self._buckets[-1][1].add(msg_id)
+            return False
+
+    def __len__(self):
+        return sum(len(bucket) for _, bucket in self._buckets)
+
+    def to_state(self):
+        """:return: [[桶起始时间, [msg_id, ...]], ...]，用于检查点保存"""
+        with self._lock:
+            return [[start, list(bucket)] for start, bucket in self._buckets]
+
+    def load_state(self, state, now=None):
+        """恢复检查点中未过期的桶，放在现有桶之前"""
+        now = time.time() if now is None else now
+        with self._lock:
+            restored = [(start, set(ids)) for start, ids in state if now - start < self.ttl]
+            self._buckets = deque(restored + list(self._buckets))
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popleft()
+
+    def stats(self):
+        return {
+            'checks': self.checks,
+            'hits': self.hits,
+            'hit_rate': self.hits / self.checks if self.checks else 0.0,
+            'size': len(self),
+            'buckets': len(self._buckets),
+        }
+
+
+_deduplicators = {}
+_lock = threading.Lock()
+
+
+def get_deduplicator(room_id):
+    """
+    获取直播间的去重器，同一进程内同一直播间的多个会话共享
+    """
+    with _lock:
+        dedup = _deduplicators.get(room_id)
+        if dedup is None:
+            dedup = _deduplicators[room_id] = MsgIdDeduplicator()
+        return dedup
+
+
+def message_id(msg):
+    """
+    取Message的msg_id，为0时回退到payload中Common.msg_id
+    """
+    if msg.msg_id:
+        return msg.msg_id
+    try:
+        return CommonHeader().parse(msg.payload).common.msg_id
+    except Exception:
+        return 0
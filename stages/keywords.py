@@ -0,0 +1,197 @@
+# coding:utf-8
+
+"""
+关键词告警
+
+基于Aho-Corasick自动机，一次扫描即可匹配上千个关键词，耗时只与文本长度有关。
+扫描 ChatMessage.content、EmojiChatMessage.default_content、FansclubMessage.content，
+命中时在原事件之后追加一条 alert 事件(含命中位置)。
+关键词文件每行一个关键词，#开头为注释，修改后自动重新加载。
+
+性能测试:
+    python -m stages.keywords --keywords 5000 --chats 100000
+"""
+
+import argparse
+import os
+import random
+import time
+from collections import deque
+
+SCAN_TYPES = ('chat', 'emoji_chat', 'fansclub')
+
+
+class AhoCorasick:
+
+    def __init__(self, keywords, ignore_case=True):
+        """
+        :param keywords: 关键词列表
+        :param ignore_case: 是否忽略大小写
+        """
+        self.ignore_case = ignore_case
+        self.keywords = list(dict.fromkeys(self._fold(word) for word in keywords if word))
+        goto = [{}]
+        fail = [0]
+        out = [()]
+        for index, word in enumerate(self.keywords):
+            node = 0
+            for ch in word:
+                nxt = goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[node][ch] = nxt
+                    goto.append({})
+                    fail.append(0)
+                    out.append(())
+                node = nxt
+            out[node] += (index,)
+
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in goto[node].items():
+                queue.append(nxt)
+                f = fail[node]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+                out[nxt] += out[fail[nxt]]
+
+        self._goto = goto
+        self._fail = fail
+        self._out = out
+
+    def _fold(self, text):
+        return text.lower() if self.ignore_case else text
+
+    def __len__(self):
+        return len(self.keywords)
+
+    def search(self, text):
+        """
+        :return: [(start, end, keyword), ...]，text[start:end]为命中的关键词
+        """
+        goto = self._goto
+        fail = self._fail
+        out = self._out
+        keywords = self.keywords
+        matches = []
+        node = 0
+        for i, ch in enumerate(self._fold(text)):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                for index in out[node]:
+                    keyword = keywords[index]
+                    matches.append((i + 1 - len(keyword), i + 1, keyword))
+        return matches
+
+
+def load_keywords(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+
+
+class KeywordAlerter:
+
+    def __init__(self, path=None, keywords=None, reload_interval=5.0, ignore_case=True):
+        """
+        :param path: 关键词文件路径，文件修改后自动重新加载
+        :param keywords: 关键词列表(不使用文件时)
+        :param reload_interval: 检查文件是否修改的间隔(秒)
+        :param ignore_case: 是否忽略大小写
+        """
+        self.path = path
+        self.reload_interval = reload_interval
+        self.ignore_case = ignore_case
+        self._mtime = None
+        self._checked = 0.0
+        self.scanned = 0
+        self.alerts = 0
+        self.automaton = AhoCorasick(keywords or [], ignore_case)
+        if path:
+            self.reload()
+
+    def reload(self):
+        """从文件重新编译自动机，编译完成后整体替换，扫描中的消息不受影响"""
+        mtime = os.path.getmtime(self.path)
+        self.automaton = AhoCorasick(load_keywords(self.path), self.ignore_case)
+        self._mtime = mtime
+
+    def process(self, event):
+        if event['type'] not in SCAN_TYPES:
+            return [event]
+        self.scanned += 1
+        matches = self.automaton.search(event['content'])
+        if not matches:
+            return [event]
+        self.alerts += 1
+        return [event, {
+            'type': 'alert',
+            'room_id': event['room_id'],
+            'msg_id': event['msg_id'],
+            'create_time': event['create_time'],
+            'user_id': event.get('user_id'),
+            'nick_name': event.get('nick_name'),
+            'source_type': event['type'],
+            'content': event['content'],
+            'matches': matches,
+        }]
+
+    def tick(self, now=None):
+        now = time.time() if now is None else now
+        if self.path and now - self._checked >= self.reload_interval:
+            self._checked = now
+            try:
+                if os.path.getmtime(self.path) != self._mtime:
+                    self.reload()
+            except OSError:
+                pass
+        return []
+
+    def stats(self):
+        return {
+            'keywords': len(self.automaton),
+            'scanned': self.scanned,
+            'alerts': self.alerts,
+        }
+
+
+def benchmark(keyword_count=5000, chat_count=100000):
+    """
+    生成随机关键词和弹幕，测试每秒可扫描的弹幕数
+    """
+    chars = [chr(c) for c in range(0x4e00, 0x4e00 + 800)] + list('abcdefghijklmnopqrstuvwxyz0123456789')
+    rand = random.Random(0)
+    keywords = [''.join(rand.choices(chars, k=rand.randint(2, 6))) for _ in range(keyword_count)]
+    chats = [''.join(rand.choices(chars, k=rand.randint(5, 40))) for _ in range(chat_count)]
+    for i in range(0, chat_count, 100):
+        chats[i] += rand.choice(keywords)
+
+    begin = time.perf_counter()
+    alerter = KeywordAlerter(keywords=keywords)
+    build = time.perf_counter() - begin
+
+    event = {'type': 'chat', 'room_id': 0, 'msg_id': 0, 'create_time': 0, 'user_id': 0, 'nick_name': ''}
+    begin = time.perf_counter()
+    for content in chats:
+        event['content'] = content
+        alerter.process(event)
+    elapsed = time.perf_counter() - begin
+    return {
+        'keywords': keyword_count,
+        'build_seconds': build,
+        'chats_per_second': chat_count / elapsed,
+        'alerts': alerter.alerts,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="关键词告警性能测试")
+    parser.add_argument('--keywords', type=int, default=5000)
+    parser.add_argument('--chats', type=int, default=100000)
+    args = parser.parse_args()
+    result = benchmark(args.keywords, args.chats)
+    print(f"关键词: {result['keywords']}, 编译耗时: {result['build_seconds'] * 1000:.1f}ms, "
+          f"扫描速度: {result['chats_per_second']:.0f}条/秒, 告警: {result['alerts']}")
@@ -0,0 +1,193 @@
+# coding:utf-8
+
+"""
+合成直播间数据: 按直播间协议编码的websocket帧(PushFrame -> gzip Response -> 各类消息)，不连接网络
+
+    room = SyntheticRoom(7000000000000000000, users=20000)
+    data = room.frame(time.time())             # PushFrame字节，可直接交给 _wsOnMessage
+    events = sample_events(20000)              # 解码后的事件dict，供各编码/sink的性能测试使用
+
+浸泡测试(soak.py)和各模块的 benchmark() 共用。
+"""
+
+import gzip
+import itertools
+import random
+import time
+
+CHAT_WORDS = ('主播好', '来了来了', '哈哈哈', '666', '这个多少钱', '上链接', '好看', '晚上好', '关注了', '求翻牌')
+GIFTS = ((1, '小心心', 1), (2, '玫瑰', 1), (3, '人气票', 1), (4, '加油鸭', 15), (5, '嘉年华', 3000))
+# 消息类型及比例
+MIX = (('chat', 50), ('member', 20), ('like', 20), ('gift', 8), ('social', 2))
+
+
+def _varint(value):
+    out = bytearray()
+    while value > 0x7f:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _encode(*fields):
+    """按protobuf线格式编码 (字段号, 值)，值为int编码为varint，str/bytes编码为长度前缀，空值跳过"""
+    parts = []
+    for number, value in fields:
+        if isinstance(value, int):
+            if value:
+                parts.append(_varint(number << 3) + _varint(value))
+        else:
+            if isinstance(value, str):
+                value = value.encode('utf-8')
+            if value:
+                parts.append(_varint(number << 3 | 2) + _varint(len(value)) + value)
+    return b''.join(parts)
+
+
+class SyntheticRoom:
+    """生成一个直播间的帧: 观众按长尾分布活跃，少量消息重复下发，礼物带连击"""
+
+    _msg_ids = itertools.count(1)
+
+    def __init__(self, room_id, users=200000, batch=20, duplicate_rate=0.01, seed=0):
+        """
+        :param users: 观众ID范围
+        :param batch: 每帧的消息数
+        :param duplicate_rate: 重复下发上一帧消息的比例
+        """
+        self.room_id = room_id
+        self.users = users
+        self.batch = batch
+        self.duplicate_rate = duplicate_rate
+        self.rand = random.Random(seed)
+        self.kinds = [kind for kind, _ in MIX]
+        self.weights = [weight for _, weight in MIX]
+        self.frames = 0
+        self.messages = 0
+        self.like_total = 0
+        self.member_count = 0
+        self.follow_count = 0
+        self._combos = {}
+        self._previous = []
+
+    def _user(self):
+        user_id = int(self.users ** self.rand.random())
+        return user_id, _encode((1, user_id), (3, f"观众{user_id}"), (4, user_id & 1))
+
+    def _common(self, method, now_ms):
+        msg_id = next(self._msg_ids)
+        # 服务端生成消息到下发之间的延迟
+        create_time = now_ms - self.rand.randint(0, 300)
+        return msg_id, _encode((1, method), (2, msg_id), (3, self.room_id), (4, create_time))
+
+    def _gift(self, common, now_ms):
+        rand = self.rand
+        if self._combos and rand.random() < 0.7:
+            group_id = rand.choice(list(self._combos))
+            user, gift, combo = self._combos[group_id]
+            combo += 1
+        else:
+            user = self._user()[1]
+            gift = rand.choice(GIFTS)
+            group_id, combo = rand.getrandbits(48), 1
+        end = combo >= 10 or rand.random() < 0.2
+        if end:
+            self._combos.pop(group_id, None)
+        else:
+            self._combos[group_id] = (user, gift, combo)
+            if len(self._combos) > 20:
+                self._combos.pop(next(iter(self._combos)))
+        gift_id, name, diamonds = gift
+        struct = _encode((5, gift_id), (10, 1), (12, diamonds), (16, name))
+        return _encode((1, common), (2, gift_id), (5, combo), (6, combo), (7, user), (9, int(end)),
+                       (11, group_id), (15, struct), (33, now_ms))
+
+    def _message(self, kind, now_ms):
+        rand = self.rand
+        if kind == 'chat':
+            msg_id, common = self._common('WebcastChatMessage', now_ms)
+            content = f"{rand.choice(CHAT_WORDS)}{rand.randint(0, 999)}"
+            return 'WebcastChatMessage', msg_id, _encode((1, common), (2, self._user()[1]), (3, content))
+        if kind == 'member':
+            msg_id, common = self._common('WebcastMemberMessage', now_ms)
+            self.member_count += rand.randint(0, 3)
+            return 'WebcastMemberMessage', msg_id, _encode((1, common), (2, self._user()[1]),
+                                                           (3, self.member_count))
+        if kind == 'like':
+            msg_id, common = self._common('WebcastLikeMessage', now_ms)
+            count = rand.randint(1, 15)
+            self.like_total += count
+            return 'WebcastLikeMessage', msg_id, _encode((1, common), (2, count), (3, self.like_total),
+                                                         (5, self._user()[1]))
+        if kind == 'gift':
+            msg_id, common = self._common('WebcastGiftMessage', now_ms)
+            return 'WebcastGiftMessage', msg_id, self._gift(common, now_ms)
+        msg_id, common = self._common('WebcastSocialMessage', now_ms)
+        self.follow_count += 1
+        return 'WebcastSocialMessage', msg_id, _encode((1, common), (2, self._user()[1]), (4, 1),
+                                                       (6, self.follow_count))
+
+    def frame(self, now):
+        """
+        :param now: 服务端当前时间(秒)
+        :return: PushFrame字节
+        """
+        now_ms = int(now * 1000)
+        messages = []
+        for kind in self.rand.choices(self.kinds, self.weights, k=self.batch):
+            method, msg_id, payload = self._message(kind, now_ms)
+            messages.append(_encode((1, method), (2, payload), (3, msg_id)))
+        if self.frames % 10 == 0:
+            msg_id, common = self._common('WebcastRoomUserSeqMessage', now_ms)
+            total = 1000 + self.rand.randint(0, 500)
+            payload = _encode((1, common), (3, total), (7, self.member_count), (11, f"{total}人看过"))
+            messages.append(_encode((1, 'WebcastRoomUserSeqMessage'), (2, payload), (3, msg_id)))
+        if self._previous and self.rand.random() < self.duplicate_rate * self.batch:
+            messages.append(self.rand.choice(self._previous))
+        self._previous = messages
+        self.frames += 1
+        self.messages += len(messages)
+
+        response = b''.join(_encode((1, message)) for message in messages) + _encode(
+            (2, f"t-{now_ms}_r-1_d-1_u-1"), (4, now_ms), (5, f"internal_src:dim|seq:{self.frames}"),
+            (8, 5000), (9, 1))
+        return _encode((2, self.frames), (7, 'msg'), (8, gzip.compress(response, compresslevel=1)))
+
+
+def sample_messages(count, users=20000, seed=0):
+    """
+    生成消息并按抓取时的方式解码
+    :param count: 消息条数
+    :return: [(消息类, 消息对象, 事件dict), ...]
+    """
+    import events
+    from protobuf import (ChatMessage, GiftMessage, LikeMessage, MemberMessage, PushFrame, Response,
+                          RoomUserSeqMessage, SocialMessage)
+
+    parsers = {
+        'WebcastChatMessage': (ChatMessage, events.chat_event),
+        'WebcastGiftMessage': (GiftMessage, events.gift_event),
+        'WebcastLikeMessage': (LikeMessage, events.like_event),
+        'WebcastMemberMessage': (MemberMessage, events.member_event),
+        'WebcastSocialMessage': (SocialMessage, events.social_event),
+        'WebcastRoomUserSeqMessage': (RoomUserSeqMessage, events.room_user_seq_event),
+    }
+    room = SyntheticRoom(7000000000000000000, users=users, seed=seed)
+    now = time.time()
+    result = []
+    while len(result) < count:
+        frame = PushFrame().parse(room.frame(now))
+        for msg in Response().parse(gzip.decompress(frame.payload)).messages_list:
+            cls, to_event = parsers[msg.method]
+            message = cls().parse(msg.payload)
+            result.append((cls, message, to_event(message)))
+        now += 1.0
+    return result[:count]
+
+
+def sample_events(count, users=20000, seed=0):
+    """
+    :return: count 条事件dict
+    """
+    return [event for _, _, event in sample_messages(count, users, seed)]
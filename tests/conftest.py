@@ -0,0 +1,7 @@
+# coding:utf-8
+
+import os
+import sys
+
+# 模块都在仓库根目录，没有打包
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,48 @@
+# coding:utf-8
+
+from protobuf import Common, RoomUserSeqMessage
+from stages.changes import StateChangeDetector, payload_fingerprint
+
+METHOD = 'WebcastRoomUserSeqMessage'
+
+
+def payload(msg_id, total, pv="1.2万"):
+    common = Common(method=METHOD, msg_id=msg_id, room_id=7392091211001140287, create_time=1721106200000 + msg_id)
+    return bytes(RoomUserSeqMessage(common=common, total=total, total_pv_for_anchor=pv))
+
+
+def test_fingerprint_ignores_common_header():
+    assert payload_fingerprint(payload(1, 100)) == payload_fingerprint(payload(2, 100))
+    assert payload_fingerprint(payload(1, 100)) != payload_fingerprint(payload(1, 101))
+    assert payload_fingerprint(payload(1, 100, "1.2万")) != payload_fingerprint(payload(1, 100, "1.3万"))
+
+
+def test_fingerprint_falls_back_on_malformed_payload():
+    # 长度前缀超出数据范围，也不能抛出异常
+    broken = b'\x0a\xff\x01abc'
+    assert payload_fingerprint(broken) == payload_fingerprint(broken)
+    assert payload_fingerprint(broken) != payload_fingerprint(b'\x0a\xff\x01abd')
+
+
+def test_detector_suppresses_unchanged_state():
+    detector = StateChangeDetector()
+    assert detector.changed(METHOD, payload(1, 100))
+    # 只有Common(msg_id、create_time)不同
+    assert not detector.changed(METHOD, payload(2, 100))
+    assert detector.changed(METHOD, payload(3, 120))
+    assert not detector.changed(METHOD, payload(4, 120))
+    assert detector.stats() == {'checks': 4, 'unchanged': 2, 'skip_rate': 0.5}
+
+
+def test_detector_passes_other_methods_and_keeps_current():
+    detector = StateChangeDetector()
+    chat = b'\x0a\x02\x08\x01'
+    assert detector.changed('WebcastChatMessage', chat)
+    assert detector.changed('WebcastChatMessage', chat)
+    assert detector.stats()['checks'] == 0
+    assert detector.current(METHOD) is None
+    message = RoomUserSeqMessage(total=5)
+    detector.update(METHOD, message)
+    detector.update('WebcastChatMessage', object())
+    assert detector.current(METHOD) is message
+    assert detector.current('WebcastChatMessage') is None
@@ -0,0 +1,164 @@
+# coding:utf-8
+
+import os
+import sys
+import threading
+import time
+
+from analytics.counters import MetricsEngine
+from analytics.hll import UniqueViewers
+from analytics.sessions import SessionTracker
+from analytics.topk import TopKTracker
+from checkpoint import Checkpointer
+from liveMan import DouyinLiveWebFetcher
+
+ROOM = 7392091211001140287
+
+
+def components():
+    return {'counters': MetricsEngine(), 'topk': TopKTracker(), 'unique': UniqueViewers(),
+            'sessions': SessionTracker()}
+
+
+def feed(analytics, checkpointer, event):
+    for component in analytics.values():
+        component.write(event)
+    checkpointer.write(event)
+
+
+def test_restore_round_trip(tmp_path):
+    analytics = components()
+    checkpointer = Checkpointer(str(tmp_path), analytics)
+    for user_id in range(1, 50):
+        feed(analytics, checkpointer, {'type': 'chat', 'room_id': ROOM, 'user_id': user_id,
+                                       'nick_name': f'u{user_id}', 'content': 'hi'})
+    feed(analytics, checkpointer, {'type': 'gift', 'room_id': ROOM, 'user_id': 7, 'nick_name': 'u7',
+                                   'combo': False, 'combo_count': 1, 'diamond_count': 99, 'group_id': 0,
+                                   'trace_id': '', 'gift_id': 1})
+    assert checkpointer.checkpoint() == 1
+    # 没有新事件时不重写
+    assert checkpointer.checkpoint() == 0
+
+    restored = components()
+    timings = Checkpointer(str(tmp_path), restored).restore()
+    assert list(timings) == [ROOM]
+    assert restored['topk'].top_gifters(ROOM, 1) == analytics['topk'].top_gifters(ROOM, 1)
+    assert restored['unique'].estimate([ROOM]) == analytics['unique'].estimate([ROOM])
+    assert restored['sessions'].viewer(ROOM, 7) == analytics['sessions'].viewer(ROOM, 7)
+    assert restored['counters'].dump_room(ROOM) == analytics['counters'].dump_room(ROOM)
+
+
+def test_expired_checkpoint_is_ignored(tmp_path):
+    analytics = components()
+    checkpointer = Checkpointer(str(tmp_path), analytics, max_age=60)
+    feed(analytics, checkpointer, {'type': 'chat', 'room_id': ROOM, 'user_id': 1, 'nick_name': 'u1',
+                                   'content': 'hi'})
+    checkpointer.checkpoint()
+    path = os.path.join(str(tmp_path), f"room_{ROOM}.ckpt.gz")
+    old = time.time() - 3600
+    # 检查点时间记录在文件内容中，改写为一小时前
+    from checkpoint import _read, _write
+    data = _read(path)
+    data['time'] = old
+    _write(path, data)
+    assert Checkpointer(str(tmp_path), components(), max_age=60).restore() == {}
+
+
+def test_fetcher_cursor_restored_on_attach(tmp_path):
+    fetcher = DouyinLiveWebFetcher('123456', lambda *_: None, dedup=False)
+    fetcher.restore_checkpoint({'live_id': '123456', 'room_id': str(ROOM), 'cursor': 't-1_r-42',
+                                'internal_ext': 'ext', 'live_cursor': ''})
+    checkpointer = Checkpointer(str(tmp_path))
+    checkpointer.attach(fetcher)
+    assert checkpointer in fetcher.sinks
+    assert checkpointer.checkpoint() == 1
+
+    restarted = DouyinLiveWebFetcher('123456', lambda *_: None, dedup=False)
+    checkpointer = Checkpointer(str(tmp_path))
+    checkpointer.restore()
+    checkpointer.attach(restarted)
+    state = restarted.get_checkpoint()
+    assert (state['cursor'], state['internal_ext']) == ('t-1_r-42', 'ext')
+    # cursor 未变化时不重写
+    assert checkpointer.checkpoint() == 0
+
+
+class SlowComponent:
+    """dump_room 较慢，扩大保存与写入并发的时间窗口"""
+
+    def dump_room(self, room_id):
+        time.sleep(0)
+        return {'room_id': room_id}
+
+    def load_room(self, room_id, state):
+        pass
+
+
+def test_write_during_checkpoint(tmp_path):
+    checkpointer = Checkpointer(str(tmp_path), {'slow': SlowComponent()})
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    stop = threading.Event()
+    errors = []
+
+    def writer():
+        room_id = 0
+        while not stop.is_set():
+            room_id += 1
+            checkpointer.write({'room_id': room_id % 500})
+
+    def saver():
+        try:
+            while not stop.is_set():
+                checkpointer.checkpoint()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=writer), threading.Thread(target=writer), threading.Thread(target=saver)]
+    try:
+        for thread in threads:
+            thread.start()
+        time.sleep(1.0)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        sys.setswitchinterval(interval)
+    assert errors == []
+    checkpointer.checkpoint()
+    assert checkpointer.stats()['rooms_dirty'] == 0
+    assert len(os.listdir(str(tmp_path))) == 500
+
+
+class BrokenComponent:
+
+    def __init__(self):
+        self.calls = 0
+
+    def dump_room(self, room_id):
+        self.calls += 1
+        raise RuntimeError("broken")
+
+    def load_room(self, room_id, state):
+        pass
+
+
+def test_unexpected_error_keeps_thread_and_rooms(tmp_path):
+    logs = []
+    broken = BrokenComponent()
+    checkpointer = Checkpointer(str(tmp_path), {'broken': broken}, interval=0.01,
+                                log_callback=lambda *args: logs.append(args))
+    checkpointer.write({'room_id': ROOM})
+    checkpointer.start()
+    try:
+        deadline = time.time() + 5
+        while broken.calls < 3 and time.time() < deadline:
+            time.sleep(0.01)
+        assert checkpointer._thread.is_alive()
+    finally:
+        checkpointer._stop_event.set()
+        checkpointer._thread.join()
+    assert checkpointer.stats()['errors'] >= 3
+    # 保存失败的直播间留到下次重试
+    assert checkpointer.stats()['rooms_dirty'] == 1
+    assert logs[0][0] == 'ERROR' and 'RuntimeError' in logs[0][1]
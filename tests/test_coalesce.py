@@ -0,0 +1,82 @@
+# coding:utf-8
+
+from stages.coalesce import Coalescer
+
+
+def gift(combo_count, repeat_end=0, group_id=9, user_id=1, combo=True):
+    return {'type': 'gift', 'room_id': 1, 'msg_id': combo_count, 'create_time': 0, 'user_id': user_id,
+            'nick_name': 'a', 'gift_id': 3, 'gift_name': '玫瑰', 'diamond_count': 1, 'combo': combo,
+            'combo_count': combo_count, 'repeat_count': combo_count, 'repeat_end': repeat_end,
+            'group_id': group_id, 'trace_id': '', 'send_time': 0, 'to_user_id': 0}
+
+
+def like(user_id, count):
+    return {'type': 'like', 'room_id': 1, 'msg_id': user_id, 'create_time': 0, 'user_id': user_id,
+            'nick_name': f'u{user_id}', 'count': count, 'total': 0}
+
+
+def test_combo_emits_only_final_message():
+    coalescer = Coalescer()
+    assert coalescer.process(gift(1), now=0) == []
+    assert coalescer.process(gift(2), now=1) == []
+    out = coalescer.process(gift(3, repeat_end=1), now=2)
+    assert [event['combo_count'] for event in out] == [3]
+    assert coalescer.stats()['pending_combos'] == 0
+
+
+def test_out_of_order_combo_keeps_largest_count():
+    coalescer = Coalescer()
+    coalescer.process(gift(5), now=0)
+    out = coalescer.process(gift(4, repeat_end=1), now=1)
+    assert [event['combo_count'] for event in out] == [5]
+
+
+def test_stale_message_after_end_is_dropped():
+    coalescer = Coalescer(combo_timeout=10, ended_combos=2)
+    assert [event['combo_count'] for event in coalescer.process(gift(5, repeat_end=1), now=0)] == [5]
+    # 结束后迟到的较小连击数不再打开新的连击，超时后也不会再次输出
+    assert coalescer.process(gift(3), now=1) == []
+    assert coalescer.process(gift(5, repeat_end=1), now=1) == []
+    assert coalescer.tick(now=20) == []
+    assert coalescer.stats()['pending_combos'] == 0
+    # 只记住最近结束的连击组
+    coalescer.process(gift(1, repeat_end=1, group_id=10), now=2)
+    coalescer.process(gift(1, repeat_end=1, group_id=11), now=2)
+    assert [event['combo_count'] for event in coalescer.process(gift(3, repeat_end=1), now=3)] == [3]
+
+
+def test_unfinished_combo_times_out():
+    coalescer = Coalescer(combo_timeout=10)
+    coalescer.process(gift(2), now=0)
+    assert coalescer.tick(now=9) == []
+    assert [event['combo_count'] for event in coalescer.tick(now=10)] == [2]
+
+
+def test_non_combo_gift_passes_through():
+    event = gift(1, combo=False)
+    assert Coalescer().process(event, now=0) == [event]
+
+
+def test_likes_are_summarised_per_window_without_losing_totals():
+    coalescer = Coalescer(like_window=1.0)
+    assert coalescer.process(like(1, 3), now=0.0) == []
+    assert coalescer.process(like(2, 4), now=0.5) == []
+    assert coalescer.process(like(1, 1), now=0.9) == []
+    out = coalescer.process(like(3, 2), now=1.2)
+    summary = out[0]
+    assert summary['type'] == 'like_summary'
+    assert summary['count'] == 8
+    assert summary['user_ids'] == [1, 2]
+    assert (summary['window_start'], summary['window_end']) == (0.0, 1.0)
+    # 新窗口从1.2秒开始，由flush输出
+    rest = coalescer.flush()
+    assert [(event['count'], event['user_ids']) for event in rest] == [(2, [3])]
+
+
+def test_flush_outputs_pending_combos_and_windows():
+    coalescer = Coalescer()
+    coalescer.process(gift(2), now=0)
+    coalescer.process(like(1, 5), now=0)
+    types = sorted(event['type'] for event in coalescer.flush())
+    assert types == ['gift', 'like_summary']
+    assert coalescer.flush() == []
@@ -0,0 +1,111 @@
+# coding:utf-8
+
+import io
+
+import pytest
+
+import codec
+from codec import BatchReader, CodecError, decode_batch, encode_batch, read_batches, write_batch
+from events import EVENT_FIELDS, UINT64_FIELDS, field_type
+
+
+def full_event(event_type, seed=1):
+    """每个字段都有值的事件，uint64字段取接近上限的值"""
+    event = {'type': event_type}
+    for i, field in enumerate(EVENT_FIELDS[event_type]):
+        if field == 'type':
+            continue
+        kind = field_type(field)
+        if field in UINT64_FIELDS:
+            value = (1 << 64) - seed - i
+        elif kind is str:
+            value = f"{field}-{seed}-昵称"
+        elif kind is list:
+            value = [seed, i, "x"]
+        elif kind is bool:
+            value = bool(seed % 2)
+        elif kind is float:
+            value = seed + i / 4
+        else:
+            value = -seed * 1000 - i
+        event[field] = value
+    return event
+
+
+def test_round_trip_every_event_type():
+    events = [full_event(event_type, seed) for seed in (1, 2) for event_type in sorted(EVENT_FIELDS)]
+    assert decode_batch(encode_batch(events)) == events
+
+
+def test_missing_and_none_fields_decode_as_none():
+    event = {'type': 'chat', 'room_id': 7392091211001140287, 'user_id': 0, 'nick_name': '', 'content': None}
+    decoded, = decode_batch(encode_batch([event]))
+    assert decoded['room_id'] == 7392091211001140287
+    # 0 和空字符串不是空值
+    assert decoded['user_id'] == 0 and decoded['nick_name'] == ''
+    assert decoded['content'] is None and decoded['msg_id'] is None
+    gift = dict(full_event('gift'), combo=False, to_user_id=None)
+    decoded, = decode_batch(encode_batch([gift]))
+    assert decoded['combo'] is False and decoded['to_user_id'] is None
+
+
+def test_strings_are_shared_within_a_batch():
+    events = [{'type': 'chat', 'user_id': i, 'nick_name': 'same', 'content': f'c{i % 2}'} for i in range(10)]
+    data = encode_batch(events)
+    reader = BatchReader(data)
+    assert len(reader.strings()) == 3
+    decoded = list(reader)
+    assert decoded[0]['nick_name'] is decoded[9]['nick_name']
+
+
+def test_compressed_batch():
+    events = [full_event('gift', seed) for seed in range(200)]
+    plain = encode_batch(events)
+    compressed = encode_batch(events, compress=True)
+    assert len(compressed) < len(plain)
+    assert decode_batch(compressed) == events
+
+
+def test_reader_random_access_and_column():
+    events = [full_event('chat', 1), {'type': 'like', 'user_id': 5, 'count': 3}, full_event('gift', 3)]
+    reader = BatchReader(encode_batch(events))
+    assert len(reader) == 3
+    assert reader.type(1) == 'like'
+    assert reader[2] == events[2]
+    assert reader.column('user_id') == [(i, event['user_id']) for i, event in enumerate(events)]
+    assert reader.column('nick_name', 'gift') == [(2, events[2]['nick_name'])]
+    assert reader.column('msg_id', 'like') == [(1, None)]
+
+
+def test_stream_round_trip_and_truncation():
+    stream = io.BytesIO()
+    batches = [[full_event('chat', seed)] for seed in range(3)]
+    for batch in batches:
+        write_batch(stream, batch, compress=True)
+    stream.seek(0)
+    assert list(read_batches(stream)) == batches
+    truncated = io.BytesIO(stream.getvalue()[:-5])
+    with pytest.raises(CodecError):
+        list(read_batches(truncated))
+
+
+def test_rejects_bad_input():
+    with pytest.raises(CodecError):
+        encode_batch([{'type': 'no_such_event'}])
+    data = bytearray(encode_batch([full_event('chat')]))
+    with pytest.raises(CodecError):
+        BatchReader(b'XXXX' + bytes(data[4:]))
+    # schema校验不一致
+    data[8] ^= 0xff
+    with pytest.raises(CodecError):
+        BatchReader(bytes(data))
+    with pytest.raises(CodecError):
+        BatchReader(bytes(data[:10]))
+
+
+def test_layout_rejects_more_than_32_fields(monkeypatch):
+    fields = ('type',) + tuple(f'f{i}' for i in range(33))
+    monkeypatch.setitem(codec.EVENT_FIELDS, 'wide', fields)
+    monkeypatch.setitem(codec.TYPE_CODES, 'wide', 255)
+    with pytest.raises(CodecError, match='32'):
+        codec._Layout('wide')
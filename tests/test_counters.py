@@ -0,0 +1,82 @@
+# coding:utf-8
+
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+from analytics.counters import MetricsEngine, RingCounter, RoomCounters
+from headless import serve_queries
+from instrument import Instrumentation
+
+ROOM = 7392091211001140287
+
+
+def test_ring_counter_slides():
+    counter = RingCounter(60, 60)
+    counter.add(1, now=0)
+    counter.add(2, now=30)
+    assert counter.total(now=59) == 3
+    assert counter.total(now=60) == 2
+    assert counter.total(now=90) == 0
+    # 超出一整圈后全部清零
+    counter.add(5, now=1000)
+    assert counter.total(now=1000) == 5
+
+
+def test_room_counters_metrics():
+    counters = RoomCounters()
+    counters.update({'type': 'chat', 'user_id': 1}, now=100)
+    counters.update({'type': 'chat', 'user_id': 1}, now=100.5)
+    counters.update({'type': 'emoji_chat', 'user_id': 2}, now=101)
+    counters.update({'type': 'like_summary', 'count': 30}, now=101)
+    counters.update({'type': 'gift', 'combo': True, 'combo_count': 3, 'diamond_count': 10, 'group_id': 1,
+                     'trace_id': '', 'user_id': 1, 'gift_id': 5}, now=101)
+    # 同一连击组只累计增量
+    counters.update({'type': 'gift', 'combo': True, 'combo_count': 5, 'diamond_count': 10, 'group_id': 1,
+                     'trace_id': '', 'user_id': 1, 'gift_id': 5}, now=101)
+    snapshot = counters.snapshot(now=101.5)
+    assert snapshot['chat']['1m'] == 3
+    assert snapshot['chatters']['1m'] == 2
+    assert snapshot['likes']['1m'] == 30
+    assert snapshot['diamonds']['1h'] == 50
+    assert counters.snapshot(now=200)['chat']['1m'] == 0
+
+
+def test_state_round_trip():
+    counters = RoomCounters()
+    counters.update({'type': 'social'}, now=1000)
+    restored = RoomCounters()
+    restored.load_state(counters.to_state())
+    assert restored.snapshot(now=1001)['follows']['1h'] == 1
+
+
+@pytest.fixture
+def server():
+    engine = MetricsEngine()
+    instrumentation = Instrumentation()
+    serve_queries(instrumentation, {'counters': engine})
+    http = instrumentation.serve(0)
+    yield engine, f"http://127.0.0.1:{http.server_address[1]}"
+    instrumentation.close()
+
+
+def test_counters_endpoint(server):
+    engine, base = server
+    engine.write({'type': 'chat', 'room_id': ROOM, 'user_id': 1})
+    engine.write({'type': 'chat', 'room_id': 1, 'user_id': 1})
+    with urllib.request.urlopen(f"{base}/counters?room_id={ROOM}") as response:
+        data = json.loads(response.read())
+    assert list(data['rooms']) == [str(ROOM)]
+    assert data['rooms'][str(ROOM)]['chat']['1m'] == 1
+    assert data['windows']['1m'] == 60
+    with urllib.request.urlopen(f"{base}/counters") as response:
+        assert len(json.loads(response.read())['rooms']) == 2
+
+
+def test_bad_query_is_400(server):
+    _, base = server
+    with pytest.raises(urllib.error.HTTPError) as error:
+        urllib.request.urlopen(f"{base}/counters?room_id=abc")
+    assert error.value.code == 400
@@ -0,0 +1,55 @@
+# coding:utf-8
+
+from protobuf import ChatMessage, Common, Message
+from stages.dedup import MsgIdDeduplicator, message_id
+
+
+def test_duplicates_within_ttl_are_dropped():
+    dedup = MsgIdDeduplicator(ttl=600, bucket_seconds=60)
+    assert not dedup.seen(1, now=1000)
+    assert dedup.seen(1, now=1001)
+    assert dedup.seen(1, now=1000 + 599)
+    assert not dedup.seen(2, now=1000 + 599)
+    assert dedup.stats()['hits'] == 2
+
+
+def test_ids_expire_with_their_bucket():
+    dedup = MsgIdDeduplicator(ttl=120, bucket_seconds=60)
+    dedup.seen(1, now=0)
+    dedup.seen(2, now=70)
+    # 第一个桶(起点0)在120秒后整体过期，第二个桶仍在
+    assert not dedup.seen(1, now=125)
+    assert dedup.seen(2, now=125)
+
+
+def test_memory_is_bounded_by_buckets():
+    dedup = MsgIdDeduplicator(ttl=600, bucket_seconds=60, max_per_bucket=100)
+    for msg_id in range(1, 10001):
+        dedup.seen(msg_id, now=1000)
+    assert len(dedup) <= dedup.max_buckets * 100
+    assert dedup.stats()['buckets'] == dedup.max_buckets
+    # 最早的ID已随提前换桶被淘汰，最近的仍能识别
+    assert not dedup.seen(1, now=1000)
+    assert dedup.seen(10000, now=1000)
+
+
+def test_zero_msg_id_is_never_a_duplicate():
+    dedup = MsgIdDeduplicator()
+    assert not dedup.seen(0)
+    assert not dedup.seen(0)
+
+
+def test_state_round_trip_skips_expired_buckets():
+    dedup = MsgIdDeduplicator(ttl=120, bucket_seconds=60)
+    dedup.seen(1, now=0)
+    dedup.seen(2, now=100)
+    restored = MsgIdDeduplicator(ttl=120, bucket_seconds=60)
+    restored.load_state(dedup.to_state(), now=130)
+    assert restored.seen(2, now=130)
+    assert not restored.seen(1, now=130)
+
+
+def test_message_id_falls_back_to_common_header():
+    payload = bytes(ChatMessage(common=Common(msg_id=77), content='hi'))
+    assert message_id(Message(method='WebcastChatMessage', payload=payload, msg_id=0)) == 77
+    assert message_id(Message(method='WebcastChatMessage', payload=payload, msg_id=5)) == 5
@@ -0,0 +1,137 @@
+# coding:utf-8
+
+import base64
+import json
+import os
+import socket
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from codec import decode_batch
+from fanout import FanoutServer, _ws_read
+
+
+class FakeFetcher:
+
+    def __init__(self, live_id, sink):
+        self.live_id = live_id
+        self.sinks = [sink]
+        self.connected_at = None
+        self.stopped = False
+
+    def start(self):
+        pass
+
+    def stop(self):
+        self.stopped = True
+
+
+@pytest.fixture
+def server():
+    fanout = FanoutServer(port=0, linger=60, fetcher_factory=FakeFetcher, max_rooms=2)
+    fanout.start()
+    yield fanout
+    fanout.close()
+
+
+def client_frame(payload, opcode=0x1):
+    mask = os.urandom(4)
+    masked = bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+    return bytes((0x80 | opcode, 0x80 | len(payload))) + mask + masked
+
+
+def test_on_demand_rooms_are_capped(server):
+    server.subscribe(['1', '2'])
+    with pytest.raises(PermissionError):
+        server.subscribe(['3'])
+    # 已连接的直播间不受上限影响
+    server.subscribe(['2'])
+    assert sorted(server.stats()['rooms']) == ['1', '2']
+    assert server.stats()['rejected'] == 1
+
+
+def test_rejected_update_keeps_filter(server):
+    subscriber = server.subscribe(['1'])
+    with pytest.raises(PermissionError):
+        server.update(subscriber, ['1', 'x'])
+    assert subscriber.rooms == {'1'}
+    assert sorted(server.stats()['rooms']) == ['1']
+
+
+def test_allow_list():
+    fanout = FanoutServer(port=0, fetcher_factory=FakeFetcher, allowed_rooms=[42])
+    fanout.subscribe(['42'])
+    with pytest.raises(PermissionError):
+        fanout.subscribe(['43'])
+    fanout.close()
+
+
+def test_rejected_subscription_returns_403(server):
+    port = server._server.server_address[1]
+    with pytest.raises(urllib.error.HTTPError) as error:
+        urllib.request.urlopen(f"http://127.0.0.1:{port}/events?room=1,2,3", timeout=5)
+    assert error.value.code == 403
+
+
+def test_websocket_frame_sent_with_handshake_is_read(server):
+    """握手请求与第一帧在同一个TCP包中到达时，帧不能被读入缓冲区后遗漏"""
+    port = server._server.server_address[1]
+    key = base64.b64encode(os.urandom(16)).decode()
+    request = (f"GET /ws?room=1&method=chat HTTP/1.1\r\nHost: 127.0.0.1\r\nUpgrade: websocket\r\n"
+               f"Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n").encode()
+    update = client_frame(json.dumps({'room': ['1'], 'method': ['gift']}).encode())
+    with socket.create_connection(('127.0.0.1', port), timeout=5) as sock:
+        sock.sendall(request + update)
+        reader = sock.makefile('rb')
+        while reader.readline() not in (b'\r\n', b''):
+            pass
+        deadline = time.time() + 5
+        while time.time() < deadline:
+            subscribers = server._subscribers
+            if subscribers and subscribers[0].types == {'gift'}:
+                break
+            time.sleep(0.05)
+        server.publish('1', {'type': 'chat', 'content': 'skip'})
+        server.publish('1', {'type': 'gift', 'gift_id': 1})
+        opcode, payload = _ws_read(reader)
+        assert opcode == 0x1
+        assert json.loads(payload) == {'type': 'gift', 'gift_id': 1, 'live_id': '1'}
+
+
+def test_binary_websocket_sends_codec_batches(server):
+    port = server._server.server_address[1]
+    key = base64.b64encode(os.urandom(16)).decode()
+    request = (f"GET /ws?room=1&format=binary HTTP/1.1\r\nHost: 127.0.0.1\r\nUpgrade: websocket\r\n"
+               f"Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n").encode()
+    with socket.create_connection(('127.0.0.1', port), timeout=5) as sock:
+        sock.sendall(request)
+        reader = sock.makefile('rb')
+        while reader.readline() not in (b'\r\n', b''):
+            pass
+        deadline = time.time() + 5
+        while not server._subscribers and time.time() < deadline:
+            time.sleep(0.05)
+        assert server._subscribers[0].binary
+        chat = {'type': 'chat', 'room_id': 7392091211001140287, 'user_id': 2 ** 64 - 1, 'content': '你好'}
+        server.publish('1', chat)
+        server.publish('1', {'type': 'no_such_event'})
+        server.publish('1', {'type': 'like', 'room_id': 7392091211001140287, 'count': 3})
+        events = []
+        while len(events) < 2:
+            opcode, payload = _ws_read(reader)
+            assert opcode == 0x2
+            events.extend(decode_batch(payload))
+        assert events[0]['content'] == '你好' and events[0]['user_id'] == 2 ** 64 - 1
+        assert [event['type'] for event in events] == ['chat', 'like']
+    assert server.stats()['encoded'] == 0
+
+
+def test_binary_format_is_websocket_only(server):
+    port = server._server.server_address[1]
+    for query in ("room=1&format=binary", "room=1&format=xml"):
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/events?{query}", timeout=5)
+        assert error.value.code == 400
@@ -0,0 +1,73 @@
+# coding:utf-8
+
+import argparse
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+from analytics.sessions import SessionTracker
+from analytics.topk import TopKTracker
+from headless import STAGE_ANALYTICS, build_stages, load_live_ids, main, query_sessions, query_top, serve_queries
+from instrument import Instrumentation
+
+ROOM = 7392091211001140287
+
+
+def args(live_ids=(), file=None):
+    return argparse.Namespace(live_ids=list(live_ids), file=file)
+
+
+def test_live_ids_from_command_line_and_file(tmp_path):
+    path = tmp_path / 'rooms.txt'
+    path.write_text("# 关注的直播间\n111\n\n  222  # 晚上开播\n   \n#333\n111\n444\r\n", encoding='utf-8')
+    # 命令行在前，重复的只保留第一次出现的位置
+    assert load_live_ids(args(['444', '555'], str(path))) == ['444', '555', '111', '222']
+    assert load_live_ids(args(['1', '1'])) == ['1']
+    empty = tmp_path / 'empty.txt'
+    empty.write_text('', encoding='utf-8')
+    assert load_live_ids(args(file=str(empty))) == []
+
+
+def test_missing_live_ids_is_an_error(tmp_path, capsys):
+    path = tmp_path / 'rooms.txt'
+    path.write_text("# 全是注释\n\n", encoding='utf-8')
+    with pytest.raises(SystemExit):
+        main(['--file', str(path)])
+    assert 'live_id' in capsys.readouterr().err
+
+
+def test_sessions_run_before_coalescer():
+    sessions = SessionTracker()
+    stages = build_stages(argparse.Namespace(no_coalesce=False, keywords=None), {'sessions': sessions})
+    assert STAGE_ANALYTICS == ('sessions',)
+    assert stages[0] is sessions and type(stages[1]).__name__ == 'Coalescer'
+
+
+def test_query_parameter_errors():
+    with pytest.raises(ValueError):
+        query_top(TopKTracker(), {'board': 'nope'})
+    with pytest.raises(ValueError):
+        query_sessions(SessionTracker(), {})
+    with pytest.raises(ValueError):
+        query_sessions(SessionTracker(), {'room_id': 'abc'})
+
+
+def test_query_endpoints_return_json_and_400():
+    tracker = SessionTracker()
+    tracker.write({'type': 'chat', 'room_id': ROOM, 'user_id': 1, 'nick_name': '观众'}, now=1000)
+    instrumentation = Instrumentation()
+    serve_queries(instrumentation, {'sessions': tracker})
+    port = instrumentation.serve(0).server_address[1]
+    try:
+        url = f"http://127.0.0.1:{port}/sessions?room_id={ROOM}&key=chats&k=1"
+        with urllib.request.urlopen(url, timeout=5) as response:
+            data = json.loads(response.read())
+        assert data[str(ROOM)][0]['user_id'] == 1 and data[str(ROOM)][0]['chats'] == 1
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/sessions", timeout=5)
+        assert error.value.code == 400
+        assert json.loads(error.value.read())['error']
+    finally:
+        instrumentation.close()
@@ -0,0 +1,81 @@
+# coding:utf-8
+
+import time
+
+import pytest
+
+from heartbeat import DEFAULT_INTERVAL, HEARTBEAT_FRAME, MAX_INTERVAL, MIN_INTERVAL, HeartbeatScheduler
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+@pytest.mark.parametrize('interval, expected', [(None, DEFAULT_INTERVAL), (0, DEFAULT_INTERVAL),
+                                                (-3, DEFAULT_INTERVAL), (0.2, MIN_INTERVAL),
+                                                (600, MAX_INTERVAL), (7, 7.0)])
+def test_interval_is_clamped(interval, expected):
+    assert HeartbeatScheduler()._clamp(interval) == expected
+
+
+def test_set_interval_is_clamped():
+    scheduler = HeartbeatScheduler(tick=0.01)
+    scheduler.register('a', lambda data: True, interval=1)
+    scheduler.set_interval('a', 0.1)
+    assert scheduler._entries['a'].interval == MIN_INTERVAL
+    scheduler.set_interval('a', 90)
+    assert scheduler._entries['a'].interval == MAX_INTERVAL
+    scheduler.set_interval('missing', 3)
+    scheduler.unregister('a')
+
+
+def test_heartbeats_are_sent_on_schedule():
+    scheduler = HeartbeatScheduler(tick=0.01)
+    sent = []
+    scheduler.register('a', sent.append, interval=1)
+    assert wait_for(lambda: len(sent) >= 2, timeout=5)
+    assert sent[0] == HEARTBEAT_FRAME
+    scheduler.unregister('a')
+    count = len(sent)
+    time.sleep(1.2)
+    assert len(sent) == count
+
+
+def test_overdue_callback_fires_once_until_touched():
+    scheduler = HeartbeatScheduler(tick=0.01, overdue_factor=0.5)
+    silences = []
+    scheduler.register('a', lambda data: True, silences.append, interval=1)
+    scheduler._entries['a'].last_seen -= 10
+    assert wait_for(lambda: silences)
+    assert silences[0] >= 10
+    assert scheduler.overdue() == ['a']
+    scheduler.touch('a')
+    assert scheduler.overdue() == []
+    assert scheduler.stats()['overdue_events'] == 1
+    scheduler.unregister('a')
+
+
+def test_failed_send_unregisters_only_its_own_entry():
+    scheduler = HeartbeatScheduler(tick=0.01)
+    scheduler.register('a', lambda data: False, interval=1)
+    old = scheduler._entries['a']
+    # 重连: 同一个key重新登记后旧连接才发送失败
+    sent = []
+    scheduler.register('a', sent.append, interval=60)
+    scheduler._fire(old)
+    assert scheduler._entries['a'] is not old
+    assert scheduler.stats()['connections'] == 1
+    scheduler.unregister('a')
+
+
+def test_raising_send_is_treated_as_dead():
+    scheduler = HeartbeatScheduler(tick=0.01)
+
+    def send(data):
+        raise OSError("closed")
+
+    scheduler.register('a', send, interval=1)
+    assert wait_for(lambda: 'a' not in scheduler._entries)
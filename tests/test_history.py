@@ -0,0 +1,113 @@
+# coding:utf-8
+
+import pytest
+
+from analytics.history import History, RoomHistory, parse_count
+
+ROOM = 7392091211001140287
+
+
+def seq(total, pv='1.2万'):
+    return {'type': 'room_user_seq', 'room_id': ROOM, 'total': total, 'total_pv_for_anchor': pv}
+
+
+@pytest.mark.parametrize('text, value', [("8923", 8923), ("1.2万", 12000), ("10万+", 100000), ("3亿", 3e8),
+                                         ("", None), ("很多", None), (15, 15)])
+def test_parse_count(text, value):
+    assert parse_count(text) == value
+
+
+def test_unchanged_gauge_is_carried_forward():
+    """状态消息内容不变时不输出事件，人数曲线不应出现空洞"""
+    history = RoomHistory()
+    history.update(seq(100), now=1000)
+    history.update(seq(300), now=1005.5)
+    start, resolution, values = history.series('total', seconds=10, points=100, now=1009)
+    assert (start, resolution) == (1000, 1)
+    assert values == [100.0] * 5 + [300.0] * 5
+    # 窗口内第一个样本之前的桶取窗口开始前最近的值
+    _, _, values = history.series('total', seconds=4, points=100, now=1004)
+    assert values == [100.0] * 4
+    _, _, values = history.series('total_pv_for_anchor', seconds=3, points=100, now=1009)
+    assert values == [12000.0] * 3
+
+
+def test_gauge_before_recording_is_none():
+    history = RoomHistory()
+    history.update(seq(100), now=1005)
+    _, _, values = history.series('total', seconds=10, points=100, now=1009)
+    assert values == [None] * 5 + [100.0] * 5
+
+
+def test_gauge_average_and_peak():
+    history = RoomHistory()
+    history.update(seq(100), now=1000.1)
+    history.update(seq(300), now=1000.9)
+    assert history.series('total', seconds=1, points=10, now=1000.9)[2] == [200.0]
+    assert history.series('total', seconds=1, points=10, now=1000.9, peak=True)[2] == [300.0]
+
+
+def test_rates_are_per_second_and_zero_when_idle():
+    history = RoomHistory()
+    history.update({'type': 'like', 'count': 10}, now=1000)
+    history.update({'type': 'like_summary', 'count': 20}, now=1000.5)
+    # 10秒精度: 最近1小时超过1000点时选择更粗的精度
+    start, resolution, values = history.series('likes', seconds=3600, points=400, now=1009)
+    assert resolution == 10
+    assert values[-1] == 3.0
+    _, _, values = history.series('likes', seconds=3, points=100, now=1002)
+    assert values == [30.0, 0.0, 0.0]
+
+
+def test_combo_gifts_count_increments():
+    history = RoomHistory()
+    for combo_count in (1, 2, 5):
+        history.update({'type': 'gift', 'combo': True, 'combo_count': combo_count, 'diamond_count': 10,
+                        'group_id': 7, 'trace_id': '', 'user_id': 1, 'gift_id': 3}, now=1000)
+    assert history.series('diamonds', seconds=1, points=10, now=1000)[2] == [50.0]
+
+
+def test_expired_buckets_are_not_reused():
+    history = RoomHistory(resolutions=((1, 10),))
+    history.update(seq(100), now=1000)
+    history.update(seq(200), now=1015)
+    # 槽位已被新桶覆盖，迟到的旧数据被丢弃
+    history.update(seq(999), now=1005)
+    _, _, values = history.series('total', seconds=10, points=100, now=1019)
+    # 1015之前沿用仍在环形数组中的1000秒的值
+    assert values == [100.0] * 5 + [200.0] * 5
+
+
+def test_coarsest_archive_is_downsampled_to_points():
+    history = RoomHistory(resolutions=((1, 60), (10, 60)))
+    history.update(seq(100), now=1000)
+    history.update({'type': 'like', 'count': 60}, now=1005)
+    history.update(seq(300), now=1300)
+    # 10秒精度600秒共60个桶，合并为不超过20个点
+    start, resolution, values = history.series('total', seconds=600, points=20, now=1599)
+    assert (start, resolution, len(values)) == (1000, 30, 20)
+    assert values[:10] == [100.0] * 10 and values[10:] == [300.0] * 10
+    _, _, likes = history.series('likes', seconds=600, points=20, now=1599)
+    # 速率取平均: 第一个30秒共60次点赞
+    assert likes[0] == 2.0 and likes[1:] == [0.0] * 19
+    # 点数不能整除时不超过 points，且不超出环形数组
+    start, resolution, values = history.series('total', seconds=600, points=7, now=1599)
+    assert resolution == 90 and len(values) == 6 and start == 1599 // 10 * 10 + 10 - 6 * 90
+
+
+def test_default_week_view_respects_points():
+    history = RoomHistory()
+    history.update(seq(100), now=1000)
+    _, resolution, values = history.series('total', seconds=7 * 86400, points=1000, now=2000)
+    assert resolution == 720 and len(values) <= 1000
+
+
+def test_history_sink():
+    history = History()
+    history.write(seq(100))
+    history.write({'type': 'chat', 'room_id': ROOM})
+    assert history.rooms() == [ROOM]
+    assert history.series(ROOM, 'total', seconds=2)[2][-1] == 100.0
+    assert history.stats()['rooms'] == 1
+    with pytest.raises(ValueError):
+        history.series(ROOM, 'nope')
@@ -0,0 +1,112 @@
+# coding:utf-8
+
+import json
+import urllib.request
+
+import pytest
+
+from analytics.hll import DAY, HOUR, WEEK, HyperLogLog, UniqueViewers, bucket_start
+from headless import serve_queries
+from instrument import Instrumentation
+
+
+def sketch(values, p=12):
+    hll = HyperLogLog(p)
+    hll.update(values)
+    return hll
+
+
+@pytest.mark.parametrize('count', [10, 1000, 100000])
+def test_estimate_within_standard_error(count):
+    estimate = sketch(range(count)).count()
+    # p=12 标准误差约1.6%，取4倍余量
+    assert abs(estimate - count) <= max(1, 0.065 * count)
+
+
+def test_duplicates_do_not_change_estimate():
+    assert sketch(list(range(5000)) * 3).count() == sketch(range(5000)).count()
+
+
+def test_merge_equals_union():
+    a = sketch(range(0, 60000))
+    b = sketch(range(40000, 100000))
+    union = sketch(range(100000))
+    merged = a.copy().merge(b)
+    assert merged.registers == union.registers
+    # 合并满足交换律，且不改变参数
+    assert b.copy().merge(a).registers == merged.registers
+    assert a.count() < merged.count()
+
+
+def test_merge_rejects_different_precision():
+    with pytest.raises(ValueError):
+        HyperLogLog(10).merge(HyperLogLog(12))
+
+
+def test_bytes_round_trip():
+    hll = sketch(range(2000))
+    restored = HyperLogLog.from_bytes(hll.to_bytes())
+    assert restored.p == hll.p and restored.registers == hll.registers
+    with pytest.raises(ValueError):
+        HyperLogLog.from_bytes(b'nope')
+
+
+def test_bucket_alignment():
+    t = 1721106114
+    assert bucket_start(t, HOUR) % HOUR == 0
+    day = bucket_start(t, DAY)
+    assert day <= t < day + DAY
+    week = bucket_start(t, WEEK)
+    assert week <= day and (day - week) % DAY == 0 and day - week < WEEK
+
+
+def test_unique_viewers_across_rooms_and_time():
+    viewers = UniqueViewers()
+    start = bucket_start(1721106114, WEEK) + DAY
+    viewers.add(1, range(0, 1000), timestamp=start)
+    viewers.add(2, range(500, 1500), timestamp=start + 2 * HOUR)
+    viewers.add(1, range(1000, 1200), timestamp=start + DAY)
+    assert viewers.estimate([1], start, start + HOUR) == pytest.approx(1000, rel=0.05)
+    assert viewers.estimate([1, 2], start, start + 3 * HOUR) == pytest.approx(1500, rel=0.05)
+    assert viewers.estimate(None, start, start + 2 * DAY) == pytest.approx(1500, rel=0.05)
+    assert viewers.estimate([1]) == pytest.approx(1200, rel=0.05)
+
+
+def test_range_ending_inside_coarse_bucket():
+    viewers = UniqueViewers()
+    day = bucket_start(1721106114, WEEK) + DAY
+    viewers.add(1, range(0, 1000), timestamp=day + HOUR)
+    viewers.add(1, range(1000, 3000), timestamp=day + 20 * HOUR)
+    # 范围只覆盖天桶的前几个小时，不能用整个天桶(以及周桶)
+    assert viewers.estimate([1], day, day + 3 * HOUR) == pytest.approx(1000, rel=0.05)
+    assert viewers.estimate([1], day + 10 * HOUR, day + 2 * DAY) == pytest.approx(2000, rel=0.05)
+    assert viewers.estimate([1], day, day + DAY) == pytest.approx(3000, rel=0.05)
+    # 小时桶已过期时退而使用部分重叠的天桶
+    for key in [key for key in viewers._sketches if key[1] == HOUR]:
+        del viewers._sketches[key]
+    assert viewers.estimate([1], day, day + 3 * HOUR) == pytest.approx(3000, rel=0.05)
+
+
+def test_dump_and_load_room():
+    viewers = UniqueViewers()
+    viewers.add(1, range(300), timestamp=1721106114)
+    restored = UniqueViewers()
+    restored.load_room(1, json.loads(json.dumps(viewers.dump_room(1))))
+    assert restored.estimate([1]) == viewers.estimate([1])
+    assert viewers.dump_room(2) is None
+
+
+def test_unique_endpoint():
+    viewers = UniqueViewers()
+    viewers.write({'type': 'chat', 'room_id': 1, 'user_id': 10})
+    viewers.write({'type': 'like_summary', 'room_id': 2, 'user_ids': [10, 11, 12]})
+    instrumentation = Instrumentation()
+    serve_queries(instrumentation, {'unique': viewers})
+    port = instrumentation.serve(0).server_address[1]
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/unique?room_id=1,2&hours=1") as response:
+            data = json.loads(response.read())
+    finally:
+        instrumentation.close()
+    assert data['total'] == 3
+    assert data['rooms'] == {'1': 1, '2': 3}
@@ -0,0 +1,36 @@
+# coding:utf-8
+
+import sys
+import threading
+
+from instrument import Instrumentation
+
+
+def test_concurrent_counts_are_not_lost():
+    # 缩短线程切换间隔，未加锁的读-改-写很容易丢失计数
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        instrumentation = Instrumentation()
+
+        def count():
+            for _ in range(20000):
+                instrumentation.count('messages', 1, 'WebcastChatMessage')
+
+        threads = [threading.Thread(target=count) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert instrumentation.snapshot()['counters'] == {('messages', 1, 'WebcastChatMessage'): 80000}
+
+
+def test_render_counters():
+    instrumentation = Instrumentation()
+    instrumentation.count('duplicates', 7, value=3)
+    instrumentation.observe('parse', 7, 'WebcastChatMessage', 0.002)
+    text = instrumentation.render()
+    assert 'douyin_live_events_total{name="duplicates",room_id="7",method=""} 3' in text
+    assert 'douyin_live_stage_seconds_count{stage="parse",room_id="7",method="WebcastChatMessage"} 1' in text
@@ -0,0 +1,76 @@
+# coding:utf-8
+
+import os
+
+from stages.keywords import AhoCorasick, KeywordAlerter, benchmark, load_keywords
+
+
+def chat(content, user_id=1):
+    return {'type': 'chat', 'room_id': 7392091211001140287, 'msg_id': 1, 'create_time': 1700000000000,
+            'user_id': user_id, 'nick_name': '观众', 'content': content}
+
+
+def test_overlapping_and_nested_matches():
+    automaton = AhoCorasick(['he', 'she', 'his', 'hers'])
+    assert automaton.search('ushers') == [(1, 4, 'she'), (2, 4, 'he'), (2, 6, 'hers')]
+    automaton = AhoCorasick(['加微信', '微信', '信号'])
+    assert automaton.search('加微信号') == [(0, 3, '加微信'), (1, 3, '微信'), (2, 4, '信号')]
+
+
+def test_spans_index_original_text():
+    automaton = AhoCorasick(['vx', '代购'])
+    text = '主播VX多少，有代购吗代购'
+    matches = automaton.search(text)
+    assert matches == [(2, 4, 'vx'), (8, 10, '代购'), (11, 13, '代购')]
+    assert [text[start:end] for start, end, _ in matches] == ['VX', '代购', '代购']
+    assert AhoCorasick(['vx'], ignore_case=False).search(text) == []
+
+
+def test_duplicates_and_empty_keywords_are_ignored():
+    automaton = AhoCorasick(['abc', 'ABC', '', 'abc'])
+    assert len(automaton) == 1
+    assert automaton.search('') == []
+
+
+def test_load_keywords_skips_comments_and_blank_lines(tmp_path):
+    path = tmp_path / 'keywords.txt'
+    path.write_text('# 广告\n加微信\n\n  # 缩进的注释\n  代购  \n', encoding='utf-8')
+    assert load_keywords(str(path)) == ['加微信', '代购']
+
+
+def test_alert_follows_event():
+    alerter = KeywordAlerter(keywords=['代购'])
+    event = chat('有代购吗')
+    assert alerter.process(event) == [event, {
+        'type': 'alert', 'room_id': event['room_id'], 'msg_id': 1, 'create_time': 1700000000000, 'user_id': 1,
+        'nick_name': '观众', 'source_type': 'chat', 'content': '有代购吗', 'matches': [(1, 3, '代购')]}]
+    assert alerter.process(chat('你好')) == [chat('你好')]
+    like = {'type': 'like', 'count': 3}
+    assert alerter.process(like) == [like]
+    assert alerter.stats() == {'keywords': 1, 'scanned': 2, 'alerts': 1}
+
+
+def test_keyword_file_reloads_on_change(tmp_path):
+    path = tmp_path / 'keywords.txt'
+    path.write_text('代购\n', encoding='utf-8')
+    alerter = KeywordAlerter(str(path), reload_interval=5)
+    assert len(alerter.process(chat('加微信'))) == 1
+    path.write_text('代购\n加微信\n', encoding='utf-8')
+    mtime = os.path.getmtime(str(path)) + 10
+    os.utime(str(path), (mtime, mtime))
+    # 未到检查间隔不重新加载
+    alerter._checked = 100
+    alerter.tick(now=101)
+    assert alerter.stats()['keywords'] == 1
+    alerter.tick(now=106)
+    assert alerter.stats()['keywords'] == 2
+    assert alerter.process(chat('加微信'))[1]['matches'] == [(0, 3, '加微信')]
+    # 文件被删除时保留已加载的关键词
+    os.remove(str(path))
+    alerter.tick(now=120)
+    assert alerter.stats()['keywords'] == 2
+
+
+def test_benchmark():
+    result = benchmark(keyword_count=50, chat_count=1000)
+    assert result['alerts'] >= 10 and result['chats_per_second'] > 0
@@ -0,0 +1,124 @@
+# coding:utf-8
+
+import pytest
+
+from lag import ClockOffset, LagTracker, _seconds
+
+ROOM = 7392091211001140287
+# 本地时钟比服务端快100秒
+SKEW = 100.0
+
+
+def test_seconds_accepts_milliseconds_and_seconds():
+    assert _seconds(1700000000123) == pytest.approx(1700000000.123)
+    assert _seconds(1700000000) == 1700000000.0
+
+
+def test_clock_offset_is_windowed_minimum():
+    clock = ClockOffset(window=10)
+    assert clock.value is None
+    assert clock.update(1000.0, 1000.5) == 0.5
+    assert clock.update(1001.0, 1001.2) == pytest.approx(0.2)
+    # 较大的偏差(网络抖动)不影响最小值
+    assert clock.update(1002.0, 1004.0) == pytest.approx(0.2)
+    assert clock.update(1005.0, 1005.9) == pytest.approx(0.2)
+    # 最小值样本超出窗口后，取窗口内剩余样本的最小值
+    assert clock.update(1011.0, 1011.5) == pytest.approx(0.5)
+    assert clock.samples == 5
+
+
+def test_clock_jump():
+    clock = ClockOffset(window=10)
+    clock.update(1000.0, 1000.1)
+    # 本地时钟往回校正时新偏差更小，立即生效
+    assert clock.update(1001.0, 951.2) == pytest.approx(-49.8)
+    clock = ClockOffset(window=10)
+    clock.update(1000.0, 1000.1)
+    # 往前跳变超过窗口时，旧的最小值按本地时间过期
+    assert clock.update(1001.0, 1051.1) == pytest.approx(50.1)
+
+
+# 服务端时间戳为毫秒，测试中的时间都相对于 BASE(秒)
+BASE = 1700000000.0
+
+
+def ms(at):
+    return int(round((BASE + at) * 1000))
+
+
+def frame(tracker, server, delay=0.0):
+    tracker.frame(ROOM, ms(server), received=BASE + server + SKEW + delay)
+
+
+def observe(tracker, stage, at, lag, field='create_time'):
+    tracker.observe({'room_id': ROOM, field: ms(at - lag)}, stage, now=BASE + at + SKEW)
+
+
+def test_lag_is_measured_against_server_clock():
+    tracker = LagTracker(threshold=None)
+    # 尚无时钟偏差时不记录
+    observe(tracker, 'decode', 1000, 1.0)
+    assert tracker.observed == 0
+    frame(tracker, 1000.0)
+    frame(tracker, 1001.0, delay=0.5)
+    observe(tracker, 'decode', 1001, 2.0)
+    # 送礼时间(秒)
+    tracker.observe({'room_id': ROOM, 'send_time': int(BASE) + 997, 'create_time': ms(999)}, 'gift',
+                    now=BASE + 1001 + SKEW)
+    tracker.observe({'room_id': ROOM, 'create_time': 0}, 'sink', now=BASE + 1001 + SKEW)
+    snapshot = tracker.snapshot(now=BASE + 1001 + SKEW)[str(ROOM)]
+    assert snapshot['receive']['max'] == pytest.approx(0.5) and snapshot['receive']['count'] == 2
+    assert snapshot['decode']['p50'] == pytest.approx(2.0)
+    assert snapshot['gift']['p50'] == pytest.approx(4.0)
+    assert 'sink' not in snapshot
+    assert tracker.stats()['clock_offset'] == pytest.approx(SKEW)
+
+
+def test_quantiles_use_recent_window():
+    tracker = LagTracker(threshold=None, window=60)
+    frame(tracker, 1000.0)
+    for i in range(100):
+        observe(tracker, 'decode', 1000 + i / 10, i / 10)
+    summary = tracker.snapshot(now=BASE + 1010 + SKEW)[str(ROOM)]['decode']
+    assert (summary['p50'], summary['p90'], summary['max'], summary['count']) == \
+        pytest.approx((4.9, 8.9, 9.9, 100), abs=1e-3)
+    assert tracker.snapshot(now=BASE + 1100 + SKEW) == {}
+
+
+def test_alert_and_recover_with_hysteresis():
+    alerts = []
+    tracker = LagTracker(threshold=5.0, window=0.5, check_interval=1.0, recover_ratio=0.8,
+                         on_alert=lambda *args: alerts.append(args))
+    frame(tracker, 1000.0)
+    observe(tracker, 'sink', 1000, 3.0)
+    observe(tracker, 'sink', 1001, 6.0)
+    # 检查间隔内不重复检查
+    observe(tracker, 'sink', 1001.5, 9.0)
+    assert [(room_id, lagging) for room_id, _, lagging in alerts] == [(str(ROOM), True)]
+    assert alerts[0][1] == pytest.approx(6.0)
+    assert tracker.lagging() == {str(ROOM): pytest.approx(6.0)}
+    # 低于阈值但高于 threshold*recover_ratio 时保持告警
+    observe(tracker, 'sink', 1005, 4.5)
+    assert len(alerts) == 1
+    observe(tracker, 'sink', 1009, 3.0)
+    assert alerts[-1][2] is False and alerts[-1][1] == pytest.approx(3.0)
+    assert tracker.lagging() == {}
+    assert tracker.stats()['alerts'] == 1 and tracker.stats()['lagging'] == 0
+
+
+def test_other_stages_do_not_alert():
+    alerts = []
+    tracker = LagTracker(threshold=1.0, on_alert=lambda *args: alerts.append(args))
+    frame(tracker, 1000.0)
+    observe(tracker, 'decode', 1001, 30.0)
+    assert alerts == [] and tracker.stats()['alerts'] == 0
+
+
+def test_alert_callback_errors_are_ignored():
+    def fail(*args):
+        raise RuntimeError("boom")
+
+    tracker = LagTracker(threshold=1.0, on_alert=fail, alert_stage='receive', alert_quantile='max')
+    frame(tracker, 1000.0)
+    frame(tracker, 1002.0, delay=3.0)
+    assert tracker.stats()['alerts'] == 1 and tracker.lagging() == {str(ROOM): pytest.approx(3.0)}
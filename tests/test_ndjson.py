@@ -0,0 +1,97 @@
+# coding:utf-8
+
+import gzip
+import io
+import json
+import os
+import time
+import zlib
+
+from sinks.ndjson import NDJSONSink, benchmark
+
+
+def chat(i):
+    return {'type': 'chat', 'room_id': 7392091211001140287, 'user_id': i, 'nick_name': f'观众{i}',
+            'content': f'弹幕{i}'}
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_gzip_rotation_renames_complete_files(tmp_path):
+    sink = NDJSONSink(str(tmp_path), compression='gzip', rotate_bytes=2000, batch_size=100, flush_interval=0.05)
+    for i in range(3000):
+        sink.write(chat(i))
+        if i % 500 == 499:
+            sink.flush()
+    sink.close()
+    names = sorted(os.listdir(str(tmp_path)))
+    assert len(names) > 1 and all(name.endswith('.ndjson.gz') for name in names)
+    lines = []
+    for name in names:
+        with gzip.open(os.path.join(str(tmp_path), name), 'rt', encoding='utf-8') as f:
+            lines.extend(f.read().splitlines())
+    assert [json.loads(line)['user_id'] for line in lines] == list(range(3000))
+    assert sink.stats()['files'] == len(names) and sink.stats()['errors'] == 0
+
+
+def test_flushed_part_file_is_readable(tmp_path):
+    sink = NDJSONSink(str(tmp_path), compression='gzip', rotate_bytes=None, rotate_interval=None)
+    for i in range(10):
+        sink.write(chat(i))
+    sink.flush()
+    name, = os.listdir(str(tmp_path))
+    assert name.endswith('.ndjson.gz.part')
+    with open(os.path.join(str(tmp_path), name), 'rb') as f:
+        # 同步刷新后已写入的部分可以解压，尚未结束的gzip流没有尾部
+        text = zlib.decompressobj(31).decompress(f.read()).decode('utf-8')
+    assert len(text.splitlines()) == 10
+    sink.close()
+    assert os.listdir(str(tmp_path)) == [name[:-len('.part')]]
+
+
+def test_stdout(monkeypatch):
+    class Stdout:
+        buffer = io.BytesIO()
+
+    monkeypatch.setattr('sys.stdout', Stdout)
+    sink = NDJSONSink('-', event_types=['chat'])
+    sink.write(chat(1))
+    sink.write({'type': 'like', 'count': 3})
+    sink.close()
+    assert Stdout.buffer.getvalue().decode('utf-8').splitlines() == [json.dumps(chat(1), ensure_ascii=False,
+                                                                                separators=(',', ':'))]
+
+
+def test_full_batch_wakes_writer(tmp_path):
+    sink = NDJSONSink(str(tmp_path), batch_size=10, flush_interval=60)
+    try:
+        for i in range(10):
+            sink.write(chat(i))
+        assert wait_for(lambda: sink.written == 10)
+        # 待写列表已超过 batch_size 时(例如写线程交换列表前又有写入)，后续写入仍会唤醒
+        with sink._lock:
+            sink._pending.extend(chat(i) for i in range(12))
+            sink._queued_seq += 12
+        sink.write(chat(99))
+        assert wait_for(lambda: sink.written == 23)
+    finally:
+        sink.close()
+
+
+def test_pending_limit_drops_newest(tmp_path):
+    sink = NDJSONSink(str(tmp_path), batch_size=1000, flush_interval=60, max_pending=5)
+    for i in range(8):
+        sink.write(chat(i))
+    assert sink.stats()['dropped'] == 3
+    sink.close()
+    assert sink.written == 5
+
+
+def test_benchmark_uses_shared_sample():
+    rate, size, stats = benchmark(200)
+    assert rate > 0 and size > 0 and stats['written'] == 200
@@ -0,0 +1,94 @@
+# coding:utf-8
+
+import os
+import time
+
+import pytest
+
+pytest.importorskip('pyarrow')
+
+from sinks.parquet import ParquetArchiveSink, read_archive
+
+ROOMS = (7392091211001140287, 7392091211001140288)
+
+
+def chat(room_id, msg_id, create_time):
+    return {'type': 'chat', 'room_id': room_id, 'msg_id': msg_id, 'create_time': create_time,
+            'user_id': 1000 + msg_id, 'nick_name': f'观众{msg_id}', 'content': f'弹幕{msg_id}'}
+
+
+@pytest.fixture
+def archive(tmp_path):
+    now = int(time.time() * 1000)
+    sink = ParquetArchiveSink(str(tmp_path), event_types=['chat'])
+    for i in range(10):
+        sink.write(chat(ROOMS[i % 2], i + 1, now - (i // 5) * 3600 * 1000))
+    sink.close()
+    return str(tmp_path), now
+
+
+def test_filter_by_realistic_room_id(archive):
+    root, _ = archive
+    table = read_archive(root, 'chat', columns=['msg_id', 'room_id'], room_ids=[str(ROOMS[0])])
+    assert sorted(table.column('msg_id').to_pylist()) == [1, 3, 5, 7, 9]
+    assert set(table.column('room_id').to_pylist()) == {ROOMS[0]}
+
+
+def test_filter_by_hour(archive):
+    root, now = archive
+    hour = time.strftime('%Y%m%d%H', time.localtime(now / 1000))
+    table = read_archive(root, 'chat', columns=['msg_id'], room_ids=ROOMS, hours=[hour])
+    assert sorted(table.column('msg_id').to_pylist()) == [1, 2, 3, 4, 5]
+
+
+def test_read_all_columns(archive):
+    root, _ = archive
+    table = read_archive(root, 'chat')
+    assert table.num_rows == 10
+    assert table.column('nick_name').to_pylist()[0].startswith('观众')
+
+
+def parts(root):
+    return sorted(name for directory, _, names in os.walk(root) for name in names if name.endswith('.parquet'))
+
+
+def test_alternating_hours_keep_one_file_per_partition(tmp_path):
+    hour = (int(time.time()) // 3600 - 5) * 3600 * 1000
+    sink = ParquetArchiveSink(str(tmp_path), event_types=['chat'], grace=60)
+    # 小时交界处两个小时的事件交替到达，都在宽限期内，不应各自写出小文件
+    for i in range(20):
+        sink.write(chat(ROOMS[0], i + 1, hour - 1000 + (i % 2) * 2000))
+        sink._rotated = 0
+    assert parts(str(tmp_path)) == [] and sink.stats()['partitions'] == 2
+    # 事件时间越过宽限期后，上一个小时的分区写出
+    sink.write(chat(ROOMS[0], 99, hour + 61 * 1000))
+    sink.flush()
+    assert sink.stats()['files_written'] == 2
+    assert sink.stats()['partitions'] == 0 and len(parts(str(tmp_path))) == 2
+    sink.close()
+    assert read_archive(str(tmp_path), 'chat').num_rows == 21
+
+
+def test_closed_hour_is_written_after_grace(tmp_path):
+    hour = (int(time.time()) // 3600 - 5) * 3600 * 1000
+    sink = ParquetArchiveSink(str(tmp_path), event_types=['chat'], grace=60)
+    sink.write(chat(ROOMS[0], 1, hour - 1000))
+    sink._rotated = 0
+    sink.write(chat(ROOMS[0], 2, hour + 61 * 1000))
+    assert sink.stats()['partitions'] == 1
+    sink.close()
+    assert sink.stats()['files_written'] == 2
+
+
+def test_failed_write_is_logged_and_counted(tmp_path):
+    logs = []
+    blocker = tmp_path / 'file'
+    blocker.write_text('')
+    # 根目录是普通文件，创建分区目录失败
+    sink = ParquetArchiveSink(str(blocker), event_types=['chat'], log_callback=lambda *args: logs.append(args))
+    for i in range(3):
+        sink.write(chat(ROOMS[0], i + 1, int(time.time() * 1000)))
+    sink.close()
+    assert sink.stats()['errors'] == 1 and sink.stats()['rows_failed'] == 3
+    assert sink.stats()['rows_written'] == 0
+    assert logs[0][0] == 'ERROR' and 'room_id=' in logs[0][1]
@@ -0,0 +1,39 @@
+# coding:utf-8
+
+import importlib
+
+import pytest
+
+import protobuf
+
+
+def test_douyin_module_shares_lazy_classes():
+    douyin = importlib.import_module('protobuf.douyin')
+    assert douyin is protobuf.douyin
+    from protobuf.douyin import ChatMessage, Response
+    assert ChatMessage is protobuf.ChatMessage
+    assert Response is protobuf.load('Response')
+    assert ChatMessage.__module__ == 'protobuf.douyin'
+    assert 'RoomStatsMessage' in dir(douyin)
+
+
+def test_forward_references_resolve_without_private_overrides():
+    from protobuf.douyin import ChatMessage, Common, Message, Response, User
+    for cls in (Response, Message, ChatMessage, User):
+        assert '_type_hints' not in cls.__dict__
+    chat = ChatMessage(common=Common(room_id=7392091211001140287, msg_id=1), user=User(id=42, nick_name="u"),
+                       content="hi")
+    response = Response(messages_list=[Message(method='WebcastChatMessage', payload=bytes(chat))],
+                        cursor='t-1_r-2')
+    decoded = Response().parse(bytes(response))
+    assert isinstance(decoded.messages_list[0], Message)
+    decoded_chat = ChatMessage().parse(decoded.messages_list[0].payload)
+    assert isinstance(decoded_chat.user, User)
+    assert (decoded_chat.common.room_id, decoded_chat.user.nick_name, decoded_chat.content) == \
+        (7392091211001140287, "u", "hi")
+
+
+def test_unknown_name_raises_attribute_error():
+    for module in (protobuf, protobuf.douyin):
+        with pytest.raises(AttributeError):
+            module.NoSuchMessage
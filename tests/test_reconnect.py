@@ -0,0 +1,119 @@
+# coding:utf-8
+
+import gzip
+
+import pytest
+
+from heartbeat import get_scheduler
+from liveMan import DouyinLiveWebFetcher
+from protobuf import PushFrame, Response
+
+
+class FakeWebSocket:
+    sock = None
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, data, opcode=None):
+        self.sent.append(data)
+
+    def close(self):
+        pass
+
+
+def make_fetcher(**kwargs):
+    fetcher = DouyinLiveWebFetcher('123456', lambda *_: None, dedup=False, **kwargs)
+    fetcher.restore_checkpoint({'live_id': '123456', 'room_id': '7392091211001140287', 'cursor': '',
+                                'internal_ext': '', 'live_cursor': ''})
+    return fetcher
+
+
+def frame(**fields):
+    payload = gzip.compress(bytes(Response(**fields)))
+    return bytes(PushFrame(log_id=1, payload_type='msg', payload=payload))
+
+
+@pytest.fixture(autouse=True)
+def unregister():
+    fetchers = []
+    yield fetchers
+    for fetcher in fetchers:
+        get_scheduler().unregister(fetcher)
+
+
+def test_backoff_is_full_jitter_and_capped():
+    fetcher = make_fetcher()
+    fetcher.reconnect_base_delay = 1.0
+    fetcher.reconnect_max_delay = 8.0
+    for attempt in range(1, 12):
+        ceiling = min(8.0, 2.0 ** (attempt - 1))
+        delay = fetcher._nextReconnectDelay()
+        assert 0.5 <= delay <= max(ceiling, 1.0)
+    assert fetcher.get_reconnect_stats()['pending_attempts'] == 11
+
+
+def test_cursor_from_last_frame_is_used_on_reconnect():
+    fetcher = make_fetcher()
+    assert 'fh-7392091211001140287' in fetcher._buildWssUrl()
+
+    fetcher._wsOnMessage(FakeWebSocket(), frame(cursor='t-1721106200000_r-42', now=1721106200000,
+                                                 internal_ext='internal_src:dim|seq:42', live_cursor='lc-42'))
+    url = fetcher._buildWssUrl()
+    assert 'cursor=t-1721106200000_r-42&' in url
+    assert 'internal_ext=internal_src:dim|seq:42&' in url
+    assert fetcher.get_checkpoint()['live_cursor'] == 'lc-42'
+
+    # 空字段不覆盖已有的续传位置
+    fetcher._wsOnMessage(FakeWebSocket(), frame(now=1721106201000))
+    assert fetcher.cursor == 't-1721106200000_r-42'
+
+
+def test_checkpoint_of_other_live_id_is_ignored():
+    fetcher = make_fetcher()
+    fetcher.restore_checkpoint({'live_id': 'other', 'room_id': '1', 'cursor': 'x', 'internal_ext': 'y',
+                                'live_cursor': 'z'})
+    assert fetcher.room_id == '7392091211001140287'
+    assert fetcher.cursor == ''
+
+
+def test_start_reconnects_until_stopped(monkeypatch):
+    fetcher = make_fetcher()
+    fetcher.reconnect_base_delay = 0.001
+    fetcher.reconnect_max_delay = 0.002
+    attempts = []
+
+    def connect():
+        attempts.append(fetcher.running)
+        if len(attempts) == 3:
+            fetcher.stop()
+
+    monkeypatch.setattr(fetcher, '_connectWebSocket', connect)
+    fetcher.start()
+    assert attempts == [True, True, True]
+    assert not fetcher.running
+
+
+def test_no_reconnect_when_disabled(monkeypatch):
+    fetcher = make_fetcher(auto_reconnect=False)
+    attempts = []
+    monkeypatch.setattr(fetcher, '_connectWebSocket', lambda: attempts.append(1))
+    fetcher.start()
+    assert attempts == [1]
+
+
+def test_gap_is_measured_between_close_and_reopen(unregister):
+    fetcher = make_fetcher()
+    unregister.append(fetcher)
+    ws = FakeWebSocket()
+    fetcher._wsOnOpen(ws)
+    assert fetcher.get_reconnect_stats()['reconnect_count'] == 0
+    fetcher._wsOnClose(ws)
+    assert fetcher.get_reconnect_stats()['disconnected']
+    fetcher._nextReconnectDelay()
+    fetcher._wsOnOpen(ws)
+    stats = fetcher.get_reconnect_stats()
+    assert stats['reconnect_count'] == 1
+    assert stats['pending_attempts'] == 0
+    assert not stats['disconnected']
+    assert 0 <= stats['last_gap'] < 5
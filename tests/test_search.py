@@ -0,0 +1,78 @@
+# coding:utf-8
+
+import pytest
+
+from sinks.search import ChatSearchIndex, match_query, search, tokenize
+
+ROOM = 7392091211001140287
+
+
+def chat(i, content, user_id=1, nick_name='观众', room_id=ROOM):
+    return {'type': 'chat', 'room_id': room_id, 'msg_id': i, 'create_time': 1700000000000 + i * 1000,
+            'user_id': user_id, 'nick_name': nick_name, 'content': content}
+
+
+@pytest.mark.parametrize('text, tokens', [
+    ("主播好漂亮", "主播 播好 好漂 漂亮 亮"),
+    ("Hi主播，好!", "hi 主播 播 好"),
+    ("666 OK", "666 ok"),
+    ("！？", ""),
+    (None, ""),
+])
+def test_tokenize(text, tokens):
+    assert tokenize(text) == tokens
+
+
+@pytest.mark.parametrize('keyword, query', [
+    ("漂亮", '"漂亮"'),
+    ("好漂亮", '"好漂 漂亮"'),
+    # 单字用前缀匹配，可以命中二元组的开头
+    ("好", '"好"*'),
+    ("主播 666", '"主播" AND "666"'),
+    ("Hello好", '"hello 好"*'),
+    ("！！", ""),
+    ("  ", ""),
+])
+def test_match_query(keyword, query):
+    assert match_query(keyword) == query
+
+
+@pytest.fixture
+def index(tmp_path):
+    sink = ChatSearchIndex(str(tmp_path / 'search.db'), flush_interval=60)
+    sink.write(chat(1, "主播好漂亮"))
+    sink.write(chat(2, "今天的歌好听", user_id=2, nick_name='小明'))
+    sink.write(chat(3, "漂亮！666", room_id=ROOM + 1))
+    sink.write({'type': 'emoji_chat', 'room_id': ROOM, 'msg_id': 4, 'create_time': 1700000004000,
+                'user_id': 3, 'nick_name': '路人', 'emoji_id': 1, 'content': '[比心]'})
+    sink.write({'type': 'like', 'room_id': ROOM, 'count': 3})
+    sink.flush()
+    yield sink
+    sink.close()
+
+
+def contents(rows):
+    return [row['content'] for row in rows]
+
+
+def test_keyword_search_newest_first(index):
+    assert contents(index.search("漂亮")) == ["漂亮！666", "主播好漂亮"]
+    assert contents(index.search("好")) == ["今天的歌好听", "主播好漂亮"]
+    assert contents(index.search("主播 漂亮")) == ["主播好漂亮"]
+    assert contents(index.search("比心")) == ["[比心]"]
+    assert index.stats()['written'] == 4
+
+
+def test_filters(index):
+    assert contents(index.search("漂亮", room_id=ROOM)) == ["主播好漂亮"]
+    assert contents(index.search(user_id=2)) == ["今天的歌好听"]
+    assert contents(index.search(nick_name="小")) == ["今天的歌好听"]
+    assert contents(index.search(start=1700000002000, end=1700000003000)) == ["漂亮！666", "今天的歌好听"]
+    assert contents(index.search(limit=1)) == ["[比心]"]
+
+
+def test_unsearchable_keyword_matches_nothing(index):
+    # 只有标点的关键词不能退化成返回全部弹幕
+    assert index.search("！！") == []
+    assert index.search(nick_name="...") == []
+    assert search(index.path, "！", room_id=ROOM) == []
@@ -0,0 +1,121 @@
+# coding:utf-8
+
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+from analytics.sessions import SessionTracker
+from headless import serve_queries
+from instrument import Instrumentation
+from stages.coalesce import Coalescer
+
+ROOM = 7392091211001140287
+
+
+def event(event_type, user_id, **fields):
+    return dict({'type': event_type, 'room_id': ROOM, 'user_id': user_id, 'nick_name': f'u{user_id}'}, **fields)
+
+
+def like(user_id, count):
+    return event('like', user_id, count=count, msg_id=user_id, create_time=1000)
+
+
+def test_dwell_and_sessions():
+    tracker = SessionTracker(idle_timeout=60, ttl=3600)
+    tracker.write(event('member', 1), now=1000)
+    tracker.write(event('chat', 1, content='hi'), now=1030)
+    tracker.write(event('chat', 1, content='hi'), now=1050)
+    # 超过 idle_timeout 后再出现算第二次停留
+    tracker.write(event('chat', 1, content='back'), now=1200)
+    tracker.write(event('chat', 1, content='bye'), now=1210)
+    viewer = tracker.viewer(ROOM, 1)
+    assert viewer['sessions'] == 2
+    assert viewer['dwell'] == 50 + 10
+    assert viewer['chats'] == 4
+
+
+def test_likes_counted_when_tracker_runs_before_coalescer():
+    tracker = SessionTracker()
+    coalescer = Coalescer(like_window=1.0)
+    out = []
+    for user_id, count in ((1, 5), (2, 3), (1, 7)):
+        passed = tracker.process(like(user_id, count))
+        assert passed == [like(user_id, count)]
+        out.extend(coalescer.process(passed[0], now=1000))
+    out.extend(coalescer.flush())
+    assert [item['type'] for item in out] == ['like_summary']
+    assert out[0]['count'] == 15
+    assert tracker.viewer(ROOM, 1)['likes'] == 12
+    assert tracker.viewer(ROOM, 2)['likes'] == 3
+
+
+def test_like_summary_has_no_per_user_likes():
+    """作为合并之后的sink时，汇总中的用户只记录活跃，点赞数不计入"""
+    coalescer = Coalescer(like_window=1.0)
+    for user_id, count in ((1, 5), (2, 3)):
+        coalescer.process(like(user_id, count), now=1000)
+    summary, = coalescer.flush()
+    tracker = SessionTracker()
+    tracker.write(summary, now=1001)
+    assert tracker.viewer(ROOM, 1)['likes'] == 0
+    assert tracker.viewer(ROOM, 2)['likes'] == 0
+    assert tracker.viewer(ROOM, 2)['last_seen'] == 1001
+
+
+def test_eviction_bounds_memory():
+    tracker = SessionTracker(ttl=100, max_viewers=3)
+    for user_id in range(1, 6):
+        tracker.write(event('member', user_id), now=1000 + user_id)
+    assert sorted(tracker.room(ROOM).viewers) == [3, 4, 5]
+    tracker.write(event('member', 9), now=1200)
+    assert list(tracker.room(ROOM).viewers) == [9]
+    assert tracker.stats()[ROOM]['evicted'] == 5
+
+
+def test_gift_combo_counts_increment_only():
+    tracker = SessionTracker()
+    for combo_count in (1, 2, 3):
+        tracker.write(event('gift', 1, combo=True, combo_count=combo_count, diamond_count=10, group_id=5,
+                            trace_id='', gift_id=1), now=1000)
+    viewer = tracker.viewer(ROOM, 1)
+    assert viewer['diamonds'] == 30
+
+
+def test_state_round_trip():
+    tracker = SessionTracker()
+    tracker.write(event('member', 1), now=1000)
+    tracker.write(like(1, 4), now=1010)
+    tracker.write(event('chat', 2, content='hi'), now=1020)
+    restored = SessionTracker()
+    restored.load_room(ROOM, json.loads(json.dumps(tracker.dump_room(ROOM))))
+    assert restored.viewer(ROOM, 1) == tracker.viewer(ROOM, 1)
+    assert restored.top(ROOM, 'chats', 1) == tracker.top(ROOM, 'chats', 1)
+    assert SessionTracker().dump_room(ROOM) is None
+
+
+def test_top_rejects_unknown_key():
+    with pytest.raises(ValueError):
+        SessionTracker().top(ROOM, 'nick_name')
+
+
+def test_sessions_endpoint():
+    tracker = SessionTracker()
+    tracker.write(like(1, 4), now=1000)
+    tracker.write(like(2, 9), now=1000)
+    instrumentation = Instrumentation()
+    serve_queries(instrumentation, {'sessions': tracker})
+    port = instrumentation.serve(0).server_address[1]
+    base = f"http://127.0.0.1:{port}/sessions?room_id={ROOM}"
+    try:
+        with urllib.request.urlopen(base + "&key=likes&k=1") as response:
+            data = json.loads(response.read())[str(ROOM)]
+        assert [(item['user_id'], item['likes']) for item in data] == [(2, 9)]
+        with urllib.request.urlopen(base + "&user_id=1") as response:
+            assert json.loads(response.read())[str(ROOM)]['likes'] == 4
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(base + "&key=nick_name")
+        assert error.value.code == 400
+    finally:
+        instrumentation.close()
@@ -0,0 +1,73 @@
+# coding:utf-8
+
+import json
+import sqlite3
+
+from sinks.sqlite import SQLiteSink, table_name
+
+ROOM = 7392091211001140287
+
+
+def chat(i):
+    return {'type': 'chat', 'room_id': ROOM, 'msg_id': 1000 + i, 'create_time': 1700000000 + i, 'user_id': i,
+            'nick_name': f'观众{i}', 'content': f'弹幕{i}'}
+
+
+def rows(path, sql):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(sql).fetchall()
+    finally:
+        conn.close()
+
+
+def test_schema_per_event_type(tmp_path):
+    path = str(tmp_path / 'events.db')
+    sink = SQLiteSink(path, event_types=['chat', 'gift'])
+    sink.flush()
+    tables = {name for name, in rows(path, "SELECT name FROM sqlite_master WHERE type='table'")}
+    assert tables == {table_name('chat'), table_name('gift')}
+    columns = rows(path, f"PRAGMA table_info({table_name('gift')})")
+    types = {name: kind for _, name, kind, *_ in columns}
+    assert list(types)[:3] == ['room_id', 'msg_id', 'create_time']
+    # uint64字段不声明类型，其余按字段类型
+    assert (types['room_id'], types['combo'], types['gift_name'], types['diamond_count']) == \
+        ('', 'INTEGER', 'TEXT', 'INTEGER')
+    assert rows(path, "PRAGMA journal_mode") == [('wal',)]
+    sink.close()
+
+
+def test_round_trip_through_writer_thread(tmp_path):
+    path = str(tmp_path / 'events.db')
+    sink = SQLiteSink(path, batch_size=7, flush_interval=60, event_types=['chat', 'rank', 'gift'])
+    for i in range(20):
+        sink.write(chat(i))
+    sink.write({'type': 'like', 'room_id': ROOM, 'count': 3})
+    sink.write({'type': 'rank', 'room_id': ROOM, 'ranks': [[1, 'a'], [2, 'b']]})
+    sink.write({'type': 'gift', 'room_id': ROOM, 'group_id': 2 ** 64 - 1, 'combo': True})
+    # flush 等待已入队事件提交，不必等 flush_interval
+    sink.flush()
+    assert sink.stats()['written'] == 22 and sink.stats()['queue_depth'] == 0
+    assert rows(path, f"SELECT user_id, nick_name, content FROM {table_name('chat')} ORDER BY user_id") == \
+        [(i, f'观众{i}', f'弹幕{i}') for i in range(20)]
+    ranks, = rows(path, f"SELECT ranks FROM {table_name('rank')}")
+    assert json.loads(ranks[0]) == [[1, 'a'], [2, 'b']]
+    # 超出有符号64位的uint64以文本保存
+    assert rows(path, f"SELECT group_id, combo FROM {table_name('gift')}") == [(str(2 ** 64 - 1), 1)]
+    assert rows(path, f"SELECT typeof(room_id) FROM {table_name('gift')}") == [('integer',)]
+    sink.close()
+    assert sink.stats()['errors'] == 0
+
+
+def test_close_commits_pending_and_ignores_later_writes(tmp_path):
+    path = str(tmp_path / 'events.db')
+    sink = SQLiteSink(path, batch_size=1000, flush_interval=60, event_types=['chat'])
+    for i in range(5):
+        sink.write(chat(i))
+    sink.close()
+    sink.write(chat(99))
+    sink.flush()
+    sink.close()
+    assert rows(path, f"SELECT COUNT(*) FROM {table_name('chat')}") == [(5,)]
+    assert sink.written == 5 and sink.batches == 1
+
@@ -0,0 +1,79 @@
+# coding:utf-8
+
+import json
+import random
+import urllib.request
+from collections import Counter
+
+from analytics.topk import SpaceSaving, TopKTracker
+from headless import serve_queries
+from instrument import Instrumentation
+
+
+def zipf_stream(count, users, seed=0):
+    rand = random.Random(seed)
+    weights = [1 / (rank ** 1.2) for rank in range(1, users + 1)]
+    return rand.choices(range(users), weights, k=count)
+
+
+def test_exact_below_capacity():
+    summary = SpaceSaving(capacity=10)
+    for key, weight in (('a', 5), ('b', 3), ('a', 1), ('c', 2)):
+        summary.add(key, weight)
+    assert summary.top(3) == [('a', 6, 0), ('b', 3, 0), ('c', 2, 0)]
+
+
+def test_error_bounds_hold_on_skewed_stream():
+    capacity = 100
+    stream = zipf_stream(50000, 5000)
+    truth = Counter(stream)
+    summary = SpaceSaving(capacity)
+    for key in stream:
+        summary.add(key)
+    assert len(summary) == capacity
+    bound = summary.error_bound()
+    assert bound == len(stream) / capacity
+    for key, score, error in summary.top(capacity):
+        # 真实值 <= 估计值 <= 真实值 + error，且 error <= N/capacity
+        assert truth[key] <= score <= truth[key] + error
+        assert error <= bound
+    # 真实值超过 N/capacity 的用户一定在榜单中
+    tracked = {key for key, _, _ in summary.top(capacity)}
+    assert {key for key, count in truth.items() if count > bound} <= tracked
+    # 长尾分布下前10名与真实排名一致
+    assert [key for key, _, _ in summary.top(10)] == [key for key, _ in truth.most_common(10)]
+
+
+def test_state_round_trip_keeps_top():
+    summary = SpaceSaving(50)
+    for key in zipf_stream(5000, 500, seed=1):
+        summary.add(key)
+    restored = SpaceSaving(50)
+    restored.load_state(json.loads(json.dumps(summary.to_state())))
+    assert restored.top(10) == summary.top(10)
+    assert restored.total == summary.total
+
+
+def gift(room_id, user_id, diamonds):
+    return {'type': 'gift', 'room_id': room_id, 'user_id': user_id, 'nick_name': f'u{user_id}', 'combo': False,
+            'combo_count': 1, 'diamond_count': diamonds, 'group_id': 0, 'trace_id': '', 'gift_id': 1}
+
+
+def test_top_endpoint():
+    tracker = TopKTracker(capacity=10)
+    for user_id, diamonds in ((1, 10), (2, 300), (3, 20)):
+        tracker.write(gift(7392091211001140287, user_id, diamonds))
+    tracker.write({'type': 'chat', 'room_id': 7392091211001140287, 'user_id': 3, 'nick_name': 'u3'})
+    instrumentation = Instrumentation()
+    serve_queries(instrumentation, {'topk': tracker})
+    port = instrumentation.serve(0).server_address[1]
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/top?room_id=7392091211001140287&k=2") as response:
+            data = json.loads(response.read())['7392091211001140287']
+        assert [(item['user_id'], item['score']) for item in data['top']] == [(2, 300), (3, 20)]
+        assert data['top'][0]['nick_name'] == 'u2'
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/top?board=chatters") as response:
+            data = json.loads(response.read())['7392091211001140287']
+        assert [item['user_id'] for item in data['top']] == [3]
+    finally:
+        instrumentation.close()
@@ -0,0 +1,83 @@
+# coding:utf-8
+
+import json
+import os
+import threading
+
+import tracing
+from tracing import Tracer
+
+
+def spans(total=0.001, start=10.0):
+    return [('frame_total', '', start, start + total),
+            ('decompress', '', start, start + 0.0002),
+            ('dispatch', 'WebcastChatMessage', start + 0.0002, start + 0.0006)]
+
+
+def traces(directory):
+    names = sorted(name for name in os.listdir(directory) if name.endswith('.json'))
+    result = []
+    for name in names:
+        with open(os.path.join(directory, name), encoding='utf-8') as f:
+            result.append(json.load(f))
+    return result
+
+
+def test_sampling(tmp_path, monkeypatch):
+    tracer = Tracer(str(tmp_path), sample_rate=0.25, slow_threshold=0.2)
+    draws = iter([0.1, 0.3, 0.9])
+    monkeypatch.setattr(tracing.random, 'random', lambda: next(draws))
+    assert tracer.add_frame(spans(), 1) is True
+    assert tracer.add_frame(spans(), 1) is False
+    # 慢帧和指定保留的帧不经采样
+    assert tracer.add_frame(spans(total=0.5), 1) is True
+    assert tracer.add_frame(spans(), 1, keep=True) is True
+    assert tracer.add_frame([], 1) is False
+    stats = tracer.stats()
+    assert (stats['frames'], stats['kept'], stats['slow']) == (5, 3, 1)
+    tracer.close()
+
+
+def test_slow_threshold_none_only_samples(tmp_path):
+    tracer = Tracer(str(tmp_path), sample_rate=0.0, slow_threshold=None)
+    assert tracer.add_frame(spans(total=10), 1) is False
+    tracer.close()
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_chrome_trace_format(tmp_path):
+    tracer = Tracer(str(tmp_path), sample_rate=1.0, slow_threshold=0.2)
+    tracer.add_frame(spans(), 7)
+    tracer.add_frame(spans(total=0.3, start=11.0), 7)
+    tracer.close()
+    trace, = traces(str(tmp_path))
+    assert trace['displayTimeUnit'] == 'ms'
+    events = trace['traceEvents']
+    # 每个线程一条名称元数据
+    thread = threading.current_thread()
+    assert events[0] == {'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': thread.ident,
+                         'args': {'name': thread.name}}
+    complete = events[1:]
+    assert len(complete) == 6 and all(event['ph'] == 'X' and event['tid'] == thread.ident for event in complete)
+    frame, decompress, dispatch = complete[:3]
+    assert (frame['name'], frame['cat']) == ('frame_total', 'frame')
+    assert (dispatch['name'], dispatch['cat']) == ('dispatch WebcastChatMessage', 'dispatch')
+    assert dispatch['args'] == {'room_id': 7, 'method': 'WebcastChatMessage'}
+    # 时间单位为微秒
+    assert frame['ts'] == 10.0 * 1e6 and abs(frame['dur'] - 1000) < 1e-6
+    assert abs(dispatch['ts'] - frame['ts'] - 200) < 1e-3 and abs(decompress['dur'] - 200) < 1e-3
+    assert 'slow' not in frame['args'] and complete[3]['args']['slow'] is True
+
+
+def test_full_buffer_writes_file_and_old_files_are_removed(tmp_path):
+    tracer = Tracer(str(tmp_path), sample_rate=1.0, max_events=7, max_files=2)
+    # 线程名称元数据+3个span，第2、4帧后写满
+    for _ in range(5):
+        tracer.add_frame(spans(), 1)
+    assert tracer.stats()['buffered_events'] == 4 and tracer.stats()['files_written'] == 2
+    tracer.close()
+    files = traces(str(tmp_path))
+    assert tracer.stats()['files_written'] == 3 and len(files) == 2
+    # 新文件重新写线程名称元数据
+    assert all(trace['traceEvents'][0]['ph'] == 'M' for trace in files)
+    assert not [name for name in os.listdir(str(tmp_path)) if name.endswith('.tmp')]
@@ -0,0 +1,60 @@
+# coding:utf-8
+
+import users
+from protobuf.douyin import FansClub, FansClubData, PayGrade, User
+from users import UserCache, get_user_cache
+
+
+def user(user_id, nick_name=None, level=1):
+    return User(id=user_id, nick_name=nick_name or f'观众{user_id}', display_id=f'dy{user_id}', gender=2,
+                pay_grade=PayGrade(level=level), fans_club=FansClub(data=FansClubData(level=3)))
+
+
+def test_profile_fields_and_interned_strings():
+    cache = UserCache()
+    # 解码得到的是不同的字符串对象
+    first = cache.profile(User().parse(bytes(user(1))))
+    second = cache.profile(User().parse(bytes(user(1))))
+    assert first is second
+    assert first.to_dict() == {'id': 1, 'nick_name': '观众1', 'display_id': 'dy1', 'gender': 2, 'pay_level': 1,
+                               'fans_club_level': 3}
+    assert cache.get(1) is first and cache.get(2) is None
+
+
+def test_hit_miss_stats():
+    cache = UserCache()
+    for user_id in (1, 2, 1, 1, 3):
+        cache.profile(user(user_id))
+    stats = cache.stats()
+    assert (stats['size'], stats['hits'], stats['misses'], stats['evictions']) == (3, 2, 3, 0)
+    assert stats['hit_rate'] == 0.4 and stats['bytes_saved'] > 0
+    assert UserCache().stats()['hit_rate'] == 0.0
+
+
+def test_changed_profile_is_replaced():
+    cache = UserCache()
+    old = cache.profile(user(1))
+    renamed = cache.profile(user(1, nick_name='改名了'))
+    assert renamed is not old and renamed.nick_name == '改名了'
+    upgraded = cache.profile(user(1, nick_name='改名了', level=20))
+    assert upgraded.pay_level == 20
+    assert cache.stats()['misses'] == 3 and len(cache) == 1
+
+
+def test_lru_eviction():
+    cache = UserCache(max_size=3)
+    for user_id in (1, 2, 3):
+        cache.profile(user(user_id))
+    # 访问1后，最久未使用的是2
+    cache.profile(user(1))
+    cache.profile(user(4))
+    assert cache.get(2) is None
+    assert [cache.get(user_id) is not None for user_id in (1, 3, 4)] == [True, True, True]
+    cache.profile(user(5))
+    assert cache.get(3) is None
+    assert len(cache) == 3 and cache.stats()['evictions'] == 2
+
+
+def test_process_wide_cache(monkeypatch):
+    monkeypatch.setattr(users, '_cache', None)
+    assert get_user_cache() is get_user_cache()
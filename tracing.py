@@ -0,0 +1,158 @@
+# coding:utf-8
+
+"""
+帧级追踪，导出Chrome trace-event JSON(可用 https://ui.perfetto.dev 或 chrome://tracing 打开)
+
+    tracer = Tracer("traces", sample_rate=0.01, slow_threshold=0.2)
+    fetcher = DouyinLiveWebFetcher(live_id, tracer=tracer)
+
+每个websocket帧记录一组span(带线程ID)，名称与 instrument 的环节一致:
+    frame_total 整帧处理
+    frame       收到的 PushFrame 解析
+    decompress  gzip 解压
+    response    Response 解析
+    ack         ACK 发送
+    dispatch    单条消息的解码与处理(名称带消息类型)
+    log         日志回调(图形界面下即界面渲染)
+    sink        写入sink
+    flush       sink刷新
+按 sample_rate 随机采样整帧；未被采样但耗时超过 slow_threshold 的帧也会完整保留，
+偶发的卡顿不会因为采样而漏掉。未保留的帧只有少量计时开销，可以在生产环境常开。
+事件写满 max_events 或调用 flush() 时在后台线程写出一个文件，最多保留 max_files 个。
+"""
+
+import json
+import os
+import random
+import threading
+import time
+
+# span名称 -> 类别
+CATEGORIES = {
+    'frame_total': 'frame',
+    'frame': 'receive',
+    'decompress': 'decompress',
+    'response': 'decode',
+    'ack': 'ack',
+    'dispatch': 'dispatch',
+    'log': 'render',
+    'sink': 'sink',
+    'flush': 'sink',
+}
+
+
+class Tracer:
+
+    def __init__(self, directory='traces', sample_rate=0.01, slow_threshold=0.2, max_events=200000,
+                 max_files=20):
+        """
+        :param directory: trace文件目录
+        :param sample_rate: 随机采样的帧比例
+        :param slow_threshold: 耗时超过该值(秒)的帧总是保留，None表示不按耗时保留
+        :param max_events: 单个文件最多的事件数
+        :param max_files: 最多保留的文件数，超出时删除最早的
+        """
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.max_events = max_events
+        self.max_files = max_files
+        self.pid = os.getpid()
+        self.frames = 0
+        self.kept = 0
+        self.slow = 0
+        self.files_written = 0
+        self._events = []
+        self._threads = set()
+        self._lock = threading.Lock()
+        self._writers = []
+        os.makedirs(directory, exist_ok=True)
+
+    def add_frame(self, spans, room_id, keep=False):
+        """
+        :param spans: [(名称, 消息类型, 开始, 结束), ...]，时间为 time.perf_counter()，第一个为整帧
+        :param keep: 不经采样直接保留
+        :return: 是否保留
+        """
+        self.frames += 1
+        if not spans:
+            return False
+        duration = spans[0][3] - spans[0][2]
+        slow = self.slow_threshold is not None and duration >= self.slow_threshold
+        if not keep and not slow and random.random() >= self.sample_rate:
+            return False
+        thread = threading.current_thread()
+        tid = thread.ident
+        events = []
+        for name, method, start, end in spans:
+            args = {'room_id': room_id}
+            if method:
+                args['method'] = method
+            events.append({
+                'name': f"{name} {method}" if method else name,
+                'cat': CATEGORIES.get(name, name),
+                'ph': 'X',
+                'ts': start * 1e6,
+                'dur': (end - start) * 1e6,
+                'pid': self.pid,
+                'tid': tid,
+                'args': args,
+            })
+        if slow:
+            events[0]['args']['slow'] = True
+        with self._lock:
+            if tid not in self._threads:
+                self._threads.add(tid)
+                self._events.append({'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid,
+                                     'args': {'name': thread.name}})
+            self._events.extend(events)
+            self.kept += 1
+            self.slow += slow
+            if len(self._events) >= self.max_events:
+                self._write()
+        return True
+
+    def flush(self):
+        """把已记录的事件写成一个文件"""
+        with self._lock:
+            if self._events:
+                self._write()
+
+    def _write(self):
+        events, self._events = self._events, []
+        self._threads = set()
+        path = os.path.join(self.directory, time.strftime('trace-%Y%m%d-%H%M%S')
+                            + f'-{self.files_written:04d}.json')
+        self.files_written += 1
+        writer = threading.Thread(target=self._dump, args=(path, events), name="trace-writer")
+        writer.daemon = True
+        writer.start()
+        self._writers = [thread for thread in self._writers if thread.is_alive()] + [writer]
+
+    def _dump(self, path, events):
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, ensure_ascii=False,
+                      separators=(',', ':'))
+        os.replace(tmp, path)
+        files = sorted(name for name in os.listdir(self.directory)
+                       if name.startswith('trace-') and name.endswith('.json'))
+        for name in files[:-self.max_files]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def close(self):
+        self.flush()
+        for writer in self._writers:
+            writer.join()
+
+    def stats(self):
+        return {
+            'frames': self.frames,
+            'kept': self.kept,
+            'slow': self.slow,
+            'buffered_events': len(self._events),
+            'files_written': self.files_written,
+        }
@@ -0,0 +1,98 @@
+# coding:utf-8
+
+"""
+进程级用户缓存
+
+聊天、礼物、点赞、进场、关注消息都携带完整的User(头像、勋章等)。
+解析事件时只按 User.id 取一份紧凑的 UserProfile，昵称等字符串经过 sys.intern，
+同一用户的所有事件和统计状态共用同一份字符串，事件与sink只保存 user_id 和昵称，
+需要其他资料时通过 get_user_cache().get(user_id) 查询。
+"""
+
+import sys
+import threading
+from collections import OrderedDict
+
+
+class UserProfile:
+    __slots__ = ('id', 'nick_name', 'display_id', 'gender', 'pay_level', 'fans_club_level')
+
+    def __init__(self, user):
+        self.id = user.id
+        self.nick_name = sys.intern(user.nick_name)
+        self.display_id = sys.intern(user.display_id)
+        self.gender = user.gender
+        self.pay_level = user.pay_grade.level
+        self.fans_club_level = user.fans_club.data.level
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+
+class UserCache:
+
+    def __init__(self, max_size=100000):
+        """
+        :param max_size: 最多缓存的用户数，超出时按LRU淘汰
+        """
+        self.max_size = max_size
+        self._profiles = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_saved = 0
+
+    def profile(self, user):
+        """
+        取用户的紧凑资料，昵称等有变化时更新
+        :param user: 解析得到的 User 对象
+        """
+        with self._lock:
+            profile = self._profiles.get(user.id)
+            if profile is not None and profile.nick_name == user.nick_name \
+                    and profile.pay_level == user.pay_grade.level:
+                self._profiles.move_to_end(user.id)
+                self.hits += 1
+                # 命中时事件引用缓存中的字符串，解码出的新字符串随User对象一起释放
+                self.bytes_saved += sys.getsizeof(user.nick_name) + sys.getsizeof(user.display_id)
+                return profile
+            self.misses += 1
+            profile = self._profiles[user.id] = UserProfile(user)
+            self._profiles.move_to_end(user.id)
+            if len(self._profiles) > self.max_size:
+                self._profiles.popitem(last=False)
+                self.evictions += 1
+            return profile
+
+    def get(self, user_id):
+        """:return: UserProfile，不在缓存中时为None"""
+        return self._profiles.get(user_id)
+
+    def __len__(self):
+        return len(self._profiles)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._profiles),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'bytes_saved': self.bytes_saved,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_user_cache():
+    """获取进程内唯一的用户缓存"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = UserCache()
+    return _cache